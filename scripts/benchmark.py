@@ -0,0 +1,188 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+import load_batch as lb
+import partitions
+from generate_traffic_counts import generate_dataset
+
+results_dir = os.path.join(project_root, "data", "benchmarks")
+
+class NullSink:
+    """Runs the client-side encoding of each writer but sends nothing to a database"""
+    name = "null"
+    # execute_values needs a live cursor to build its pages, so only df_to_tuples is measured
+    bulk_insert = None
+
+    def copy_insert(self, df: pd.DataFrame, copy_format: str) -> int:
+        chunks = lb._copy_binary_chunks if copy_format == "binary" else lb._copy_text_chunks
+        return sum(n for n, _ in chunks(df, lb.copy_chunk_size, "benchmark"))
+
+    def close(self):
+        pass
+
+class PostgresSink:
+    """Writes into vehicles_batch through the real loaders, then rolls back so the table is unchanged"""
+    name = "postgres"
+
+    def __init__(self):
+        from db import get_connection
+        self.conn = get_connection()
+
+    def _ensure_partitions(self, departure_times):
+        # partitions for the generated dates only exist inside the rolled back transaction
+        if partitions.is_partitioned(self.conn):
+            partitions.PartitionRouter(self.conn).split(pd.DataFrame({"departure_time": departure_times}))
+
+    def bulk_insert(self, rows) -> int:
+        try:
+            self._ensure_partitions([r[2] for r in rows])
+            return lb.bulk_insert(self.conn, rows, "benchmark", commit=False)
+        finally:
+            self.conn.rollback()
+
+    def copy_insert(self, df: pd.DataFrame, copy_format: str) -> int:
+        try:
+            self._ensure_partitions(df["departure_time"])
+            return lb.copy_insert(self.conn, df, copy_format, source_file="benchmark", commit=False)
+        finally:
+            self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+SINKS = {"null": NullSink, "postgres": PostgresSink}
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, stage: str, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        entry = self.stages.setdefault(stage, {"seconds": 0.0, "rows": 0})
+        entry["seconds"] += elapsed
+        entry["rows"] += len(result) if hasattr(result, "__len__") else int(result)
+        return result
+
+    def report(self) -> dict:
+        return {
+            stage: {
+                "seconds": round(v["seconds"], 4),
+                "rows": v["rows"],
+                "rows_per_sec": round(v["rows"] / v["seconds"]) if v["seconds"] > 0 else None,
+            }
+            for stage, v in self.stages.items()
+        }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def benchmark_files(files, sink, copy_format: str, include_values: bool) -> dict:
+    timer = StageTimer()
+    quiet = open(os.devnull, "w")
+    for f in files:
+        raw = timer.run("read_csv", lambda: pd.read_csv(f, dtype=str))
+        stdout, sys.stdout = sys.stdout, quiet  # the transform prints a line per file
+        try:
+            vehicles = timer.run("transform_traffic_count_to_vehicles", lb.transform_traffic_count_to_vehicles, raw, f)
+        finally:
+            sys.stdout = stdout
+        # clean_vehicle_columns is what normalize_dataframe does after the transform
+        df = timer.run("normalize_dataframe", lb.clean_vehicle_columns, vehicles)
+        timer.run(f"copy_insert[{copy_format}]", sink.copy_insert, df, copy_format)
+        if include_values:
+            rows = timer.run("df_to_tuples", lb.df_to_tuples, df)
+            if sink.bulk_insert is not None:
+                timer.run("bulk_insert", sink.bulk_insert, rows)
+    quiet.close()
+    return timer.report()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the load_batch pipeline stages on synthetic SSRN data")
+    parser.add_argument("--stations", type=int, default=152)
+    parser.add_argument("--days", type=int, default=3, help="days per station file (3 matches the real data)")
+    parser.add_argument("--density", type=float, default=1.0, help="multiplier on the measured hourly counts")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="multiply the days per file, e.g. 100 for 100x the real data volume")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="benchmark existing CSV files (e.g. data/batch/ssrn) instead of generating")
+    parser.add_argument("--keep", action="store_true", help="keep the generated files")
+    parser.add_argument("--sink", choices=sorted(SINKS), default="null")
+    parser.add_argument("--copy-format", choices=lb.copy_formats, default="text")
+    parser.add_argument("--skip-values", action="store_true", help="skip df_to_tuples + bulk_insert (slow at large scales)")
+    parser.add_argument("--output", help="result JSON path (default: data/benchmarks/benchmark-<timestamp>.json)")
+    args = parser.parse_args()
+
+    generated_dir = None
+    if args.data_dir:
+        files = sorted(glob.glob(os.path.join(args.data_dir, "**/*.csv"), recursive=True))
+        dataset = {"source": os.path.abspath(args.data_dir)}
+    else:
+        generated_dir = tempfile.mkdtemp(prefix="ssrn-bench-")
+        days = args.days * args.scale
+        print(f"Generating {args.stations} station file(s) x {days} day(s) at density {args.density} in {generated_dir}")
+        generated = generate_dataset(generated_dir, args.stations, days, args.density, args.seed)
+        files = generated["files"]
+        dataset = {k: v for k, v in generated.items() if k != "files"}
+        dataset["scale"] = args.scale
+
+    sink = SINKS[args.sink]()
+    try:
+        start = time.perf_counter()
+        stages = benchmark_files(files, sink, args.copy_format, not args.skip_values)
+        total_seconds = time.perf_counter() - start
+    finally:
+        sink.close()
+        if generated_dir and not args.keep:
+            shutil.rmtree(generated_dir, ignore_errors=True)
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "dataset": dataset,
+        "files": len(files),
+        "sink": sink.name,
+        "copy_format": args.copy_format,
+        "total_seconds": round(total_seconds, 3),
+        "stages": stages,
+    }
+
+    output = args.output or os.path.join(results_dir, f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fh:
+        json.dump(result, fh, indent=2)
+
+    print(f"{'stage':<40}{'seconds':>10}{'rows':>12}{'rows/sec':>12}")
+    for stage, v in stages.items():
+        print(f"{stage:<40}{v['seconds']:>10.2f}{v['rows']:>12}{v['rows_per_sec'] or 0:>12}")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,91 +1,341 @@
 import pandas as pd
 import os
+import sys
 import glob
-from bs4 import BeautifulSoup
-
-def convert_html_to_csv():
-    """Convert HTML files (disguised as .xls) to CSV files"""
-    
-    # Define directories
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    download_dir = os.path.join(project_root, "data", "downloads")
-    batch_dir = os.path.join(project_root, "data", "batch", "ssrn")
-    
+import time
+import hashlib
+import argparse
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+# lxml is optional: without it the stdlib streaming extractor below is used
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+download_dir = os.path.join(project_root, "data", "downloads")
+batch_dir = os.path.join(project_root, "data", "batch", "ssrn")
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+def _clean_cell(fragments: List[str]) -> str:
+    # same text as BeautifulSoup's get_text(strip=True): strip each text node and join them
+    cell_text = "".join(s.strip() for s in fragments)
+    # Replace non-breaking spaces and clean up
+    return cell_text.replace('\xa0', '').replace('&nbsp;', '')
+
+class TableExtractor(HTMLParser):
+    """
+    Streaming extractor for the cells of the first <table> in a document.
+    Only td/th text is kept, so the long style attributes of the SSRN exports are never built into a tree.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[List[str]] = []
+        self.table_depth = 0
+        self.done = False
+        self.row: Optional[List[str]] = None
+        self.cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "table":
+            self.table_depth += 1
+        elif self.table_depth == 0:
+            return
+        elif tag == "tr":
+            self._end_row()
+            self.row = []
+        elif tag in ("td", "th"):
+            self._end_cell()
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if self.done or self.table_depth == 0:
+            return
+        if tag in ("td", "th"):
+            self._end_cell()
+        elif tag == "tr":
+            self._end_row()
+        elif tag == "table":
+            self.table_depth -= 1
+            if self.table_depth == 0:
+                self._end_row()
+                self.done = True
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+    def _end_cell(self):
+        if self.cell is not None:
+            if self.row is not None:
+                self.row.append(_clean_cell(self.cell))
+            self.cell = None
+
+    def _end_row(self):
+        self._end_cell()
+        if self.row:  # Only add non-empty rows
+            self.rows.append(self.row)
+        self.row = None
+
+def extract_rows_stdlib(html_content: str) -> Optional[List[List[str]]]:
+    """Rows of the first table, or None when the document has no table"""
+    parser = TableExtractor()
+    parser.feed(html_content)
+    parser.close()
+    parser._end_row()
+    if parser.table_depth == 0 and not parser.done:
+        return None
+    return parser.rows
+
+def extract_rows_lxml(html_content: str) -> Optional[List[List[str]]]:
+    """Rows of the first table, or None when the document has no table"""
+    root = lxml.html.document_fromstring(html_content)
+    table = next(root.iter("table"), None)
+    if table is None:
+        return None
+    rows = []
+    for tr in table.iter("tr"):
+        row = [_clean_cell(list(td.itertext())) for td in tr.iter("td", "th")]
+        if row:
+            rows.append(row)
+    return rows
+
+def extract_rows(html_content: str) -> Optional[List[List[str]]]:
+    if lxml is not None:
+        return extract_rows_lxml(html_content)
+    return extract_rows_stdlib(html_content)
+
+def csv_path_for(html_file: str, out_dir: str) -> str:
+    csv_name = os.path.splitext(os.path.basename(html_file))[0] + '.csv'
+    return os.path.join(out_dir, csv_name)
+
+def is_up_to_date(html_file: str, csv_path: str) -> bool:
+    """True when the CSV exists and is newer than its source file"""
+    try:
+        return os.path.getmtime(csv_path) >= os.path.getmtime(html_file)
+    except OSError:
+        return False
+
+def read_rows(html_file: str) -> Tuple[Optional[List[List[str]]], str]:
+    """(rows, status) for one HTML file; rows is None unless status is "converted" """
+    # Read HTML file
+    with open(html_file, 'r', encoding='utf-8') as file:
+        html_content = file.read()
+
+    rows = extract_rows(html_content)
+    if rows is None:
+        return None, "No table found"
+    if not rows:
+        return None, "No data rows found"
+    return rows, "converted"
+
+def csv_bytes(rows: List[List[str]]) -> bytes:
+    """The CSV text of the rows, byte for byte what write_csv writes"""
+    return pd.DataFrame(rows).to_csv(index=False, header=False).encode("utf-8")
+
+def write_csv(rows: List[List[str]], csv_path: str, data: Optional[bytes] = None):
+    # write to a temporary name first so an interrupted run never leaves a truncated CSV that looks up to date
+    tmp_path = f"{csv_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(csv_bytes(rows) if data is None else data)
+    os.replace(tmp_path, csv_path)
+
+def convert_file(html_file: str, out_dir: str) -> Tuple[str, int, float]:
+    """
+    Convert one HTML file (disguised as .xls) to CSV.
+    Returns (status, rows, seconds); status is "converted" or the reason the file was not converted.
+    """
+    start = time.perf_counter()
+    rows, status = read_rows(html_file)
+    if rows is None:
+        return status, 0, time.perf_counter() - start
+    write_csv(rows, csv_path_for(html_file, out_dir))
+    return status, len(rows), time.perf_counter() - start
+
+def load_html_file(pool, html_file: str, out_dir: str, keep_csv: bool, load_options: dict) -> Tuple[str, int, float, int]:
+    """
+    Extract one HTML file's table and load the rows straight into the database, on a connection
+    of pool and retried like load_batch.load_file_retrying.
+    The CSV is an optional side output. Either way the manifest records the size and hash of the
+    CSV text the rows were parsed as, under the CSV's key, so a later load_batch run over that CSV
+    finds it unchanged. Its mtime is the CSV's, or the download's when no CSV is written.
+    Returns (status, rows, seconds, inserted).
+    """
+    import load_batch as lb
+
+    start = time.perf_counter()
+    rows, status = read_rows(html_file)
+    if rows is None:
+        return status, 0, time.perf_counter() - start, 0
+    csv_path = csv_path_for(html_file, out_dir)
+    data = csv_bytes(rows)
+    if keep_csv:
+        write_csv(rows, csv_path, data)
+        mtime = lb.file_stat(csv_path)[1]
+    else:
+        mtime = lb.file_stat(html_file)[1]
+    manifest_entry = (len(data), mtime, hashlib.sha256(data).hexdigest())
+    inserted, _ = lb.load_rows_retrying(pool, rows, csv_path, manifest_entry, **load_options)
+    return status, len(rows), time.perf_counter() - start, inserted
+
+def _load_html_file_in_worker(html_file: str, out_dir: str, keep_csv: bool, load_options: dict):
+    import load_batch as lb
+
+    return load_html_file(lb._worker_pool, html_file, out_dir, keep_csv, load_options)
+
+def is_loaded(entry, html_file: str, csv_path: str, target: str = "vehicles", storage: str = "wide") -> bool:
+    """True when the load manifest entry for csv_path already covers the current download, loaded for target and storage"""
+    import load_batch as lb
+
+    if entry is None or not lb.loaded_as(entry, target, storage):
+        return False
+    # loaded from (or since found identical to) the current CSV, and the CSV is newer than the download
+    if is_up_to_date(html_file, csv_path) and lb.file_stat(csv_path) == (entry.size, entry.mtime):
+        return True
+    # loaded with --no-csv: the entry carries the download's mtime
+    return lb.file_stat(html_file)[1] == entry.mtime
+
+def convert_html_to_csv(source_dir: str = download_dir, out_dir: str = batch_dir,
+                        workers: Optional[int] = None, force: bool = False,
+                        load: bool = False, keep_csv: bool = True, load_options: Optional[dict] = None):
+    """
+    Convert HTML files (disguised as .xls) to CSV files.
+    With load=True the extracted rows also go straight into the database (see load_html_file);
+    keep_csv=False then skips the CSV entirely.
+    """
+
     # Create batch directory if it doesn't exist
-    os.makedirs(batch_dir, exist_ok=True)
-    
-    print(f"Converting HTML files from: {download_dir}")
-    print(f"Saving CSV files to: {batch_dir}")
-    
+    os.makedirs(out_dir, exist_ok=True)
+
+    print(f"Converting HTML files from: {source_dir}")
+    print(f"Saving CSV files to: {out_dir}" if keep_csv else "Not writing CSV files")
+    print(f"Parser: {'lxml' if lxml is not None else 'html.parser (streaming)'}")
+
     # Find all .xls files (which are actually HTML)
-    html_files = glob.glob(os.path.join(download_dir, "*.xls"))
-    
+    html_files = sorted(glob.glob(os.path.join(source_dir, "*.xls")))
+
     if not html_files:
         print("No .xls files found in downloads directory.")
         return
-    
-    print(f"Found {len(html_files)} HTML files to convert...")
-    
+
+    pool = None
+    if load:
+        import load_batch as lb
+        pool = lb.create_pool(minconn=1, maxconn=1, profile="bulk_load")
+        load_options = load_options or {}
+
+    if force:
+        pending = html_files
+    elif load:
+        conn = pool.getconn()
+        try:
+            manifest = lb.fetch_manifest(conn)
+        finally:
+            pool.putconn(conn)
+        pending = [f for f in html_files
+                   if not is_loaded(manifest.get(lb.manifest_key(csv_path_for(f, out_dir))), f, csv_path_for(f, out_dir),
+                                    load_options.get("target", "vehicles"), load_options.get("storage", "wide"))
+                   or (keep_csv and not is_up_to_date(f, csv_path_for(f, out_dir)))]
+    else:
+        pending = [f for f in html_files if not is_up_to_date(f, csv_path_for(f, out_dir))]
+    up_to_date = len(html_files) - len(pending)
+    print(f"Found {len(html_files)} HTML files, {up_to_date} already up to date, {len(pending)} to "
+          f"{'load' if load else 'convert'}...")
+
     converted_count = 0
     error_count = 0
-    
-    for html_file in html_files:
-        try:
-            # Read HTML file
-            with open(html_file, 'r', encoding='utf-8') as file:
-                html_content = file.read()
-            
-            # Parse HTML with BeautifulSoup
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Find the main data table
-            table = soup.find('table')
-            if not table:
-                print(f"✗ No table found in {os.path.basename(html_file)}")
-                error_count += 1
-                continue
-            
-            # Extract table data
-            rows = []
-            for tr in table.find_all('tr'):
-                row = []
-                for td in tr.find_all(['td', 'th']):
-                    # Get text content and clean it
-                    cell_text = td.get_text(strip=True)
-                    # Replace non-breaking spaces and clean up
-                    cell_text = cell_text.replace('\xa0', '').replace('&nbsp;', '')
-                    row.append(cell_text)
-                if row:  # Only add non-empty rows
-                    rows.append(row)
-            
-            if not rows:
-                print(f"✗ No data rows found in {os.path.basename(html_file)}")
-                error_count += 1
-                continue
-            
-            # Create DataFrame
-            df = pd.DataFrame(rows)
-            
-            # Generate CSV filename
-            base_name = os.path.basename(html_file)
-            csv_name = os.path.splitext(base_name)[0] + '.csv'
-            csv_path = os.path.join(batch_dir, csv_name)
-            
-            # Save as CSV
-            df.to_csv(csv_path, index=False, header=False)
-            
-            print(f"✓ Converted: {base_name} -> {csv_name} ({len(rows)} rows)")
-            converted_count += 1
-            
-        except Exception as e:
-            print(f"✗ Error converting {os.path.basename(html_file)}: {str(e)}")
+    total_inserted = 0
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+
+    def report(html_file: str, status: str, rows: int, seconds: float, inserted: Optional[int] = None):
+        nonlocal converted_count, error_count, total_inserted
+        base_name = os.path.basename(html_file)
+        if status != "converted":
+            print(f"✗ {status} in {base_name}")
             error_count += 1
-    
-    print(f"\nConversion completed:")
-    print(f"  Successfully converted: {converted_count} files")
+        elif inserted is not None:
+            print(f"✓ Loaded: {base_name} ({rows} rows -> {inserted} records, {seconds * 1000:.0f} ms)")
+            converted_count += 1
+            total_inserted += inserted
+        else:
+            csv_name = os.path.basename(csv_path_for(html_file, out_dir))
+            print(f"✓ Converted: {base_name} -> {csv_name} ({rows} rows, {seconds * 1000:.0f} ms)")
+            converted_count += 1
+
+    if workers > 1 and len(pending) > 1:
+        if load:
+            pool.closeall()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=lb._init_worker)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        with executor:
+            if load:
+                futures = {executor.submit(_load_html_file_in_worker, f, out_dir, keep_csv, load_options): f for f in pending}
+            else:
+                futures = {executor.submit(convert_file, f, out_dir): f for f in pending}
+            for future in as_completed(futures):
+                html_file = futures[future]
+                try:
+                    report(html_file, *future.result())
+                except Exception as e:
+                    print(f"✗ Error converting {os.path.basename(html_file)}: {str(e)}")
+                    error_count += 1
+    else:
+        for html_file in pending:
+            try:
+                if load:
+                    report(html_file, *load_html_file(pool, html_file, out_dir, keep_csv, load_options))
+                else:
+                    report(html_file, *convert_file(html_file, out_dir))
+            except Exception as e:
+                print(f"✗ Error converting {os.path.basename(html_file)}: {str(e)}")
+                error_count += 1
+        if pool is not None:
+            pool.closeall()
+
+    elapsed = time.perf_counter() - start
+    print(f"\nConversion completed in {elapsed:.1f}s:")
+    print(f"  Successfully {'loaded' if load else 'converted'}: {converted_count} files")
+    if load:
+        print(f"  Records inserted: {total_inserted}")
+    print(f"  Up to date (skipped): {up_to_date} files")
     print(f"  Errors: {error_count} files")
-    print(f"  CSV files saved to: {batch_dir}")
+    if keep_csv:
+        print(f"  CSV files saved to: {out_dir}")
+
+def parse_args(argv=None) -> argparse.Namespace:
+    import load_batch as lb
+
+    parser = argparse.ArgumentParser(description="Convert downloaded SSRN .xls (HTML) exports to CSV")
+    parser.add_argument("--source-dir", default=download_dir, help="directory with the downloaded .xls files")
+    parser.add_argument("--out-dir", default=batch_dir, help="directory to write the CSV files to")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of converter processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true",
+                        help="convert every file, even when its CSV is newer than the source")
+    parser.add_argument("--load", action="store_true",
+                        help="load the extracted rows straight into the database, skipping the CSV read-back; "
+                             "files already in load_manifest are skipped")
+    parser.add_argument("--no-csv", action="store_true", help="with --load, do not write CSV files at all")
+    # how --load writes the rows: the load_batch.py options
+    lb.add_load_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.no_csv and not args.load:
+        parser.error("--no-csv needs --load")
+    lb.check_load_arguments(parser, args)
+    return args
 
 if __name__ == "__main__":
-    convert_html_to_csv()
-    
+    import load_batch as lb
+
+    args = parse_args()
+    load_options = lb.options_from_args(args)
+    convert_html_to_csv(args.source_dir, args.out_dir, args.workers, args.force,
+                        args.load, not args.no_csv, load_options)
@@ -0,0 +1,87 @@
+import os
+import argparse
+from datetime import date, timedelta
+
+import numpy as np
+
+# Mean hourly count per count column (15 vehicle classes x a/b), measured on data/batch/ssrn
+COLUMN_MEANS = [
+    3.85, 3.72, 7.85, 7.89, 2.53, 2.66, 4.47, 4.43, 6.41, 6.68,
+    5.89, 5.86, 18.36, 18.2, 131.67, 133.42, 10.87, 10.73, 4.67, 4.77,
+    45.65, 47.67, 12.05, 12.45, 0.14, 0.13, 3.26, 3.32, 0.23, 0.2,
+]
+# Relative traffic by hour of day (mean 1.0), measured on data/batch/ssrn
+HOURLY_PROFILE = [
+    0.06, 0.05, 0.05, 0.08, 0.16, 0.36, 0.73, 1.04, 1.4, 1.77, 1.9, 1.91,
+    1.89, 1.82, 1.84, 1.87, 1.87, 1.86, 1.45, 0.87, 0.48, 0.29, 0.17, 0.1,
+]
+# The four header rows of an SSRN traffic count export, 35 columns wide
+HEADER_ROWS = [
+    ["Date", "Start Time (Hrs)", "Motorized Vehicle", "Non-motorized Vehicle", "Total"] + [""] * 30,
+    ["Truck", "Bus", "Car", "Motor Cycle", "Utility Vehicle", "Tractor", "Motorized Three Wheeler",
+     "Four Wheel Drive", "Power Tiller", "Rickshaw", "Bullock Cart/ Hand Cart/ Tanga"] + [""] * 24,
+    ["Multi Axle", "Heavy", "Light", "Big", "Mini", "Micro"] + [""] * 29,
+    ["a", "b"] * 16 + ["Total", "", ""],
+]
+
+def station_ids(count: int):
+    return [f"SYN{i:04d}" for i in range(1, count + 1)]
+
+def generate_station_file(path: str, days: int, density: float, start: date, rng: np.random.Generator) -> int:
+    """
+    Write one synthetic station-year file in the SSRN four-row header layout.
+    Returns the number of vehicles counted in the file.
+    """
+    hours = days * 24
+    profile = np.tile(HOURLY_PROFILE, days)[:, None]
+    counts = rng.poisson(np.array(COLUMN_MEANS)[None, :] * profile * density, size=(hours, len(COLUMN_MEANS)))
+    # the three trailing columns of a data row are the a-column total, b-column total and grand total
+    total_a = counts[:, 0::2].sum(axis=1)
+    total_b = counts[:, 1::2].sum(axis=1)
+
+    lines = [",".join(row) for row in HEADER_ROWS]
+    for h in range(hours):
+        day = start + timedelta(days=h // 24)
+        cells = ["" if c == 0 else str(c) for c in counts[h]]
+        lines.append(",".join([day.isoformat(), f"{h % 24:02d}:00:00"] + cells
+                              + [str(total_a[h]), str(total_b[h]), str(total_a[h] + total_b[h])]))
+    # summary block like the real exports; the loader filters these rows out
+    per_class = counts.reshape(hours, -1, 2).sum(axis=2).sum(axis=0)
+    aadt = np.round(per_class / max(days, 1)).astype(int)
+    lines.append("")
+    lines.append(",".join(["Average Annual Daily Traffic(AADT)"] + [str(v) for v in aadt] + [str(aadt.sum())]
+                          + [""] * (len(HEADER_ROWS[0]) - len(aadt) - 2)))
+    with open(path, "w", newline="") as fh:
+        fh.write("\n".join(lines) + "\n")
+    return int(counts.sum())
+
+def generate_dataset(out_dir: str, stations: int = 152, days: int = 3, density: float = 1.0,
+                     seed: int = 0, start: date = date(2024, 1, 1)) -> dict:
+    """
+    Generate one file per station. The defaults (152 stations x 3 days, density 1.0)
+    match the size of the real data/batch/ssrn set; raise days, stations or density to scale up.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    files = []
+    vehicles = 0
+    for station in station_ids(stations):
+        path = os.path.join(out_dir, f"{station}_traffic_count_{start.year}.csv")
+        vehicles += generate_station_file(path, days, density, start, rng)
+        files.append(path)
+    return {"files": files, "vehicles": vehicles, "stations": stations, "days": days, "density": density, "seed": seed}
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic SSRN traffic count CSV files")
+    parser.add_argument("out_dir", help="directory to write the CSV files to")
+    parser.add_argument("--stations", type=int, default=152)
+    parser.add_argument("--days", type=int, default=3, help="days of hourly rows per station file")
+    parser.add_argument("--density", type=float, default=1.0, help="multiplier on the measured hourly counts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    result = generate_dataset(args.out_dir, args.stations, args.days, args.density, args.seed)
+    print(f"Wrote {len(result['files'])} file(s) with {result['vehicles']} vehicles to {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import json
+import math
+import time
+import random
+import socket
+import asyncio
+import argparse
+from datetime import datetime
+
+# vehicles drive around this point (Kathmandu ring road area), ~1 km per 0.009 degrees
+center = (27.7172, 85.3240)
+area_degrees = 0.08
+vehicle_types = ["Heavy_Truck", "Light_Truck", "Big_Bus", "Mini_Bus", "Micro_Bus", "Car",
+                 "Motor_Cycle", "Utility_Vehicle", "Tractor", "Three_Wheeler"]
+statuses = ["moving", "moving", "moving", "stopped", "idle"]
+
+class Fleet:
+    """Vehicles on a random walk; each step moves one vehicle and returns its position event"""
+
+    def __init__(self, vehicles: int, seed: int = 0, invalid_rate: float = 0.0):
+        self.rng = random.Random(seed)
+        self.invalid_rate = invalid_rate
+        self.vehicles = []
+        for i in range(vehicles):
+            self.vehicles.append({
+                "vehicle_number": f"RT{i:06d}",
+                "vehicle_type": self.rng.choice(vehicle_types),
+                "lat": center[0] + self.rng.uniform(-area_degrees, area_degrees),
+                "lon": center[1] + self.rng.uniform(-area_degrees, area_degrees),
+                "heading": self.rng.uniform(0, 2 * math.pi),
+                "speed": self.rng.uniform(0, 60),
+            })
+
+    def event(self) -> dict:
+        v = self.rng.choice(self.vehicles)
+        v["heading"] += self.rng.gauss(0, 0.3)
+        v["speed"] = min(max(v["speed"] + self.rng.gauss(0, 3), 0.0), 90.0)
+        step = v["speed"] / 3600 / 111  # about one second of travel, in degrees
+        v["lat"] = min(max(v["lat"] + step * math.cos(v["heading"]), center[0] - area_degrees), center[0] + area_degrees)
+        v["lon"] = min(max(v["lon"] + step * math.sin(v["heading"]), center[1] - area_degrees), center[1] + area_degrees)
+        event = {
+            "vehicle_number": v["vehicle_number"],
+            "vehicle_type": v["vehicle_type"],
+            "latitude": round(v["lat"], 6),
+            "longitude": round(v["lon"], 6),
+            "speed": round(v["speed"], 1),
+            "status": self.rng.choice(statuses) if v["speed"] < 5 else "moving",
+            "recorded_at": datetime.now().isoformat(timespec="milliseconds"),
+        }
+        if self.invalid_rate and self.rng.random() < self.invalid_rate:
+            # exercise validation: a missing field, an out of range coordinate or broken JSON
+            kind = self.rng.randrange(3)
+            if kind == 0:
+                del event["vehicle_number"]
+            elif kind == 1:
+                event["latitude"] = 123.0
+            else:
+                return None
+        return event
+
+def encode(event) -> bytes:
+    if event is None:
+        return b'{"vehicle_number": "RT-broken", "latitude": \n'
+    return json.dumps(event, separators=(",", ":")).encode() + b"\n"
+
+async def open_sink(args):
+    """Returns (send(lines: bytes), close()) for the chosen target"""
+    if args.tcp:
+        reader, writer = await asyncio.open_connection(args.host, args.tcp)
+
+        async def send(data: bytes):
+            writer.write(data)
+            # waits while the service is not reading, so a backed up service slows the generator
+            await writer.drain()
+
+        async def close():
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass  # the service stopped first
+        return send, close
+    if args.udp:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect((args.host, args.udp))
+
+        async def send(data: bytes):
+            # keep datagrams under a typical MTU-safe size, splitting on line boundaries
+            lines = data.splitlines(keepends=True)
+            packet = b""
+            for line in lines:
+                if packet and len(packet) + len(line) > 1400:
+                    sock.send(packet)
+                    packet = b""
+                packet += line
+            if packet:
+                sock.send(packet)
+
+        async def close():
+            sock.close()
+        return send, close
+    fh = open(args.file, "ab")
+
+    async def send(data: bytes):
+        fh.write(data)
+        fh.flush()
+
+    async def close():
+        fh.close()
+    return send, close
+
+async def generate(args) -> int:
+    fleet = Fleet(args.vehicles, args.seed, args.invalid_rate)
+    send, close = await open_sink(args)
+    tick = 0.01
+    sent = 0
+    start = time.perf_counter()
+    next_report = start + 5
+    try:
+        while True:
+            elapsed = time.perf_counter() - start
+            if (args.duration and elapsed >= args.duration) or (args.count and sent >= args.count):
+                break
+            # catch up to rate * elapsed in steps of at most 0.1s of events; a slow send (backpressure) lowers the achieved rate
+            due = min(int(args.rate * (elapsed + tick)) - sent, max(1, int(args.rate * 0.1)))
+            if args.count:
+                due = min(due, args.count - sent)
+            if due > 0:
+                try:
+                    await send(b"".join(encode(fleet.event()) for _ in range(due)))
+                except ConnectionError as e:
+                    print(f"Connection lost: {e}")
+                    break
+                sent += due
+            now = time.perf_counter()
+            if now >= next_report:
+                print(f"sent {sent} events ({sent / (now - start):.0f}/s)")
+                next_report = now + 5
+            await asyncio.sleep(max(0.0, start + elapsed + tick - time.perf_counter()))
+    finally:
+        await close()
+    elapsed = time.perf_counter() - start
+    print(f"Sent {sent} events in {elapsed:.1f}s ({sent / elapsed:.0f}/s)")
+    return sent
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate vehicle position events for src/realtime_ingest.py")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--tcp", type=int, metavar="PORT", help="send JSON lines to the ingest service over TCP")
+    target.add_argument("--udp", type=int, metavar="PORT", help="send JSON lines in UDP datagrams")
+    target.add_argument("--file", help="append JSON lines to this file (for --file ingestion)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--rate", type=float, default=2000, help="events per second (default 2000)")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run")
+    parser.add_argument("--count", type=int, default=None, help="stop after this many events")
+    parser.add_argument("--vehicles", type=int, default=1000, help="size of the simulated fleet")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="fraction of malformed events")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if not (args.duration or args.count):
+        parser.error("give --duration or --count")
+    asyncio.run(generate(args))
+
+if __name__ == "__main__":
+    main()
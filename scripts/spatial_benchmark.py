@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+from datetime import datetime
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+import spatial_index as si
+from benchmark import git_commit, results_dir
+from realtime_generator import Fleet, area_degrees, center
+
+def fleet_positions(fleet: Fleet, now: float, max_age: float, rng: random.Random):
+    # latest positions spread over the age window, as after a bulk load
+    return [si.Position(v["vehicle_number"], v["vehicle_type"], v["lat"], v["lon"], v["speed"], "moving",
+                        now - rng.uniform(0, max_age)) for v in fleet.vehicles]
+
+def event_position(event: dict, recorded_at: float) -> si.Position:
+    return si.Position(event["vehicle_number"], event["vehicle_type"], event["latitude"], event["longitude"],
+                       event["speed"], event["status"], recorded_at)
+
+def latency_stats(samples) -> dict:
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(q * len(samples)), len(samples) - 1)] * 1000
+    return {"queries": len(samples), "mean_ms": round(sum(samples) / len(samples) * 1000, 4),
+            "p50_ms": round(pick(0.50), 4), "p95_ms": round(pick(0.95), 4), "p99_ms": round(pick(0.99), 4),
+            "max_ms": round(samples[-1] * 1000, 4)}
+
+def timed(fn, points):
+    samples, found = [], 0
+    for p in points:
+        start = time.perf_counter()
+        result = fn(*p)
+        samples.append(time.perf_counter() - start)
+        found += len(result)
+    stats = latency_stats(samples)
+    stats["mean_results"] = round(found / len(points), 1)
+    return stats
+
+def check_against_scan(index: si.SpatialIndex, points, meters: float, box_meters: float, k: int) -> int:
+    """Compare each query with a scan of every position; returns the number of mismatches"""
+    mismatches = 0
+    everything = list(index.positions.values())
+    for lat, lon in points:
+        my, mx = index._scale(lat)
+        dist = lambda p: math.hypot((p.latitude - lat) * my, (p.longitude - lon) * mx)
+        expected = sorted(p.vehicle_number for p in everything if dist(p) <= meters)
+        if sorted(p.vehicle_number for _, p in index.radius(lat, lon, meters)) != expected:
+            mismatches += 1
+        half = box_meters / 2 / si.meters_per_degree
+        box = (lat - half, lon - half, lat + half, lon + half)
+        expected = sorted(p.vehicle_number for p in everything
+                          if box[0] <= p.latitude <= box[2] and box[1] <= p.longitude <= box[3])
+        if sorted(p.vehicle_number for p in index.bbox(*box)) != expected:
+            mismatches += 1
+        # compare distances, not vehicles: ties may pick either
+        expected = sorted(dist(p) for p in everything)[:k]
+        if any(abs(a - d) > 1e-6 for a, (d, _) in zip(expected, index.nearest(lat, lon, k))):
+            mismatches += 1
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the in-memory spatial index of latest vehicle positions")
+    parser.add_argument("--vehicles", type=int, default=100_000)
+    parser.add_argument("--updates", type=int, default=200_000, help="position events applied after the build")
+    parser.add_argument("--queries", type=int, default=2000, help="query points per query type")
+    parser.add_argument("--meters", type=float, default=500, help="radius query distance")
+    parser.add_argument("--box-meters", type=float, default=1000, help="bounding box side")
+    parser.add_argument("-k", type=int, default=10, help="vehicles per nearest query")
+    parser.add_argument("--cell-meters", type=float, default=si.cell_meters)
+    parser.add_argument("--max-age", type=float, default=si.max_age_seconds)
+    parser.add_argument("--verify", type=int, default=50, help="query points also checked against a full scan")
+    parser.add_argument("--from-db", action="store_true",
+                        help="build the index from vehicles_realtime instead of a generated fleet")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="result JSON path (default: data/benchmarks/spatial-<timestamp>.json)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    index = si.SpatialIndex(args.cell_meters, args.max_age)
+    stages = {}
+    now = time.time()
+
+    if args.from_db:
+        feed = si.RealtimeFeed(index)
+        start = time.perf_counter()
+        try:
+            feed.load()
+        finally:
+            feed.close()
+        stages["build_from_db"] = {"seconds": round(time.perf_counter() - start, 4), "vehicles": len(index)}
+        if not len(index):
+            sys.exit(f"No vehicles_realtime rows newer than {args.max_age:g}s")
+    else:
+        print(f"Generating {args.vehicles} vehicles")
+        fleet = Fleet(args.vehicles, args.seed)
+        positions = fleet_positions(fleet, now, args.max_age, rng)
+        start = time.perf_counter()
+        index.update_many(positions)
+        stages["build"] = {"seconds": round(time.perf_counter() - start, 4), "vehicles": len(index)}
+
+        events = [fleet.event() for _ in range(args.updates)]
+        start = time.perf_counter()
+        for i, event in enumerate(events):
+            index.update(event_position(event, now + i * 1e-4))
+        elapsed = time.perf_counter() - start
+        stages["update"] = {"seconds": round(elapsed, 4), "updates": len(events),
+                            "updates_per_sec": round(len(events) / elapsed) if elapsed > 0 else None}
+
+    # query points: the positions of random vehicles, so every query lands where traffic is
+    sample = rng.sample(list(index.positions.values()), min(args.queries, len(index)))
+    points = [(p.latitude + rng.uniform(-0.002, 0.002), p.longitude + rng.uniform(-0.002, 0.002)) for p in sample]
+    half = args.box_meters / 2 / si.meters_per_degree
+    queries = {
+        f"radius[{args.meters:g}m]": timed(lambda lat, lon: index.radius(lat, lon, args.meters), points),
+        f"bbox[{args.box_meters:g}m]": timed(lambda lat, lon: index.bbox(lat - half, lon - half, lat + half, lon + half),
+                                               points),
+        f"nearest[k={args.k}]": timed(lambda lat, lon: index.nearest(lat, lon, args.k), points),
+    }
+    mismatches = check_against_scan(index, points[:args.verify], args.meters, args.box_meters, args.k)
+
+    # a tenth of the window later: vehicles last seen in the oldest tenth and not updated since are evicted
+    start = time.perf_counter()
+    evicted = index.evict(now + args.max_age * 0.1 if not args.from_db else None)
+    stages["evict"] = {"seconds": round(time.perf_counter() - start, 4), "evicted": evicted, "remaining": len(index)}
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "dataset": {"source": "vehicles_realtime" if args.from_db else "generated", "vehicles": stages.get(
+            "build", stages.get("build_from_db"))["vehicles"], "area_degrees": area_degrees, "center": center,
+            "seed": args.seed},
+        "index": index.stats(),
+        "stages": stages,
+        "queries": queries,
+        "verified_points": min(args.verify, len(points)),
+        "mismatches": mismatches,
+    }
+
+    output = args.output or os.path.join(results_dir, f"spatial-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fh:
+        json.dump(result, fh, indent=2)
+
+    for stage, v in stages.items():
+        print(f"{stage:<16}{v['seconds']:>10.3f}s  " + ", ".join(f"{k} {x}" for k, x in v.items() if k != "seconds"))
+    print(f"{'query':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'results':>10}")
+    for name, q in queries.items():
+        print(f"{name:<20}{q['p50_ms']:>10.4f}{q['p95_ms']:>10.4f}{q['p99_ms']:>10.4f}{q['max_ms']:>10.4f}"
+              f"{q['mean_results']:>10}")
+    print(f"{mismatches} mismatch(es) against a full scan of {result['verified_points']} point(s)")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
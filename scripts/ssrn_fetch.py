@@ -0,0 +1,346 @@
+import os
+import re
+import time
+import random
+import asyncio
+import argparse
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from html.parser import HTMLParser
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+download_dir = os.path.join(project_root, "data", "downloads")
+
+base_url = "http://ssrn.aviyaan.com"
+listing_path = "/traffic_controller"
+user_agent = "City_Traffic_ETL ssrn_fetch"
+
+# retry policy for connection errors, timeouts, 429 and 5xx responses
+max_retries = 4
+backoff_base = 1.0
+backoff_cap = 30.0
+request_timeout = 60
+
+# same name the browser gave the file exportToExcel produced, e.g. F00101_traffic_count_2011.xls
+file_name_template = "{second_param}_traffic_count_{first_param}.xls"
+
+# exportToExcel builds the download in the browser: the report table wrapped in this
+# Excel-HTML envelope. Every file in data/downloads starts and ends with exactly these bytes.
+excel_head = (
+    '<html xmlns:o="urn:schemas-microsoft-com:office:office" xmlns:x="urn:schemas-microsoft-com:office:excel" '
+    'xmlns="http://www.w3.org/TR/REC-html40"><meta http-equiv="content-type" content="application/vnd.ms-excel; '
+    'charset=UTF-8"><head><!--[if gte mso 9]><xml><x:ExcelWorkbook><x:ExcelWorksheets><x:ExcelWorksheet>'
+    '<x:Name>Sheet0</x:Name><x:WorksheetOptions><x:DisplayGridlines/></x:WorksheetOptions></x:ExcelWorksheet>'
+    '</x:ExcelWorksheets></x:ExcelWorkbook></xml><![endif]--></head><body>'
+)
+excel_tail = '</body></html>'
+
+class Report(NamedTuple):
+    location: str
+    first_param: str
+    second_param: str
+    url: str
+
+class FetchError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+class PageParser(HTMLParser):
+    """Collects the location form and the rows of the link table from a traffic_controller page"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.form_action: Optional[str] = None
+        self.form_method = "get"
+        self.hidden: Dict[str, str] = {}
+        self.locations: List[Tuple[str, str]] = []
+        self.rows: List[Tuple[List[str], Optional[str]]] = []
+        self._in_location_select = False
+        self._option_value: Optional[str] = None
+        self._option_text: List[str] = []
+        self._link_table_depth = 0
+        self._row: Optional[List[str]] = None
+        self._row_href: Optional[str] = None
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "form" and self.form_action is None:
+            self.form_action = attrs.get("action") or ""
+            self.form_method = (attrs.get("method") or "get").lower()
+        elif tag == "input" and attrs.get("type") == "hidden" and attrs.get("name"):
+            self.hidden[attrs["name"]] = attrs.get("value") or ""
+        elif tag == "select" and attrs.get("name") == "location":
+            self._in_location_select = True
+        elif tag == "option" and self._in_location_select:
+            self._end_option()
+            self._option_value = attrs.get("value")
+            self._option_text = []
+        elif tag == "table":
+            if self._link_table_depth or "link-table" in (attrs.get("class") or "").split():
+                self._link_table_depth += 1
+        elif self._link_table_depth == 1:
+            if tag == "tr":
+                self._end_row()
+                self._row, self._row_href = [], None
+            elif tag in ("td", "th"):
+                self._end_cell()
+                self._cell = []
+            elif tag == "a" and self._cell is not None and attrs.get("href"):
+                # the link in the last column wins
+                self._row_href = attrs["href"]
+
+    def handle_endtag(self, tag):
+        if tag == "select" and self._in_location_select:
+            self._end_option()
+            self._in_location_select = False
+        elif tag == "option":
+            self._end_option()
+        elif tag == "table" and self._link_table_depth:
+            self._link_table_depth -= 1
+            if not self._link_table_depth:
+                self._end_row()
+        elif self._link_table_depth == 1:
+            if tag in ("td", "th"):
+                self._end_cell()
+            elif tag == "tr":
+                self._end_row()
+
+    def handle_data(self, data):
+        if self._option_value is not None:
+            self._option_text.append(data)
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def _end_option(self):
+        if self._option_value is not None:
+            self.locations.append((self._option_value, " ".join("".join(self._option_text).split())))
+        self._option_value = None
+
+    def _end_cell(self):
+        if self._cell is not None and self._row is not None:
+            self._row.append(" ".join("".join(self._cell).split()))
+        self._cell = None
+
+    def _end_row(self):
+        self._end_cell()
+        if self._row is not None:
+            self.rows.append((self._row, self._row_href))
+        self._row = None
+
+def parse_page(html: str) -> PageParser:
+    parser = PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+_table_tag = re.compile(r"<(/?)table\b[^>]*>", re.IGNORECASE)
+
+def report_table(html: str) -> Optional[str]:
+    """
+    Inner markup of the report table on a report page: the first top-level table that is not
+    the link table. exportToExcel wraps this in the Excel envelope.
+    """
+    depth = 0
+    start = None
+    for match in _table_tag.finditer(html):
+        if not match.group(1):
+            if depth == 0:
+                start = match
+            depth += 1
+        elif depth:
+            depth -= 1
+            if depth == 0:
+                if "link-table" not in start.group(0):
+                    return html[start.end():match.start()]
+                start = None
+    return None
+
+def excel_document(table_html: str) -> str:
+    return f"{excel_head}<table>{table_html}</table>{excel_tail}"
+
+class Fetcher:
+    """
+    Crawls the traffic_controller listing and fetches each report with at most `concurrency`
+    requests in flight. urllib runs in a thread pool so the crawl needs no extra dependencies.
+    """
+
+    def __init__(self, base: str = base_url, out_dir: str = download_dir, concurrency: int = 4,
+                 export_url: Optional[str] = None, force: bool = False, refresh: bool = False,
+                 retries: int = max_retries, backoff: float = backoff_base):
+        self.base = base.rstrip("/") + "/"
+        self.out_dir = out_dir
+        self.export_url = export_url
+        self.force = force
+        self.refresh = refresh
+        self.retries = retries
+        self.backoff = backoff
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.stats = {"downloaded": 0, "present": 0, "not_modified": 0, "failed": 0, "requests": 0, "retries": 0}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    def _request(self, url: str, data: Optional[bytes], headers: Dict[str, str]) -> Tuple[int, bytes]:
+        request = urllib.request.Request(url, data=data, headers={"User-Agent": user_agent, **headers})
+        try:
+            with urllib.request.urlopen(request, timeout=request_timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 304, b""
+            raise FetchError(f"HTTP {e.code} for {url}", e.code)
+
+    async def fetch(self, url: str, data: Optional[Dict[str, str]] = None,
+                    headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        """GET (or POST when data is given) with retries and exponential backoff plus jitter"""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    self.stats["requests"] += 1
+                    return await loop.run_in_executor(self.executor, self._request, url, body, headers or {})
+            except FetchError as e:
+                # other 4xx responses will not change on a retry
+                if e.status is not None and e.status != 429 and e.status < 500:
+                    raise
+                error = e
+            except (urllib.error.URLError, OSError) as e:
+                error = e
+            if attempt == self.retries:
+                raise FetchError(f"{url}: giving up after {attempt + 1} attempts ({error})")
+            self.stats["retries"] += 1
+            delay = min(backoff_cap, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            await asyncio.sleep(delay)
+
+    async def fetch_text(self, url: str, data: Optional[Dict[str, str]] = None) -> str:
+        _, content = await self.fetch(url, data)
+        return content.decode("utf-8", errors="replace")
+
+    async def list_locations(self) -> Tuple[PageParser, List[Tuple[str, str]]]:
+        page = parse_page(await self.fetch_text(urllib.parse.urljoin(self.base, listing_path.lstrip("/"))))
+        # the first option is the "select a location" placeholder
+        locations = [(value, text) for value, text in page.locations if value]
+        return page, locations
+
+    async def list_reports(self, page: PageParser, location: Tuple[str, str]) -> List[Report]:
+        """Submit the location form like the browser did and read the link table"""
+        value, text = location
+        action = urllib.parse.urljoin(self.base, page.form_action or listing_path.lstrip("/"))
+        fields = {**page.hidden, "location": value}
+        if page.form_method == "post":
+            html = await self.fetch_text(action, fields)
+        else:
+            html = await self.fetch_text(f"{action}?{urllib.parse.urlencode(fields)}")
+        reports = []
+        # the first row is the header; the report parameters are in columns 8 and 2
+        for cells, href in parse_page(html).rows[1:]:
+            if len(cells) < 8 or not href:
+                continue
+            reports.append(Report(text, cells[7], cells[1], urllib.parse.urljoin(action, href)))
+        return reports
+
+    async def download(self, report: Report) -> str:
+        """Fetch one report into out_dir. Returns "downloaded", "present", "not_modified" or "failed" """
+        name = file_name_template.format(first_param=report.first_param, second_param=report.second_param)
+        path = os.path.join(self.out_dir, name)
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists and not self.force and not self.refresh:
+            return "present"
+        headers = {}
+        if exists and self.refresh:
+            headers["If-Modified-Since"] = formatdate(os.path.getmtime(path), usegmt=True)
+        try:
+            if self.export_url:
+                url = self.export_url.format(base=self.base.rstrip("/"), first_param=urllib.parse.quote(report.first_param),
+                                             second_param=urllib.parse.quote(report.second_param))
+                status, content = await self.fetch(url, headers=headers)
+            else:
+                status, content = await self.fetch(report.url, headers=headers)
+                if status != 304:
+                    table = report_table(content.decode("utf-8", errors="replace"))
+                    if table is None:
+                        raise FetchError(f"no report table on {report.url}")
+                    content = excel_document(table).encode("utf-8")
+        except FetchError as e:
+            print(f"\t✗ Cannot get {report.location} {report.first_param}: {e}")
+            return "failed"
+        if status == 304:
+            return "not_modified"
+        # write under a temporary name so a half-written file is never taken as present
+        tmp_path = f"{path}.{os.getpid()}.part"
+        with open(tmp_path, "wb") as fh:
+            fh.write(content)
+        os.replace(tmp_path, path)
+        return "downloaded"
+
+    async def _download_logged(self, report: Report):
+        start = time.perf_counter()
+        result = await self.download(report)
+        self.stats[result] += 1
+        if result == "downloaded":
+            print(f"\t✓ Downloaded {report.location} {report.first_param} ({time.perf_counter() - start:.1f}s)")
+
+    async def _crawl_location(self, page: PageParser, location: Tuple[str, str]):
+        try:
+            reports = await self.list_reports(page, location)
+        except FetchError as e:
+            print(f"Error processing location {location[1]}: {e}")
+            self.stats["failed"] += 1
+            return
+        print(f"Getting {location[1]}: {len(reports)} report(s)")
+        await asyncio.gather(*(self._download_logged(r) for r in reports))
+
+    async def crawl(self, only: Optional[List[str]] = None) -> dict:
+        os.makedirs(self.out_dir, exist_ok=True)
+        page, locations = await self.list_locations()
+        if only:
+            locations = [loc for loc in locations if loc[0] in only or loc[1] in only]
+        print(f"Found {len(locations)} location(s)")
+        await asyncio.gather(*(self._crawl_location(page, loc) for loc in locations))
+        return self.stats
+
+async def run(args: argparse.Namespace) -> dict:
+    fetcher = Fetcher(args.base_url, args.out_dir, args.concurrency, args.export_url,
+                      args.force, args.refresh, args.retries, args.backoff)
+    try:
+        return await fetcher.crawl(args.location)
+    finally:
+        fetcher.close()
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Download SSRN traffic count reports over HTTP")
+    parser.add_argument("--base-url", default=base_url,
+                        help="site root, e.g. http://127.0.0.1:8765 for scripts/ssrn_standin.py")
+    parser.add_argument("--out-dir", default=download_dir)
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum requests in flight")
+    parser.add_argument("--retries", type=int, default=max_retries)
+    parser.add_argument("--backoff", type=float, default=backoff_base, help="first retry delay in seconds (doubles per retry)")
+    parser.add_argument("--location", action="append",
+                        help="only crawl this location (option value or label); repeatable")
+    parser.add_argument("--force", action="store_true", help="download every report, even ones already present")
+    parser.add_argument("--refresh", action="store_true",
+                        help="re-request present files with If-Modified-Since and keep them on 304")
+    parser.add_argument("--export-url", default=None,
+                        help="fetch reports from a server-side export endpoint instead of building them from the "
+                             "report page, e.g. '{base}/traffic_controller/exportToExcel/{first_param}/{second_param}'")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"Download directory: {args.out_dir}")
+    start = time.perf_counter()
+    stats = asyncio.run(run(args))
+    print(f"Done in {time.perf_counter() - start:.1f}s: {stats['downloaded']} downloaded, {stats['present']} already present, "
+          f"{stats['not_modified']} not modified, {stats['failed']} failed "
+          f"({stats['requests']} requests, {stats['retries']} retries)")
+
+if __name__ == "__main__":
+    main()
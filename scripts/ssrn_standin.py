@@ -0,0 +1,154 @@
+import os
+import glob
+import random
+import argparse
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+download_dir = os.path.join(project_root, "data", "downloads")
+recordings_dir = os.path.join(project_root, "data", "ssrn_recorded")
+
+def page_key(path: str, params: Optional[dict] = None) -> str:
+    """File name of the recorded response for a request path plus its query/form fields"""
+    key = urllib.parse.quote(path.strip("/") or "index", safe="")
+    if params:
+        key += "@" + urllib.parse.quote(urllib.parse.urlencode(sorted(params.items())), safe="")
+    return key + ".html"
+
+def _listing_page(body: str) -> str:
+    return f"<html><body>{body}</body></html>"
+
+def record_from_downloads(source_dir: str = download_dir, out_dir: str = recordings_dir) -> int:
+    """
+    Build stand-in recordings from already downloaded exports: the location form, one link table
+    per station and one report page per file. The station code is the location.
+    Returns the number of report pages written.
+    """
+    reports = defaultdict(list)
+    for path in sorted(glob.glob(os.path.join(source_dir, "*_traffic_count_*.xls"))):
+        station, year = os.path.splitext(os.path.basename(path))[0].split("_traffic_count_")
+        reports[station].append((year, path))
+    os.makedirs(out_dir, exist_ok=True)
+
+    def write(key: str, html: str):
+        with open(os.path.join(out_dir, key), "w", encoding="utf-8") as fh:
+            fh.write(html)
+
+    options = "".join(f'<option value="{s}">{s}</option>' for s in reports)
+    write(page_key("/traffic_controller"), _listing_page(
+        '<form method="post" action="/traffic_controller"><input type="hidden" name="submit" value="1">'
+        f'<select name="location"><option value="">Select location</option>{options}</select></form>'))
+    written = 0
+    for station, files in reports.items():
+        header = "".join(f"<th>col{i}</th>" for i in range(1, 9)) + "<th>View</th>"
+        rows = "".join(
+            f"<tr><td>{i}</td><td>{station}</td><td>-</td><td>-</td><td>-</td><td>-</td><td>-</td>"
+            f'<td>{year}</td><td><a href="/traffic_controller/report/{station}/{year}">View</a></td></tr>'
+            for i, (year, _) in enumerate(files, 1))
+        write(page_key("/traffic_controller", {"location": station, "submit": "1"}), _listing_page(
+            f'<table class="link-table column span-24"><tbody><tr>{header}</tr>{rows}</tbody></table>'))
+        for year, path in files:
+            with open(path, encoding="utf-8") as fh:
+                export = fh.read()
+            table = export[export.index("<table"):export.rindex("</table>") + len("</table>")]
+            write(page_key(f"/traffic_controller/report/{station}/{year}"), _listing_page(
+                f'<h2>{station} {year}</h2><button onclick="exportToExcel(\'{year}\', \'{station}\')">Export</button>{table}'))
+            write(page_key("/traffic_controller/exportToExcel", {"first_param": year, "second_param": station}), export)
+            written += 1
+    return written
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves recorded pages; settings come from the server instance"""
+
+    def _respond(self, params: Optional[dict]):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = random.random() < server.fail_rate
+        if server.latency:
+            time.sleep(server.latency)
+        if fail:
+            self.send_error(503, "injected failure")
+            return
+        path = os.path.join(server.recordings, page_key(urllib.parse.urlsplit(self.path).path, params))
+        if not os.path.exists(path):
+            self.send_error(404)
+            return
+        mtime = int(os.path.getmtime(path))
+        since = self.headers.get("If-Modified-Since")
+        if since:
+            try:
+                if parsedate_to_datetime(since).timestamp() >= mtime:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+            except (TypeError, ValueError):
+                pass
+        with open(path, "rb") as fh:
+            content = fh.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=UTF-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Last-Modified", self.date_time_string(mtime))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        self._respond(query or None)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        fields = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode("utf-8")))
+        self._respond(fields or None)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def make_server(host: str = "127.0.0.1", port: int = 8765, recordings: str = recordings_dir,
+                fail_rate: float = 0.0, latency: float = 0.0, verbose: bool = False) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.recordings = recordings
+    server.fail_rate = fail_rate
+    server.latency = latency
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.requests = 0
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the SSRN traffic_controller site, serving recorded pages")
+    sub = parser.add_subparsers(dest="command", required=True)
+    record = sub.add_parser("record", help="build recordings from downloaded exports")
+    record.add_argument("--source-dir", default=download_dir)
+    record.add_argument("--recordings", default=recordings_dir)
+    serve = sub.add_parser("serve", help="serve the recordings over HTTP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--recordings", default=recordings_dir)
+    serve.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    serve.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    serve.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        print(f"Recorded {record_from_downloads(args.source_dir, args.recordings)} report page(s) in {args.recordings}")
+        return
+    server = make_server(args.host, args.port, args.recordings, args.fail_rate, args.latency, args.verbose)
+    print(f"Serving {args.recordings} on http://{args.host}:{args.port}/traffic_controller")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
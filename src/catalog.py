@@ -0,0 +1,250 @@
+import os
+import re
+import json
+import fnmatch
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+batch_dir = os.path.join(project_root, "data", "batch")
+catalog_path = os.path.join(project_root, "data", "cache", "catalog.json")
+
+# bump when the indexed fields change so an older catalog is rebuilt
+catalog_version = 1
+
+# SSRN count files are named <station>_traffic_count_<survey year>.csv
+_name_pattern = re.compile(r"^(?P<station>.+)_traffic_count_(?P<year>\d{4})$")
+# a data row starts with an ISO date (load_batch._date_prefix)
+_date_prefix = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+class CatalogEntry(NamedTuple):
+    """What the loader needs to know about one batch file without opening it"""
+    size: int
+    mtime_ns: int
+    station: Optional[str]          # from the file name; None for names that do not follow the SSRN pattern
+    year: Optional[int]             # survey year from the file name (the data may start in the next year)
+    min_date: Optional[str]         # first and last ISO date of the data rows
+    max_date: Optional[str]
+    rows: Optional[int]             # data rows: hours of a count file, records of a vehicle CSV
+    layout: Optional[dict]          # load_batch.CountLayout of a count file; None for vehicle CSVs
+
+def _key(path: str) -> str:
+    # project-relative with forward slashes, like the load manifest
+    return os.path.relpath(os.path.abspath(path), project_root).replace(os.sep, "/")
+
+def _is_under(key: str, dir_key: str) -> bool:
+    return dir_key == "." or key == dir_key or key.startswith(dir_key + "/")
+
+def parse_name(filepath: str) -> Tuple[Optional[str], Optional[int]]:
+    """(station, survey year) of e.g. NH02-006_traffic_count_2024.csv; (None, None) for other names"""
+    match = _name_pattern.match(os.path.splitext(os.path.basename(filepath))[0])
+    if match is None:
+        return None, None
+    return match.group("station"), int(match.group("year"))
+
+def _scan_count_dates(filepath: str, data_start: int) -> Tuple[Optional[str], Optional[str], int]:
+    # the date is the first ten characters of a data row; ISO dates compare as text
+    first = last = None
+    rows = 0
+    with open(filepath, encoding="utf-8", errors="replace") as fh:
+        for i, line in enumerate(fh):
+            if i < data_start or not _date_prefix.match(line):
+                continue
+            day = line[:10]
+            if first is None or day < first:
+                first = day
+            if last is None or day > last:
+                last = day
+            rows += 1
+    return first, last, rows
+
+def _scan_vehicle_dates(filepath: str) -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    try:
+        df = pd.read_csv(filepath, dtype=str)
+    except Exception:
+        return None, None, None
+    if "departure_time" not in df.columns:
+        return None, None, len(df)
+    departures = pd.to_datetime(df["departure_time"], errors="coerce").dropna()
+    if departures.empty:
+        return None, None, len(df)
+    return departures.min().date().isoformat(), departures.max().date().isoformat(), len(df)
+
+def index_file(filepath: str, st: os.stat_result) -> CatalogEntry:
+    """Read one file's dates, row count and layout"""
+    # imported here: load_batch imports this module
+    import load_batch
+    station, year = parse_name(filepath)
+    layout = load_batch.detect_layout(filepath)
+    if layout is not None:
+        min_date, max_date, rows = _scan_count_dates(filepath, layout.data_start)
+    else:
+        min_date, max_date, rows = _scan_vehicle_dates(filepath)
+    return CatalogEntry(st.st_size, st.st_mtime_ns, station, year, min_date, max_date, rows,
+                        layout._asdict() if layout is not None else None)
+
+class Catalog:
+    """
+    Persistent index of the batch CSV files. refresh() lists only directories whose mtime changed
+    (a file added, removed or renamed) and re-reads only files whose size or mtime changed.
+    Files and directories are keyed by their project-relative path.
+    """
+
+    def __init__(self, path: str = catalog_path):
+        self.path = path
+        self.dirs: Dict[str, dict] = {}     # dir -> {"mtime_ns", "files": [csv names], "subdirs": [names]}
+        self.files: Dict[str, CatalogEntry] = {}
+
+    @classmethod
+    def load(cls, path: str = catalog_path) -> "Catalog":
+        catalog = cls(path)
+        try:
+            with open(path, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return catalog
+        if data.get("version") != catalog_version:
+            return catalog
+        catalog.dirs = data["dirs"]
+        catalog.files = {k: CatalogEntry(**v) for k, v in data["files"].items()}
+        return catalog
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump({"version": catalog_version, "dirs": self.dirs,
+                       "files": {k: e._asdict() for k, e in sorted(self.files.items())}}, fh)
+        os.replace(tmp_path, self.path)
+
+    def _list_dir(self, path: str, mtime_ns: int) -> dict:
+        files, subdirs = [], []
+        with os.scandir(path) as it:
+            for item in it:
+                # like glob, hidden files and directories are not batch files
+                if item.name.startswith("."):
+                    continue
+                if item.is_dir():
+                    subdirs.append(item.name)
+                elif item.name.endswith(".csv") and item.is_file():
+                    files.append(item.name)
+        return {"mtime_ns": mtime_ns, "files": sorted(files), "subdirs": sorted(subdirs)}
+
+    def refresh(self, root: str = batch_dir) -> Tuple[int, int, int]:
+        """Bring the entries under root up to date. Returns (directories listed, files indexed, files removed)"""
+        listed = indexed = 0
+        seen_dirs, seen_files = set(), set()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            dir_key = _key(path)
+            seen_dirs.add(dir_key)
+            entry = self.dirs.get(dir_key)
+            if entry is None or entry["mtime_ns"] != mtime_ns:
+                entry = self.dirs[dir_key] = self._list_dir(path, mtime_ns)
+                listed += 1
+            stack.extend(os.path.join(path, name) for name in entry["subdirs"])
+            for name in entry["files"]:
+                filepath = os.path.join(path, name)
+                # rewriting a file in place does not touch its directory's mtime
+                try:
+                    st = os.stat(filepath)
+                except FileNotFoundError:
+                    continue
+                key = _key(filepath)
+                seen_files.add(key)
+                known = self.files.get(key)
+                if known is None or (known.size, known.mtime_ns) != (st.st_size, st.st_mtime_ns):
+                    self.files[key] = index_file(filepath, st)
+                    indexed += 1
+        root_key = _key(root)
+        for key in [k for k in self.dirs if _is_under(k, root_key) and k not in seen_dirs]:
+            del self.dirs[key]
+        removed = [k for k in self.files if _is_under(k, root_key) and k not in seen_files]
+        for key in removed:
+            del self.files[key]
+        return listed, indexed, len(removed)
+
+    def select(self, root: str = batch_dir, stations: Optional[Iterable[str]] = None,
+               years: Optional[Iterable[int]] = None, start: Optional[datetime] = None,
+               end: Optional[datetime] = None) -> List[Tuple[str, CatalogEntry]]:
+        """
+        (path, entry) of the files under root that match every given filter, sorted by path.
+        stations are shell patterns (NH08-*), matched case-insensitively. A file matches the date range
+        [start, end) when any of its data days falls inside it; files without dates never do.
+        """
+        root_key = _key(root)
+        patterns = [s.upper() for s in stations] if stations else None
+        years = set(years) if years else None
+        selected = []
+        for key, entry in sorted(self.files.items()):
+            if not _is_under(key, root_key):
+                continue
+            if patterns is not None and (entry.station is None
+                                         or not any(fnmatch.fnmatchcase(entry.station.upper(), p) for p in patterns)):
+                continue
+            if years is not None and entry.year not in years:
+                continue
+            if start is not None or end is not None:
+                if entry.min_date is None:
+                    continue
+                if end is not None and datetime.fromisoformat(entry.min_date) >= end:
+                    continue
+                if start is not None and datetime.fromisoformat(entry.max_date) + timedelta(days=1) <= start:
+                    continue
+            selected.append((os.path.join(project_root, key), entry))
+        return selected
+
+def refreshed(root: str = batch_dir, path: str = catalog_path) -> Catalog:
+    """The catalog with root refreshed and saved; an unwritable catalog file only costs the next run a rescan"""
+    catalog = Catalog.load(path)
+    listed, indexed, removed = catalog.refresh(root)
+    if listed or indexed or removed:
+        try:
+            catalog.save()
+        except OSError as e:
+            print(f"Could not save the file catalog {path}: {e}")
+    return catalog
+
+def add_filter_arguments(parser: argparse.ArgumentParser):
+    """--station, --year, --from and --to, shared by the catalog and loader CLIs"""
+    parser.add_argument("--station", action="append",
+                        help="only this station; a shell pattern such as 'NH08-*' selects a corridor (repeatable)")
+    parser.add_argument("--year", type=int, action="append", help="only this survey year (repeatable)")
+    parser.add_argument("--from", dest="start", type=datetime.fromisoformat,
+                        help="only files with data on or after this date")
+    parser.add_argument("--to", dest="end", type=datetime.fromisoformat,
+                        help="only files with data before this date (exclusive)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index the batch CSV files by station, year and date range")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = sub.add_parser("refresh", help="update the catalog from the batch directory")
+    refresh_parser.add_argument("--rebuild", action="store_true", help="forget the catalog and re-read every file")
+    list_parser = sub.add_parser("list", help="list catalogued files matching the filters")
+    add_filter_arguments(list_parser)
+    args = parser.parse_args(argv)
+
+    if args.command == "refresh":
+        catalog = Catalog() if args.rebuild else Catalog.load()
+        listed, indexed, removed = catalog.refresh(batch_dir)
+        catalog.save()
+        print(f"Catalog {catalog_path}: {len(catalog.files)} file(s); "
+              f"{listed} director(ies) listed, {indexed} file(s) indexed, {removed} removed")
+    else:
+        catalog = refreshed()
+        selected = catalog.select(batch_dir, args.station, args.year, args.start, args.end)
+        for path, e in selected:
+            print(f"{e.station or '-':<12} {e.year or '-':<5} {e.min_date or '-':<10} {e.max_date or '-':<10} "
+                  f"{e.rows if e.rows is not None else '-':>6}  {_key(path)}")
+        print(f"{len(selected)} of {len(catalog.files)} file(s)")
+
+if __name__ == "__main__":
+    main()
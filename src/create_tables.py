@@ -1,20 +1,118 @@
-from db import get_connection
+from db import get_connection, retrying
 
-# SQL commands to create tables
-TABLE_QUERIES = [
+# Query indexes on vehicles_batch. The loader can drop and rebuild them around large loads
+# (load_batch.py --defer-indexes); the source_file index stays because reloads delete by it.
+# BRIN suits the timestamps: rows arrive roughly in time order within each partition.
+VEHICLES_BATCH_INDEXES = {
+    "idx_vehicles_batch_departure_brin": "CREATE INDEX IF NOT EXISTS idx_vehicles_batch_departure_brin ON vehicles_batch USING brin (departure_time)",
+    "idx_vehicles_batch_arrival_brin": "CREATE INDEX IF NOT EXISTS idx_vehicles_batch_arrival_brin ON vehicles_batch USING brin (arrival_time)",
+    "idx_vehicles_batch_origin": "CREATE INDEX IF NOT EXISTS idx_vehicles_batch_origin ON vehicles_batch (origin)",
+    "idx_vehicles_batch_vehicle_type": "CREATE INDEX IF NOT EXISTS idx_vehicles_batch_vehicle_type ON vehicles_batch (vehicle_type)",
+    # natural key of a vehicle expanded from a traffic count file (load_batch.py --mode merge):
+    # station, vehicle type and its sequence number within the hour's count. departure_time is
+    # the hour plus an offset fixed by seq, so it stands in for the hour (and is the partition key,
+    # which every unique index must include). vehicle_number is not unique: Car and Car_b share
+    # the CAR prefix, the station is not in it and its sequence wraps at 1000.
+    # Rows of plain vehicle CSVs have no station and seq and never conflict.
+    "idx_vehicles_batch_natural_key": "CREATE UNIQUE INDEX IF NOT EXISTS idx_vehicles_batch_natural_key ON vehicles_batch (station, departure_time, vehicle_type, seq)",
+}
+
+# vehicles_batch and the index the loader relies on; also used by src/partitions.py migrate
+VEHICLES_BATCH_QUERIES = [
+    # range partitioned on departure_time; partitions (vehicles_batch_y2019 or vehicles_batch_y2019m03)
+    # are created on demand by the loader and managed with src/partitions.py
     """
     CREATE TABLE IF NOT EXISTS vehicles_batch (
-        vehicle_id SERIAL PRIMARY KEY,
+        vehicle_id SERIAL,
         vehicle_number VARCHAR(20) NOT NULL,
         vehicle_type VARCHAR(20),
-        departure_time TIMESTAMP,
+        departure_time TIMESTAMP NOT NULL,
         arrival_time TIMESTAMP,
         origin VARCHAR(50),
         destination VARCHAR(50),
+        recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        source_file VARCHAR(255),
+        station VARCHAR(50),
+        seq INTEGER,
+        PRIMARY KEY (vehicle_id, departure_time)
+    ) PARTITION BY RANGE (departure_time);
+    """,
+    """
+    ALTER TABLE vehicles_batch ADD COLUMN IF NOT EXISTS source_file VARCHAR(255);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_vehicles_batch_source_file ON vehicles_batch (source_file);
+    """,
+    """
+    ALTER TABLE vehicles_batch ADD COLUMN IF NOT EXISTS station VARCHAR(50), ADD COLUMN IF NOT EXISTS seq INTEGER;
+    """,
+]
+
+# SQL commands to create tables
+TABLE_QUERIES = VEHICLES_BATCH_QUERIES + [
+    """
+    CREATE TABLE IF NOT EXISTS load_manifest (
+        file_path VARCHAR(255) PRIMARY KEY,
+        file_size BIGINT NOT NULL,
+        file_mtime TIMESTAMP NOT NULL,
+        content_hash CHAR(64) NOT NULL,
+        row_count INTEGER NOT NULL,
+        target VARCHAR(10) NOT NULL DEFAULT 'vehicles',
+        storage VARCHAR(10) NOT NULL DEFAULT 'wide',
+        loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    # the load target and vehicle storage the file's rows were written for (load_batch.py --target,
+    # --storage); a run with another target or storage loads the file again
+    """
+    ALTER TABLE load_manifest ADD COLUMN IF NOT EXISTS target VARCHAR(10) NOT NULL DEFAULT 'vehicles';
+    """,
+    """
+    ALTER TABLE load_manifest ADD COLUMN IF NOT EXISTS storage VARCHAR(10) NOT NULL DEFAULT 'wide';
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS traffic_counts (
+        count_id SERIAL PRIMARY KEY,
+        location VARCHAR(50) NOT NULL,
+        hour_start TIMESTAMP NOT NULL,
+        vehicle_type VARCHAR(20) NOT NULL,
+        vehicle_count INTEGER NOT NULL CHECK (vehicle_count > 0),
+        source_file VARCHAR(255),
         recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
     """,
     """
+    CREATE INDEX IF NOT EXISTS idx_traffic_counts_source_file ON traffic_counts (source_file);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_traffic_counts_location_hour ON traffic_counts (location, hour_start);
+    """,
+    # Per-vehicle rows expanded on demand from traffic_counts, with the same
+    # vehicle_number, departure/arrival offset and origin/destination rules as load_batch
+    """
+    CREATE OR REPLACE VIEW traffic_count_vehicles AS
+    SELECT
+        upper(left(c.vehicle_type, 3)) || to_char(c.hour_start, 'YYMMDDHH24MI') || lpad((s.i % 1000)::text, 3, '0') AS vehicle_number,
+        c.vehicle_type,
+        c.hour_start + make_interval(mins => s.i * 2 + (s.i % 5) * 10) AS departure_time,
+        c.hour_start + make_interval(mins => s.i * 2 + (s.i % 5) * 10 + 90 + (s.i % 4) * 15) AS arrival_time,
+        CASE
+            WHEN c.vehicle_type LIKE '%Bus%' THEN c.location || '_Bus_Station'
+            WHEN c.vehicle_type LIKE '%Truck%' THEN c.location || '_Industrial_Area'
+            ELSE c.location || '_Entry_Point'
+        END AS origin,
+        CASE
+            WHEN c.vehicle_type LIKE '%Bus%' THEN 'City_Center'
+            WHEN c.vehicle_type LIKE '%Truck%' THEN 'Commercial_District'
+            ELSE 'Various_Destinations'
+        END AS destination,
+        c.location,
+        c.hour_start,
+        c.source_file
+    FROM traffic_counts c
+    CROSS JOIN LATERAL generate_series(0, c.vehicle_count - 1) AS s(i);
+    """,
+    """
     CREATE TABLE IF NOT EXISTS vehicles_realtime (
         vehicle_id SERIAL PRIMARY KEY,
         vehicle_number VARCHAR(20) NOT NULL,
@@ -25,25 +123,161 @@ TABLE_QUERIES = [
         status VARCHAR(20),
         recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
+    """,
+    # rows arrive in recorded_at order, so a BRIN index finds spatial_index.py's recent window cheaply
     """
-]
+    CREATE INDEX IF NOT EXISTS idx_vehicles_realtime_recorded_at_brin ON vehicles_realtime USING brin (recorded_at);
+    """,
+    # Compact storage (load_batch.py --storage compact): vehicle_facts keeps only ids of the
+    # repeated strings; vehicles_batch_view joins them back into the vehicles_batch columns
+    """
+    CREATE TABLE IF NOT EXISTS vehicle_types (
+        vehicle_type_id SMALLSERIAL PRIMARY KEY,
+        name VARCHAR(20) NOT NULL UNIQUE
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS locations (
+        location_id SERIAL PRIMARY KEY,
+        name VARCHAR(50) NOT NULL UNIQUE
+    );
+    """,
+    # loaded_at is the load time of every row of the file (vehicles_batch.recorded_at)
+    """
+    CREATE TABLE IF NOT EXISTS source_files (
+        source_file_id SERIAL PRIMARY KEY,
+        file_path VARCHAR(255) NOT NULL UNIQUE,
+        loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    # fixed-width columns first so no alignment padding is needed. The id columns are not declared
+    # as foreign keys: their per-row trigger checks made COPY 5x slower, and the loader only writes
+    # ids it has read from or inserted into the dimension tables in the same transaction
+    """
+    CREATE TABLE IF NOT EXISTS vehicle_facts (
+        departure_time TIMESTAMP,
+        arrival_time TIMESTAMP,
+        vehicle_id SERIAL PRIMARY KEY,
+        source_file_id INTEGER NOT NULL,
+        origin_id INTEGER,
+        destination_id INTEGER,
+        vehicle_type_id SMALLINT,
+        vehicle_number VARCHAR(20) NOT NULL
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_vehicle_facts_source_file ON vehicle_facts (source_file_id);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_vehicle_facts_departure_brin ON vehicle_facts USING brin (departure_time);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_vehicle_facts_origin ON vehicle_facts (origin_id);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_vehicle_facts_vehicle_type ON vehicle_facts (vehicle_type_id);
+    """,
+    """
+    CREATE OR REPLACE VIEW vehicles_batch_view AS
+    SELECT
+        f.vehicle_id,
+        f.vehicle_number,
+        t.name AS vehicle_type,
+        f.departure_time,
+        f.arrival_time,
+        o.name AS origin,
+        d.name AS destination,
+        s.loaded_at AS recorded_at,
+        s.file_path AS source_file
+    FROM vehicle_facts f
+    LEFT JOIN source_files s ON s.source_file_id = f.source_file_id
+    LEFT JOIN vehicle_types t ON t.vehicle_type_id = f.vehicle_type_id
+    LEFT JOIN locations o ON o.location_id = f.origin_id
+    LEFT JOIN locations d ON d.location_id = f.destination_id;
+    """,
+    # Rollups of the counted vehicles (src/rollups.py), maintained by load_batch per file.
+    # The hourly rows keep their source file so a reload can take the old contribution out
+    # of the daily tables; station is the location without its _traffic_count_<year> suffix
+    """
+    CREATE TABLE IF NOT EXISTS rollup_station_hour (
+        station VARCHAR(50) NOT NULL,
+        hour_start TIMESTAMP NOT NULL,
+        vehicle_type VARCHAR(20) NOT NULL,
+        source_file VARCHAR(255) NOT NULL,
+        vehicle_count INTEGER NOT NULL,
+        PRIMARY KEY (station, hour_start, vehicle_type, source_file)
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_rollup_station_hour_source_file ON rollup_station_hour (source_file);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rollup_station_day (
+        station VARCHAR(50) NOT NULL,
+        day DATE NOT NULL,
+        vehicle_type VARCHAR(20) NOT NULL,
+        vehicle_count BIGINT NOT NULL,
+        PRIMARY KEY (station, day, vehicle_type)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rollup_network_day (
+        day DATE NOT NULL,
+        vehicle_type VARCHAR(20) NOT NULL,
+        vehicle_count BIGINT NOT NULL,
+        PRIMARY KEY (day, vehicle_type)
+    );
+    """,
+    # Work queue of batch files shared by loader workers on any number of hosts (src/load_queue.py).
+    # Workers claim queued rows with FOR UPDATE SKIP LOCKED and refresh heartbeat_at while loading.
+    # timestamptz, because the hosts comparing heartbeats may run in different time zones
+    """
+    CREATE TABLE IF NOT EXISTS load_jobs (
+        file_path VARCHAR(255) PRIMARY KEY,
+        file_size BIGINT NOT NULL,
+        status VARCHAR(10) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker VARCHAR(100),
+        available_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        claimed_at TIMESTAMPTZ,
+        heartbeat_at TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ,
+        inserted INTEGER,
+        skipped INTEGER,
+        error TEXT,
+        enqueued_at TIMESTAMPTZ DEFAULT now()
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_load_jobs_queued ON load_jobs (file_size DESC, file_path) WHERE status = 'queued';
+    """,
+] + list(VEHICLES_BATCH_INDEXES.values())
 
-def create_tables():
-    conn = None
+# vehicles_batch tables created before partitioning are plain heap tables
+is_partitioned_sql = "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'vehicles_batch'::regclass)"
+
+def _create_tables():
+    conn = get_connection()
     try:
-        conn = get_connection()
         cur = conn.cursor()
         for query in TABLE_QUERIES:
             cur.execute(query)
             print("Table created or already exists.")
         conn.commit()
+        cur.execute(is_partitioned_sql)
+        if not cur.fetchone()[0]:
+            print("vehicles_batch is not partitioned; convert it with: python src/partitions.py migrate")
         cur.close()
+    finally:
+        conn.close()
+        print("Connection closed.")
+
+def create_tables():
+    # every statement is idempotent, so after a dropped connection they all run again on a new one
+    try:
+        retrying(_create_tables, what="Creating tables")
     except Exception as e:
         print("Error creating tables:", e)
-    finally:
-        if conn:
-            conn.close()
-            print("Connection closed.")
 
 if __name__ == "__main__":
     create_tables()
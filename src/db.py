@@ -1,14 +1,206 @@
 from dotenv import load_dotenv
 import os
+import time
+import hashlib
+from typing import Callable, Dict, Sequence, TypeVar
 import psycopg2
-
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
 load_dotenv()
 
-def get_connection():
-    return psycopg2.connect(
-        host = os.getenv("DB_HOST"),
-        port = os.getenv("DB_PORT"),
-        dbname = os.getenv("DB_NAME"),
-        user = os.getenv("DB_USER"),
-        password = os.getenv("DB_PASS")
-    )
\ No newline at end of file
+# loads NOTIFY this channel in their transaction, so listeners hear of a load when it commits
+load_channel = "traffic_loaded"
+
+# connecting is retried with doubling delays: a restarting server or a network blip should
+# not abort a long load
+connect_retries = int(os.getenv("DB_CONNECT_RETRIES") or 5)
+retry_delay = float(os.getenv("DB_RETRY_DELAY") or 0.5)
+# a pooled connection idle for longer than this is checked with a round trip before it is handed out
+pool_check_idle = float(os.getenv("DB_POOL_CHECK_IDLE") or 30)
+
+# libpq reports a lost or refused connection without a SQLSTATE; these are its messages for one.
+# Startup errors (authentication, unknown database, role or host name) are not among them and fail fast.
+connection_lost_messages = (
+    "server closed the connection unexpectedly",
+    "terminating connection",
+    "could not receive data from server",
+    "could not send data to server",
+    "SSL connection has been closed unexpectedly",
+    "no connection to the server",
+    "Connection reset by peer",
+    "Connection timed out",
+    "timeout expired",
+    # refused, or the socket is missing while the server restarts
+    "Is the server running",
+    "the database system is starting up",
+    "the database system is shutting down",
+    "the database system is in recovery mode",
+    "the database system is not yet accepting connections",
+)
+
+# Session settings per connection profile, sent as startup options so they hold for the whole
+# session (a SET inside a transaction is undone by its rollback).
+# bulk_load: with synchronous_commit off a commit does not wait for its WAL flush. A server crash
+# can lose the last few commits but never corrupts them; each load commits its manifest entry with
+# its rows, so a lost load is simply loaded again by the next run. The memory settings size the
+# merge/rollup sorts and the index rebuild after --defer-indexes.
+session_profiles: Dict[str, Dict[str, str]] = {
+    "default": {},
+    "bulk_load": {
+        "synchronous_commit": "off",
+        "work_mem": os.getenv("DB_BULK_WORK_MEM") or "64MB",
+        "maintenance_work_mem": os.getenv("DB_BULK_MAINTENANCE_WORK_MEM") or "512MB",
+        "temp_buffers": os.getenv("DB_BULK_TEMP_BUFFERS") or "32MB",
+    },
+}
+
+T = TypeVar("T")
+
+class Connection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers its session profile and its prepared statements"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profile = "default"
+        # server-side prepared statements outlive transactions (and their rollback) but not the session
+        self.prepared: Dict[str, str] = {}
+        # time.monotonic() when the connection last went idle in a pool
+        self.idle_since = time.monotonic()
+
+def connection_params(profile: str = "default"):
+    params = dict(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS")
+    )
+    settings = session_profiles[profile]
+    if settings:
+        params["options"] = " ".join(f"-c {name}={value}" for name, value in settings.items())
+    return params
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    True for errors a retry on a new connection can get past: a lost or refused connection,
+    a serialization failure or a deadlock. Statement errors (bad data, constraint violations) and
+    startup errors (wrong password, database or host name) are not.
+    """
+    if isinstance(exc, psycopg2.InterfaceError):
+        return True
+    if isinstance(exc, psycopg2.extensions.TransactionRollbackError):
+        return True
+    if isinstance(exc, psycopg2.OperationalError):
+        code = exc.pgcode or ""
+        if code:
+            # 08xxx connection exceptions and 57P0x shutdowns
+            return code.startswith("08") or code.startswith("57P0")
+        cursor = getattr(exc, "cursor", None)
+        if cursor is not None and cursor.connection.closed:
+            return True
+        message = str(exc)
+        return any(m in message for m in connection_lost_messages)
+    return False
+
+def backoff(attempt: int) -> float:
+    """Seconds to wait before retry number attempt (1-based)"""
+    return retry_delay * 2 ** (attempt - 1)
+
+def retrying(fn: Callable[[], T], retries: int = connect_retries, what: str = "database call") -> T:
+    """Call fn, retrying it after transient errors with doubling delays"""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            attempt += 1
+            if attempt > retries or not is_transient(e):
+                raise
+            delay = backoff(attempt)
+            print(f"{what} failed ({str(e).strip()}); retry {attempt}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+def get_connection(profile: str = "default"):
+    params = connection_params(profile)
+
+    def connect():
+        conn = psycopg2.connect(connection_factory=Connection, **params)
+        conn.profile = profile
+        return conn
+
+    return retrying(connect, what="Connecting to the database")
+
+def is_healthy(conn) -> bool:
+    """Round trip check of an idle connection; False when it is closed or the server is gone"""
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def rollback(conn):
+    """Roll back unless the connection is already gone (its transaction went with it)"""
+    if not conn.closed:
+        try:
+            conn.rollback()
+        except psycopg2.InterfaceError:
+            pass
+
+class ConnectionPool(ThreadedConnectionPool):
+    """
+    Thread-safe pool of profile connections. New connections are opened with retries;
+    getconn() checks a connection that sat idle for over pool_check_idle seconds before handing
+    it out and replaces a dead one. A connection lost in use fails its statement, which
+    retrying() and the load retries then run again on a new one.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, profile: str = "default"):
+        self.profile = profile
+        super().__init__(minconn, maxconn)
+
+    def _connect(self, key=None):
+        conn = get_connection(self.profile)
+        if key is not None:
+            self._used[key] = conn
+            self._rused[id(conn)] = key
+        else:
+            self._pool.append(conn)
+        return conn
+
+    def getconn(self, key=None):
+        # each dead connection is closed, so the loop ends with a pooled or a new connection
+        while True:
+            conn = super().getconn(key)
+            if not conn.closed and time.monotonic() - conn.idle_since < pool_check_idle:
+                return conn
+            if is_healthy(conn):
+                return conn
+            super().putconn(conn, key, close=True)
+
+    def putconn(self, conn, key=None, close=False):
+        conn.idle_since = time.monotonic()
+        super().putconn(conn, key, close=close or bool(conn.closed))
+
+def create_pool(minconn=1, maxconn=4, profile: str = "default") -> ConnectionPool:
+    # connections are opened lazily up to maxconn; use getconn()/putconn()
+    return ConnectionPool(minconn, maxconn, profile)
+
+def prepare(conn, sql: str, types: Sequence[str]) -> str:
+    """
+    Name of a server-side prepared statement for sql ($1, $2, ... parameters of the given types),
+    PREPAREd the first time it is used on conn. Run it with execute_prepared.
+    """
+    name = "stmt_" + hashlib.md5(sql.encode()).hexdigest()[:16]
+    if name not in conn.prepared:
+        with conn.cursor() as cur:
+            cur.execute(f"PREPARE {name} ({', '.join(types)}) AS {sql}")
+        conn.prepared[name] = sql
+    return name
+
+def execute_prepared(cur, name: str, params: Sequence):
+    """EXECUTE a prepared statement; the server skips parsing and planning its statement"""
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
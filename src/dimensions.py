@@ -0,0 +1,91 @@
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+# dimension -> (table, id column); origin and destination share the locations table
+dimension_tables = {
+    "vehicle_types": ("vehicle_types", "vehicle_type_id"),
+    "locations": ("locations", "location_id"),
+}
+# fact column -> (dimension, source column of the normalized vehicle frame)
+fact_columns = {
+    "vehicle_type_id": ("vehicle_types", "vehicle_type"),
+    "origin_id": ("locations", "origin"),
+    "destination_id": ("locations", "destination"),
+}
+# marks a NULL id in the encoded frame (ids are positive)
+null_id = -1
+
+source_file_upsert_sql = """
+INSERT INTO source_files (file_path) VALUES (%s)
+ON CONFLICT (file_path) DO UPDATE SET loaded_at = CURRENT_TIMESTAMP
+RETURNING source_file_id"""
+
+class DimensionCache:
+    """
+    Name -> id maps of the dimension tables, kept for the life of the process.
+    Names first seen in the current transaction are inserted there and only become
+    permanent cache entries on commit(), so a rolled back load never leaves ids behind.
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, Dict[str, int]] = {d: {} for d in dimension_tables}
+        self._pending: Dict[str, Dict[str, int]] = {d: {} for d in dimension_tables}
+
+    def lookup(self, conn, dimension: str, names: Iterable[str]) -> Dict[str, int]:
+        """Ids for names, inserting unknown names; one or two round trips only when something is new"""
+        known = self.ids[dimension]
+        pending = self._pending[dimension]
+        # sorted so concurrent loads insert shared names in the same order and cannot deadlock
+        missing = sorted({n for n in names if n not in known and n not in pending})
+        if missing:
+            table, id_column = dimension_tables[dimension]
+            cur = conn.cursor()
+            try:
+                # look up first: ON CONFLICT still draws a sequence value for every name it skips
+                cur.execute(f"SELECT name, {id_column} FROM {table} WHERE name = ANY(%s)", (missing,))
+                found = dict(cur.fetchall())
+                new = [n for n in missing if n not in found]
+                if new:
+                    cur.execute(f"INSERT INTO {table} (name) SELECT unnest(%s::text[]) ON CONFLICT (name) DO NOTHING", (new,))
+                    # a concurrent load may have inserted some of them; this sees its committed rows
+                    cur.execute(f"SELECT name, {id_column} FROM {table} WHERE name = ANY(%s)", (new,))
+                    found.update(cur.fetchall())
+            finally:
+                cur.close()
+            pending.update(found)
+        return {**known, **pending}
+
+    def commit(self):
+        for dimension, pending in self._pending.items():
+            self.ids[dimension].update(pending)
+            pending.clear()
+
+    def rollback(self):
+        for pending in self._pending.values():
+            pending.clear()
+
+    def encode(self, conn, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Fact id columns (int64, null_id for missing values) for a normalized vehicle frame"""
+        encoded = {}
+        for fact_column, (dimension, column) in fact_columns.items():
+            # factorize once per column; the per-row work is a single numpy take
+            codes, uniques = pd.factorize(df[column].astype("string"))
+            names: List[str] = [str(u) for u in uniques]
+            ids = self.lookup(conn, dimension, names)
+            table = np.array([ids[n] for n in names] + [null_id], dtype=np.int64)
+            encoded[fact_column] = table[codes]  # code -1 (NA) picks null_id
+        return encoded
+
+def source_file_id(conn, source_file: str) -> int:
+    """Id of a loaded file, stamping its loaded_at (the recorded_at of its rows)"""
+    cur = conn.cursor()
+    try:
+        cur.execute(source_file_upsert_sql, (source_file,))
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+
+# per-process cache used by the loader
+cache = DimensionCache()
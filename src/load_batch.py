@@ -1,53 +1,250 @@
 import os
+import io
+import re
+import csv
 import sys
 import glob
+import time
+import struct
+import hashlib
+import cProfile
+import pstats
+import shutil
+import argparse
+import itertools
+import tempfile
 import traceback
-from datetime import datetime, timedelta
-from typing import List, Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Tuple, Optional
 import uuid
 
+import numpy as np
 import pandas as pd
 from psycopg2.extras import execute_values
 
 try:
-    from db import get_connection
+    import db
+    from db import get_connection, create_pool, load_channel
 except Exception as e:
     print("ERROR: Could not import get_connection from src/db.py. Fix it first.")
     raise
 
+# pyarrow's multithreaded CSV reader is used for whole traffic count files when it is installed
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+import staging_cache
+import catalog
+import rollups
+import partitions
+import dimensions
+from metrics import RunMetrics, hot_functions, write_report
+
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 batch_dir = os.path.join(project_root, "data", "batch")
+reports_dir = os.path.join(project_root, "data", "reports")
 chunk_size = 2000
 
+# {table} is vehicles_batch, or one of its partitions when loads are routed (--route-partitions)
 insert_sql = """
-INSERT INTO vehicles_batch (vehicle_number, vehicle_type, departure_time, arrival_time, origin, destination) VALUES %s"""
+INSERT INTO {table} (vehicle_number, vehicle_type, departure_time, arrival_time, origin, destination, station, seq, source_file) VALUES %s"""
+# prepared inserts (--prepared): pages of prepared_page_rows rows are one server-side prepared
+# statement per connection and table, so the server parses and plans the INSERT only once
+prepared_page_rows = 500
+insert_param_types = ["varchar", "varchar", "timestamp", "timestamp", "varchar", "varchar", "varchar", "integer", "varchar"]
+
+# COPY streams many more rows per round trip than an INSERT page
+copy_chunk_size = 50000
+copy_sql = {
+    "text": "COPY {table} (vehicle_number, vehicle_type, departure_time, arrival_time, origin, destination, station, seq, source_file) FROM STDIN",
+    "binary": "COPY {table} (vehicle_number, vehicle_type, departure_time, arrival_time, origin, destination, station, seq, source_file) FROM STDIN WITH (FORMAT binary)",
+}
+loader_modes = ["copy", "values"]
+copy_formats = ["text", "binary"]
+
+# vehicle row storage: wide strings in vehicles_batch, or dimension ids in vehicle_facts
+# (read back through vehicles_batch_view); compact storage is written with COPY only
+storage_modes = ["wide", "compact"]
+copy_compact_sql = {
+    "text": "COPY vehicle_facts (vehicle_number, vehicle_type_id, departure_time, arrival_time, origin_id, destination_id, source_file_id) FROM STDIN",
+    "binary": "COPY vehicle_facts (vehicle_number, vehicle_type_id, departure_time, arrival_time, origin_id, destination_id, source_file_id) FROM STDIN WITH (FORMAT binary)",
+}
+delete_compact_source_sql = """
+DELETE FROM vehicle_facts f USING source_files s WHERE f.source_file_id = s.source_file_id AND s.file_path = %s"""
+
+# load targets: per-vehicle rows, raw hourly counts (traffic_counts), or both
+load_targets = ["vehicles", "counts", "both"]
+counts_insert_sql = """
+INSERT INTO traffic_counts (location, hour_start, vehicle_type, vehicle_count, source_file) VALUES %s"""
+delete_counts_source_sql = "DELETE FROM traffic_counts WHERE source_file = %s"
+
+# load modes: replace deletes the file's earlier vehicle rows and inserts all of its rows; merge
+# stages them and writes only the differences on the natural key (for corrected files)
+load_modes = ["replace", "merge"]
+merge_staging_table = "vehicles_merge_staging"
+# temp tables are never WAL-logged; the rows go at commit, the table stays for the session
+merge_staging_sql = f"""
+CREATE TEMP TABLE IF NOT EXISTS {merge_staging_table} (
+    vehicle_number VARCHAR(20),
+    vehicle_type VARCHAR(20),
+    departure_time TIMESTAMP,
+    arrival_time TIMESTAMP,
+    origin VARCHAR(50),
+    destination VARCHAR(50),
+    station VARCHAR(50),
+    seq INTEGER,
+    source_file VARCHAR(255)
+) ON COMMIT DELETE ROWS"""
+# the file's earlier rows whose key is gone (rows without a key are always replaced)
+merge_delete_sql = f"""
+DELETE FROM vehicles_batch v
+WHERE v.source_file = %s AND NOT EXISTS (
+    SELECT 1 FROM {merge_staging_table} s
+    WHERE s.station = v.station AND s.departure_time = v.departure_time
+      AND s.vehicle_type = v.vehicle_type AND s.seq = v.seq)"""
+# identical rows (which include the source file, so only the file's own rows are searched) are
+# filtered out first: they are neither rewritten nor draw a vehicle_id. A row of another file
+# with the same key is taken over by this one
+merge_upsert_sql = f"""
+INSERT INTO vehicles_batch (vehicle_number, vehicle_type, departure_time, arrival_time, origin, destination, station, seq, source_file)
+SELECT s.vehicle_number, s.vehicle_type, s.departure_time, s.arrival_time, s.origin, s.destination, s.station, s.seq, s.source_file
+FROM {merge_staging_table} s
+WHERE NOT EXISTS (
+    SELECT 1 FROM vehicles_batch v
+    WHERE v.source_file = %s
+      AND v.station = s.station AND v.departure_time = s.departure_time
+      AND v.vehicle_type = s.vehicle_type AND v.seq = s.seq
+      AND (v.vehicle_number, v.arrival_time, v.origin, v.destination, v.source_file)
+          IS NOT DISTINCT FROM (s.vehicle_number, s.arrival_time, s.origin, s.destination, s.source_file))
+ORDER BY s.departure_time
+ON CONFLICT (station, departure_time, vehicle_type, seq) DO UPDATE SET
+    vehicle_number = EXCLUDED.vehicle_number, arrival_time = EXCLUDED.arrival_time,
+    origin = EXCLUDED.origin, destination = EXCLUDED.destination,
+    source_file = EXCLUDED.source_file, recorded_at = CURRENT_TIMESTAMP"""
+
+# load manifest: one row per loaded file, used to skip unchanged files on rerun
+delete_source_sql = "DELETE FROM vehicles_batch WHERE source_file = %s"
+manifest_select_sql = "SELECT file_path, file_size, file_mtime, content_hash, target, storage FROM load_manifest"
+manifest_upsert_sql = """
+INSERT INTO load_manifest (file_path, file_size, file_mtime, content_hash, row_count, target, storage, loaded_at)
+VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+ON CONFLICT (file_path) DO UPDATE SET
+    file_size = EXCLUDED.file_size, file_mtime = EXCLUDED.file_mtime, content_hash = EXCLUDED.content_hash,
+    row_count = EXCLUDED.row_count, target = EXCLUDED.target, storage = EXCLUDED.storage,
+    loaded_at = EXCLUDED.loaded_at"""
+manifest_touch_sql = "UPDATE load_manifest SET file_size = %s, file_mtime = %s WHERE file_path = %s"
+# delivered to LISTENers (the queries.py result cache) when the load transaction commits
+notify_load_sql = "SELECT pg_notify(%s, %s)"
+
+# streaming mode: input CSV rows read per step (each expands to at most ~24 cells)
+stream_read_rows = 1000
 
 required_column = "vehicle_number"
 
-def find_csv_files(batch_dir: str) -> List[str]:
-    pattern = os.path.join(batch_dir, "**/*.csv")  # Made recursive to find files in subfolders
-    return sorted(glob.glob(pattern, recursive=True))
+# column name fragments that mark an SSRN traffic count file
+traffic_indicators = ['Start Time', 'Motorized Vehicle', 'Non-motorized Vehicle',
+                      'Truck', 'Bus', 'Car', 'Motor Cycle']
+# a data row starts with an ISO date; the year itself is not restricted
+_date_prefix = re.compile(r"\d{4}-\d{2}-\d{2}")
+# lines read to find the first data row when fingerprinting a header
+layout_probe_lines = 32
+
+# strings pd.read_csv treats as missing by default; rows_to_frame matches it
+_csv_na_values = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                  "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+
+# Vehicle type mapping based on the traffic count CSV structure: (name, count column offset)
+VEHICLE_TYPES = [
+    ('Multi_Axle_Truck', 0), ('Heavy_Truck', 1), ('Light_Truck', 2),
+    ('Big_Bus', 3), ('Mini_Bus', 4), ('Micro_Bus', 5),
+    ('Car', 6), ('Car_b', 7), ('Motor_Cycle', 8), ('Motor_Cycle_b', 9),
+    ('Utility_Vehicle', 10), ('Utility_Vehicle_b', 11),
+    ('Tractor', 12), ('Tractor_b', 13), ('Three_Wheeler', 14), ('Three_Wheeler_b', 15),
+    ('Four_Wheel_Drive', 16), ('Four_Wheel_Drive_b', 17),
+    ('Power_Tiller', 18), ('Power_Tiller_b', 19),
+    ('Rickshaw', 20), ('Rickshaw_b', 21), ('Hand_Cart', 22), ('Hand_Cart_b', 23)
+]
+
+# per-stage/per-file timings of the current run; main() writes them out as the run report
+metrics = RunMetrics()
+
+# '000'..'999' suffixes for vehicle numbers
+_SEQUENCE_SUFFIXES = np.array([f"{i:03d}" for i in range(1000)], dtype=object)
+
+def find_csv_files(batch_dir: str, stations: Optional[List[str]] = None, years: Optional[List[int]] = None,
+                   start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+    """
+    CSV files under batch_dir (recursively), optionally filtered by station, survey year and data dates.
+    The file catalog is refreshed first, so only new or changed files are opened.
+    """
+    return [path for path, _ in catalog.refreshed(batch_dir).select(batch_dir, stations, years, start, end)]
 
 def is_traffic_count_file(df: pd.DataFrame) -> bool:
     """Detect if this is a traffic count file based on column structure"""
-    # Check for traffic count indicators
-    traffic_indicators = ['Start Time', 'Motorized Vehicle', 'Non-motorized Vehicle', 
-                         'Truck', 'Bus', 'Car', 'Motor Cycle']
-    
     # Convert column names to string and check
     col_str = ' '.join([str(col) for col in df.columns])
     return any(indicator in col_str for indicator in traffic_indicators)
 
-def transform_traffic_count_to_vehicles(df: pd.DataFrame, filepath: str) -> pd.DataFrame:
-    """Transform traffic count data into individual vehicle records"""
+def _parse_count(value) -> int:
+    """Parse a single count cell the same way for every file (blank/invalid -> 0)"""
+    if pd.isna(value) or str(value).strip() == '':
+        return 0
+    try:
+        return max(int(float(value)), 0)
+    except (ValueError, TypeError, OverflowError):
+        return 0
+
+def _parse_base_datetimes(date_strs: pd.Series, time_strs: pd.Series) -> pd.Series:
+    """Parse 'date time' strings, falling back to per-value parsing for odd formats"""
+    combined = date_strs + ' ' + time_strs
+    parsed = pd.to_datetime(combined, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    for idx in parsed.index[parsed.isna()]:
+        try:
+            parsed[idx] = pd.to_datetime(combined[idx])
+        except Exception:
+            pass
+    return parsed
+
+class CountCells(NamedTuple):
+    """Parsed count matrix of a traffic count file, flattened in row -> type order"""
+    counts: np.ndarray          # vehicles per (row, type) cell
+    cell_ends: np.ndarray       # cumulative counts: records before the end of each cell
+    base_datetimes: np.ndarray  # datetime64 per data row
+    cell_prefix: np.ndarray     # vehicle number prefix per cell: TYPE + YYMMDD + HHMM
+    type_names: np.ndarray
+    origins: np.ndarray
+    destinations: np.ndarray
+    location: str
+
+    @property
+    def total(self) -> int:
+        return int(self.cell_ends[-1]) if len(self.cell_ends) else 0
+
+def _is_data_date(value) -> bool:
+    """True for a cell that starts a data row: an ISO date in any valid year"""
+    if not isinstance(value, str) or not _date_prefix.match(value):
+        return False
+    try:
+        datetime.strptime(value[:10], '%Y-%m-%d')
+    except ValueError:
+        return False
+    return True
+
+def parse_traffic_count_cells(df: pd.DataFrame, filepath: str, find_data_start: bool = True) -> CountCells:
+    """
+    Parse the count matrix of a traffic count file once.
+    find_data_start=False treats every row as a candidate data row (later chunks of a streamed file).
+    """
     
     # Find where actual data starts (skip headers)
     data_start_idx = 0
-    for i, row in df.iterrows():
-        first_col = str(df.iloc[i, 0]) if not pd.isna(df.iloc[i, 0]) else ""
-        if first_col.startswith('2011') or first_col.startswith('2012') or first_col.startswith('2013') or first_col.startswith('2014') or first_col.startswith('2015') or first_col.startswith('2016') or first_col.startswith('2018') or first_col.startswith('2020') or first_col.startswith('2021') or first_col.startswith('2022') or first_col.startswith('2024'):
-            data_start_idx = i
-            break
+    if find_data_start:
+        data_start_idx = next((i for i, v in enumerate(df.iloc[:, 0]) if _is_data_date(v)), 0)
     
     # Get data rows only
     data_df = df.iloc[data_start_idx:].copy()
@@ -57,97 +254,238 @@ def transform_traffic_count_to_vehicles(df: pd.DataFrame, filepath: str) -> pd.D
     data_df = data_df[~data_df.iloc[:, 0].astype(str).str.contains(
         'Sub-total|Total|Average|Composition|Grand Total', case=False, na=False)]
     
-    vehicles = []
+    # Get date and time
+    date_strs = data_df.iloc[:, 0].astype(str)
+    if data_df.shape[1] > 1:
+        time_strs = data_df.iloc[:, 1].astype(str)
+    else:
+        time_strs = pd.Series("00:00:00", index=data_df.index)
+    
+    # Count matrix: one row per hour, one column per vehicle type (counts start from column 2)
+    n_types = max(min(len(VEHICLE_TYPES), data_df.shape[1] - 2), 0)
+    raw_counts = data_df.iloc[:, 2:2 + n_types].to_numpy(dtype=object)
+    codes, uniques = pd.factorize(raw_counts.ravel())
+    lookup = np.array([_parse_count(u) for u in uniques] + [0], dtype=np.int64)
+    counts = lookup[codes].reshape(raw_counts.shape)  # code -1 (missing) picks the trailing 0
+    
+    type_names = [name for name, _ in VEHICLE_TYPES[:n_types]]
+    return _build_count_cells(date_strs, time_strs, counts, type_names, filepath)
+
+def _build_count_cells(date_strs: pd.Series, time_strs: pd.Series, counts: np.ndarray,
+                       type_names: List[str], filepath: str) -> CountCells:
+    """CountCells from per-row date/time strings and a (rows x types) integer count matrix"""
     location = os.path.basename(filepath).replace('.csv', '')
+    n_types = len(type_names)
     
-    for _, row in data_df.iterrows():
-        try:
-            # Get date and time
-            date_str = str(row.iloc[0])  # First column is Date
-            time_str = str(row.iloc[1]) if len(row) > 1 else "00:00:00"  # Second column is time
-            
-            if not date_str.startswith('20'):  # Skip invalid date rows
-                continue
-                
-            # Parse base datetime
-            try:
-                base_datetime = pd.to_datetime(f"{date_str} {time_str}")
-            except:
-                continue
-            
-            # Extract vehicle counts from the row
-            # Based on your CSV structure, counts start from column 2
-            counts_data = row.iloc[2:].tolist()
-            
-            # Vehicle type mapping based on your CSV structure
-            vehicle_types = [
-                ('Multi_Axle_Truck', 0), ('Heavy_Truck', 1), ('Light_Truck', 2),
-                ('Big_Bus', 3), ('Mini_Bus', 4), ('Micro_Bus', 5),
-                ('Car', 6), ('Car_b', 7), ('Motor_Cycle', 8), ('Motor_Cycle_b', 9),
-                ('Utility_Vehicle', 10), ('Utility_Vehicle_b', 11),
-                ('Tractor', 12), ('Tractor_b', 13), ('Three_Wheeler', 14), ('Three_Wheeler_b', 15),
-                ('Four_Wheel_Drive', 16), ('Four_Wheel_Drive_b', 17),
-                ('Power_Tiller', 18), ('Power_Tiller_b', 19),
-                ('Rickshaw', 20), ('Rickshaw_b', 21), ('Hand_Cart', 22), ('Hand_Cart_b', 23)
-            ]
-            
-            # Generate individual vehicle records
-            for vehicle_type, col_idx in vehicle_types:
-                if col_idx < len(counts_data):
-                    try:
-                        count = int(float(counts_data[col_idx])) if pd.notna(counts_data[col_idx]) and str(counts_data[col_idx]).strip() != '' else 0
-                    except (ValueError, TypeError):
-                        count = 0
-                    
-                    # Create individual records for each vehicle
-                    for i in range(count):
-                        # Generate unique vehicle number (max 20 chars)
-                        date_short = date_str.replace('-', '')[-6:]  # Last 6 digits of date (YYMMDD)
-                        time_short = time_str.replace(':', '')[:4]   # First 4 digits of time (HHMM)
-                        vehicle_number = f"{vehicle_type[:3].upper()}{date_short}{time_short}{i%1000:03d}"
-                        
-                        # Create realistic departure and arrival times
-                        # Spread departures within the hour
-                        departure_offset = timedelta(minutes=i * 2 + (i % 5) * 10)
-                        departure_time = base_datetime + departure_offset
-                        
-                        # Arrival time 30 minutes to 2 hours later
-                        arrival_offset = timedelta(hours=1, minutes=30 + (i % 4) * 15)
-                        arrival_time = departure_time + arrival_offset
-                        
-                        # Determine origin and destination based on vehicle type
-                        if 'Bus' in vehicle_type:
-                            origin = f"{location}_Bus_Station"
-                            destination = "City_Center"
-                        elif 'Truck' in vehicle_type:
-                            origin = f"{location}_Industrial_Area"
-                            destination = "Commercial_District"
-                        else:
-                            origin = f"{location}_Entry_Point"
-                            destination = "Various_Destinations"
-                        
-                        vehicles.append({
-                            'vehicle_number': vehicle_number,
-                            'vehicle_type': vehicle_type.replace('_', ' '),
-                            'departure_time': departure_time.strftime('%Y-%m-%d %H:%M:%S'),
-                            'arrival_time': arrival_time.strftime('%Y-%m-%d %H:%M:%S'),
-                            'origin': origin,
-                            'destination': destination
-                        })
-                        
-        except Exception as e:
-            print(f"Error processing row in traffic count transformation: {e}")
-            continue
+    # skip rows without a date and rows whose timestamp does not parse
+    valid = date_strs.str.match(r"\d{4}").fillna(False).to_numpy(dtype=bool)
+    base_datetimes = _parse_base_datetimes(date_strs[valid], time_strs[valid])
+    parsed = base_datetimes.notna().to_numpy()
+    rows = np.flatnonzero(valid)[parsed]
+    base_datetimes = base_datetimes[parsed].to_numpy(dtype='datetime64[ns]')
+    date_strs = date_strs.to_numpy()[rows]
+    time_strs = time_strs.to_numpy()[rows]
+    counts = counts[rows].ravel()
+    
+    # Vehicle number prefix per cell (max 20 chars with the sequence): TYPE + YYMMDD + HHMM.
+    # Empty cells are never expanded, so only cells with vehicles get a prefix.
+    type_prefixes = np.array([name[:3].upper() for name in type_names], dtype=object)
+    row_prefixes = np.array([d.replace('-', '')[-6:] + t.replace(':', '')[:4] for d, t in zip(date_strs, time_strs)],
+                            dtype=object)
+    occupied = np.flatnonzero(counts)
+    cell_prefix = np.empty(len(counts), dtype=object)
+    if n_types:
+        cell_prefix[occupied] = type_prefixes[occupied % n_types] + row_prefixes[occupied // n_types]
+    
+    # Determine origin and destination based on vehicle type
+    origins = []
+    destinations = []
+    for vehicle_type in type_names:
+        if 'Bus' in vehicle_type:
+            origins.append(f"{location}_Bus_Station")
+            destinations.append("City_Center")
+        elif 'Truck' in vehicle_type:
+            origins.append(f"{location}_Industrial_Area")
+            destinations.append("Commercial_District")
+        else:
+            origins.append(f"{location}_Entry_Point")
+            destinations.append("Various_Destinations")
+    
+    return CountCells(
+        counts=counts,
+        cell_ends=np.cumsum(counts, dtype=np.int64),
+        base_datetimes=base_datetimes,
+        cell_prefix=cell_prefix,
+        type_names=np.array([name.replace('_', ' ') for name in type_names], dtype=object),
+        origins=np.array(origins, dtype=object),
+        destinations=np.array(destinations, dtype=object),
+        location=location,
+    )
+
+class CountLayout(NamedTuple):
+    """Where the data sits in one SSRN header variant; detected once per header signature"""
+    data_start: int                 # header lines before the first data row
+    width: int                      # columns per line
+    date_col: int
+    time_col: int
+    count_cols: Tuple[int, ...]     # file column of each vehicle type's counts
+    type_names: Tuple[str, ...]     # VEHICLE_TYPES name per count column
+
+# header signature -> layout (None for headers that are not traffic count headers)
+_layout_cache: Dict[Tuple[str, ...], Optional[CountLayout]] = {}
+
+def _build_layout(header: List[List[str]]) -> Optional[CountLayout]:
+    if not header or not any(indicator in ' '.join(header[0]) for indicator in traffic_indicators):
+        return None
+    width = max(len(row) for row in header)
+    types = [(name, 2 + offset) for name, offset in VEHICLE_TYPES if 2 + offset < width]
+    return CountLayout(
+        data_start=len(header),
+        width=width,
+        date_col=0,
+        time_col=1,
+        count_cols=tuple(col for _, col in types),
+        type_names=tuple(name for name, _ in types),
+    )
+
+def detect_layout(filepath: str) -> Optional[CountLayout]:
+    """
+    Layout of a traffic count CSV, or None when the file has no recognised count header.
+    The header is every line before the first data row; its text is the cache key,
+    so each distinct header variant is analysed only once per process.
+    """
+    header = []
+    try:
+        with open(filepath, newline='', encoding='utf-8') as fh:
+            for row in itertools.islice(csv.reader(fh), layout_probe_lines):
+                if row and _is_data_date(row[0]):
+                    break
+                header.append(row)
+            else:
+                return None  # no data row near the top
+    except (OSError, UnicodeDecodeError, csv.Error):
+        return None
+    signature = tuple(','.join(row) for row in header)
+    if signature not in _layout_cache:
+        _layout_cache[signature] = _build_layout(header)
+    return _layout_cache[signature]
+
+def _read_count_table(filepath: str, layout: CountLayout) -> Optional[pd.DataFrame]:
+    """
+    Data rows of a count file through pyarrow.csv: date/time as str, counts cast to int32 in Arrow.
+    None when the file does not fit (ragged lines, count cells that are not plain integers).
+    """
+    names = [str(i) for i in range(layout.width)]
+    columns = [layout.date_col, layout.time_col, *layout.count_cols]
+    try:
+        table = pa_csv.read_csv(
+            filepath,
+            read_options=pa_csv.ReadOptions(skip_rows=layout.data_start, column_names=names),
+            convert_options=pa_csv.ConvertOptions(include_columns=[names[c] for c in columns],
+                                                  column_types={n: pa.string() for n in names},
+                                                  strings_can_be_null=True))
+        table = table.filter(pc.fill_null(pc.match_substring_regex(table[names[layout.date_col]], r"^\d{4}-\d{2}-\d{2}"), False))
+        frame = {layout.date_col: table[names[layout.date_col]].to_pandas(),
+                 layout.time_col: table[names[layout.time_col]].to_pandas()}
+        for c in layout.count_cols:
+            counts = pc.fill_null(pc.cast(table[names[c]], pa.int32()), 0)
+            frame[c] = pc.max_element_wise(counts, 0).to_numpy()
+    except (pa.ArrowInvalid, ValueError):
+        return None
+    return pd.DataFrame(frame)
+
+def read_count_frames(filepath: str, layout: CountLayout, chunk_rows: Optional[int] = None) -> Iterable[pd.DataFrame]:
+    """
+    Read only the date, time and count columns below the header.
+    Whole files go through pyarrow.csv when it is installed (data rows only, int32 counts);
+    streamed files and files pyarrow cannot type use chunked C-engine reads of str cells.
+    """
+    if not chunk_rows and pa is not None:
+        frame = _read_count_table(filepath, layout)
+        if frame is not None:
+            return [frame]
+    options = dict(header=None, skiprows=layout.data_start,
+                   usecols=[layout.date_col, layout.time_col, *layout.count_cols], dtype=str)
+    if chunk_rows:
+        return pd.read_csv(filepath, chunksize=stream_read_rows, **options)
+    return [pd.read_csv(filepath, **options)]
+
+def parse_layout_cells(frame: pd.DataFrame, layout: CountLayout, filepath: str) -> CountCells:
+    """CountCells from a read_count_frames frame; counts become a compact int32 matrix"""
+    date_strs = frame[layout.date_col].astype(str)
+    time_strs = frame[layout.time_col].astype(str)
+    # only data rows matter; summary rows below the data hold percentages and factors
+    data_rows = np.flatnonzero(date_strs.str.match(_date_prefix).to_numpy(dtype=bool))
+    block = frame[list(layout.count_cols)].iloc[data_rows]
+    if all(pd.api.types.is_integer_dtype(dtype) for dtype in block.dtypes):
+        counts = block.to_numpy(dtype=np.int32)
+    else:
+        # convert each distinct cell text once with the same rules as _parse_count
+        # (blank/invalid -> 0, fractions truncated, negatives -> 0)
+        codes, uniques = pd.factorize(block.to_numpy(dtype=object).ravel())
+        values = pd.to_numeric(pd.Series(uniques, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+        values = np.clip(np.trunc(np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0)), 0, np.iinfo(np.int32).max)
+        lookup = np.append(values.astype(np.int32), np.int32(0))
+        counts = lookup[codes].reshape(block.shape)  # code -1 (missing) picks the trailing 0
+    return _build_count_cells(date_strs.iloc[data_rows], time_strs.iloc[data_rows], counts,
+                              list(layout.type_names), filepath)
+
+def expand_count_cells(cells: CountCells, start: int = 0, stop: Optional[int] = None) -> pd.DataFrame:
+    """
+    Expand records [start, stop) of the parsed count matrix into individual vehicle records.
+    Memory is proportional to stop - start, however large the file is.
+    """
+    stop = cells.total if stop is None else min(stop, cells.total)
+    n_types = len(cells.type_names)
+    
+    # Locate each record's (row, type) cell and its sequence number within the cell
+    positions = np.arange(start, max(stop, start), dtype=np.int64)
+    cell_idx = np.searchsorted(cells.cell_ends, positions, side='right')
+    seq = positions - (cells.cell_ends[cell_idx] - cells.counts[cell_idx])
+    row_idx = cell_idx // max(n_types, 1)
+    type_idx = cell_idx % max(n_types, 1)
+    
+    # Generate unique vehicle number: cell prefix + sequence
+    vehicle_numbers = cells.cell_prefix[cell_idx] + _SEQUENCE_SUFFIXES[seq % 1000]
+    
+    # Spread departures within the hour; arrival 30 minutes to 2 hours later
+    departure_minutes = seq * 2 + (seq % 5) * 10
+    departure_times = cells.base_datetimes[row_idx] + departure_minutes.astype('timedelta64[m]')
+    arrival_minutes = 90 + (seq % 4) * 15
+    arrival_times = departure_times + arrival_minutes.astype('timedelta64[m]')
     
+    return pd.DataFrame({
+        'vehicle_number': vehicle_numbers,
+        'vehicle_type': cells.type_names[type_idx],
+        'departure_time': departure_times,
+        'arrival_time': arrival_times,
+        'origin': cells.origins[type_idx],
+        'destination': cells.destinations[type_idx],
+        # natural key with vehicle_type and departure_time (see idx_vehicles_batch_natural_key)
+        'station': rollups.station_of(cells.location),
+        'seq': seq.astype(np.int32),
+    })
+
+def transform_traffic_count_to_vehicles(df: pd.DataFrame, filepath: str) -> pd.DataFrame:
+    """
+    Transform traffic count data into individual vehicle records.
+    The count matrix is parsed once and expanded with numpy,
+    so no Python object is built per vehicle.
+    departure_time/arrival_time are datetime64 columns (they used to be '%Y-%m-%d %H:%M:%S'
+    strings that normalize_dataframe then parsed); tests/test_transform.py checks both forms.
+    """
+    vehicles = expand_count_cells(parse_traffic_count_cells(df, filepath))
     print(f"Transformed {len(vehicles)} vehicle records from traffic count data")
-    return pd.DataFrame(vehicles)
+    return vehicles
 
 def normalize_dataframe(df: pd.DataFrame, filepath: str) -> pd.DataFrame:
     # Check if this is a traffic count file and transform if needed
     if is_traffic_count_file(df):
         print(f"Detected traffic count format in {os.path.basename(filepath)}")
         df = transform_traffic_count_to_vehicles(df, filepath)
-    
+    return clean_vehicle_columns(df)
+
+def clean_vehicle_columns(df: pd.DataFrame) -> pd.DataFrame:
     expected_cols = ["vehicle_number", "vehicle_type", "departure_time", "arrival_time", "origin", "destination"]
     for c in expected_cols:
         if c not in df.columns:
@@ -158,6 +496,12 @@ def normalize_dataframe(df: pd.DataFrame, filepath: str) -> pd.DataFrame:
     for c in str_cols:
         df[c] = df[c].astype("string").str.strip()
 
+    # natural key columns; only vehicles expanded from count files have them
+    if "station" not in df.columns:
+        df["station"] = pd.Series(pd.NA, index=df.index, dtype="string")
+    if "seq" not in df.columns:
+        df["seq"] = pd.Series(pd.NA, index=df.index, dtype="Int32")
+
     # parse timestamps - allow multiple common formats ; coerce errors to NaT
     df["departure_time"] = pd.to_datetime(df["departure_time"], errors="coerce", utc=False)
     df["arrival_time"] = pd.to_datetime(df["arrival_time"], errors="coerce", utc=False)
@@ -169,6 +513,73 @@ def normalize_dataframe(df: pd.DataFrame, filepath: str) -> pd.DataFrame:
     df = df.reset_index(drop=True)
     return df
 
+def count_cells_to_frame(cells: CountCells) -> pd.DataFrame:
+    """Non-zero (location, hour, vehicle type, count) cells for the traffic_counts table"""
+    n_types = max(len(cells.type_names), 1)
+    nonzero = np.flatnonzero(cells.counts)
+    return pd.DataFrame({
+        'location': cells.location,
+        'hour_start': cells.base_datetimes[nonzero // n_types],
+        'vehicle_type': cells.type_names[nonzero % n_types],
+        'vehicle_count': cells.counts[nonzero],
+    })
+
+def iter_count_cells(raw_frames: Iterable[pd.DataFrame], filepath: str,
+                     layout: Optional[CountLayout] = None) -> Iterator[Tuple[Optional[CountCells], pd.DataFrame]]:
+    """
+    Yield (cells, raw) per read step; cells is None for plain vehicle CSVs.
+    With a layout the frames come from read_count_frames (data rows and count columns only).
+    """
+    for i, raw in enumerate(raw_frames):
+        with metrics.stage("parse_counts") as stage:
+            if layout is not None:
+                if i == 0:
+                    print(f"Detected traffic count format in {os.path.basename(filepath)}")
+                cells = parse_layout_cells(raw, layout, filepath)
+            elif not is_traffic_count_file(raw):
+                cells = None
+            else:
+                if i == 0:
+                    print(f"Detected traffic count format in {os.path.basename(filepath)}")
+                cells = parse_traffic_count_cells(raw, filepath, find_data_start=(i == 0))
+            stage["rows"] = len(raw)
+        yield cells, raw
+
+def iter_vehicle_frames(cells: Optional[CountCells], raw: pd.DataFrame,
+                        chunk_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """Normalized vehicle frames for one read step, at most chunk_rows records each"""
+    if cells is None:
+        with metrics.stage("normalize") as stage:
+            df = clean_vehicle_columns(raw)
+            stage["rows"] = len(df)
+        yield df
+        return
+    step = chunk_rows or max(cells.total, 1)
+    for start in range(0, cells.total, step):
+        with metrics.stage("expand") as stage:
+            vehicles = expand_count_cells(cells, start, start + step)
+            stage["rows"] = len(vehicles)
+        with metrics.stage("normalize") as stage:
+            df = clean_vehicle_columns(vehicles)
+            stage["rows"] = len(df)
+        yield df
+
+def iter_normalized_chunks(filepath: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """
+    Streaming pipeline: CSV reader -> count expansion -> normalization, as chained generators.
+    Each yielded frame holds at most chunk_rows records, so memory does not grow with the file.
+    """
+    reader = pd.read_csv(filepath, dtype=str, chunksize=stream_read_rows)
+    for cells, raw in iter_count_cells(reader, filepath):
+        yield from iter_vehicle_frames(cells, raw, chunk_rows)
+
+def read_file_counts(filepath: str) -> Optional[pd.DataFrame]:
+    """A file's non-zero count cells (count_cells_to_frame) without expanding vehicles; None for vehicle CSVs"""
+    layout = detect_layout(filepath)
+    raw_frames = read_count_frames(filepath, layout) if layout is not None else [pd.read_csv(filepath, dtype=str)]
+    frames = [count_cells_to_frame(cells) for cells, _ in iter_count_cells(raw_frames, filepath, layout) if cells is not None]
+    return pd.concat(frames, ignore_index=True) if frames else None
+
 def df_to_tuples(df: pd.DataFrame) -> List[Tuple]:
     """
     Convert DataFrame to list of tuples matching INSERT order.
@@ -190,59 +601,770 @@ def df_to_tuples(df: pd.DataFrame) -> List[Tuple]:
             arr_value,
             r["origin"] if not pd.isna(r["origin"]) else None,
             r["destination"] if not pd.isna(r["destination"]) else None,
+            r["station"] if not pd.isna(r["station"]) else None,
+            int(r["seq"]) if not pd.isna(r["seq"]) else None,
         )
         rows.append(tup)
     
     return rows
 
-def bulk_insert(conn, rows: List[Tuple]):
+def _prepared_insert_sql(table: str, rows: int) -> str:
+    width = len(insert_param_types)
+    values = ", ".join("(" + ", ".join(f"${i * width + j + 1}" for j in range(width)) + ")" for i in range(rows))
+    return insert_sql.format(table=table).replace("%s", values)
+
+def bulk_insert(conn, rows: List[Tuple], source_file: Optional[str] = None, commit: bool = True,
+                table: str = "vehicles_batch", prepared: bool = False):
     # execute bulk insert using pyscopg2.extras.execute_values for performance
     if not rows:
         return 0
     
+    rows = [r + (source_file,) for r in rows]
+    sql = insert_sql.format(table=table)
     cur = conn.cursor()
     inserted = 0
     try:
+        if prepared:
+            # whole pages run the prepared statement; the remainder goes through execute_values
+            name = db.prepare(conn, _prepared_insert_sql(table, prepared_page_rows), insert_param_types * prepared_page_rows)
+            full = len(rows) - len(rows) % prepared_page_rows
+            for i in range(0, full, prepared_page_rows):
+                db.execute_prepared(cur, name, [v for r in rows[i : i + prepared_page_rows] for v in r])
+            inserted = full
+            rows = rows[full:]
         for i in range(0, len(rows), chunk_size):
             chunk = rows[i : i + chunk_size]
-            execute_values(cur, insert_sql, chunk, template=None, page_size=chunk_size)
+            execute_values(cur, sql, chunk, template=None, page_size=chunk_size)
             inserted += len(chunk)
-        conn.commit()
+        if commit:
+            conn.commit()
         return inserted
     except Exception:
-        conn.rollback()
+        db.rollback(conn)
         raise
     finally:
         cur.close()
 
-def load_file(conn, filepath : str) -> Tuple[int, int]:
-    # load a single csv file. returns (inserted_counts, skipped_counts)
+def insert_traffic_counts(conn, counts: pd.DataFrame, source_file: Optional[str] = None, commit: bool = True) -> int:
+    # a file has only a few thousand count cells, so plain execute_values pages are enough
+    if len(counts) == 0:
+        return 0
+    
+    rows = list(zip(
+        counts["location"].tolist(),
+        counts["hour_start"].to_numpy(dtype='datetime64[us]').tolist(),
+        counts["vehicle_type"].tolist(),
+        counts["vehicle_count"].tolist(),
+        [source_file] * len(counts),
+    ))
+    cur = conn.cursor()
     try:
-        df = pd.read_csv(filepath, dtype=str) #read everything as str first
-    except Exception as e:
-        print(f"Failed to read csv '{filepath}': {e}")
-        return 0, 0
+        execute_values(cur, counts_insert_sql, rows, page_size=chunk_size)
+        if commit:
+            conn.commit()
+        return len(rows)
+    except Exception:
+        db.rollback(conn)
+        raise
+    finally:
+        cur.close()
+
+def _escape_copy_text(col: pd.Series) -> List[str]:
+    """Render a string column as COPY text fields (NULL -> \\N, special characters escaped)"""
+    col = col.astype("string")
+    if col.str.contains(r'[\\\t\n\r]', regex=True, na=False).any():
+        col = (col.str.replace('\\', '\\\\', regex=False)
+                  .str.replace('\t', '\\t', regex=False)
+                  .str.replace('\n', '\\n', regex=False)
+                  .str.replace('\r', '\\r', regex=False))
+    return col.fillna('\\N').tolist()
+
+def _timestamp_copy_text(col: pd.Series) -> List[str]:
+    """Render a timestamp column as ISO strings for COPY text format (NaT -> \\N)"""
+    values = np.datetime_as_string(col.to_numpy(dtype='datetime64[us]'), unit='us')
+    values[col.isna().to_numpy()] = '\\N'
+    return values.tolist()
+
+def _int_copy_text(col: pd.Series) -> List[str]:
+    """Render an integer column as COPY text fields (NA -> \\N)"""
+    if not col.isna().any():
+        return col.to_numpy(dtype=np.int64).astype(str).tolist()
+    return col.astype("Int64").astype("string").fillna('\\N').tolist()
+
+def _copy_text_chunks(df: pd.DataFrame, rows_per_chunk: int, source_file: Optional[str] = None):
+    """Yield (row_count, payload) chunks of COPY text format data"""
+    source_field = _escape_copy_text(pd.Series([source_file], dtype=object))[0]
+    columns = [
+        _escape_copy_text(df["vehicle_number"]),
+        _escape_copy_text(df["vehicle_type"]),
+        _timestamp_copy_text(df["departure_time"]),
+        _timestamp_copy_text(df["arrival_time"]),
+        _escape_copy_text(df["origin"]),
+        _escape_copy_text(df["destination"]),
+        _escape_copy_text(df["station"]),
+        _int_copy_text(df["seq"]),
+        [source_field] * len(df),
+    ]
+    for i in range(0, len(df), rows_per_chunk):
+        lines = ['\t'.join(fields) for fields in zip(*(c[i : i + rows_per_chunk] for c in columns))]
+        yield len(lines), ('\n'.join(lines) + '\n').encode('utf-8')
+
+_PG_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+_BINARY_NULL = struct.pack('>i', -1)
+_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_BINARY_TRAILER = struct.pack('>h', -1)
+_BINARY_FIELD_COUNT = struct.pack('>h', 9)
+_BINARY_COMPACT_FIELD_COUNT = struct.pack('>h', 7)
+
+def _binary_text_fields(col: pd.Series) -> List[bytes]:
+    """Length-prefixed UTF-8 fields for a string column; repeated values are encoded once"""
+    codes, uniques = pd.factorize(col.astype("string"))
+    encoded = [struct.pack('>i', len(b)) + b for b in (str(u).encode('utf-8') for u in uniques)]
+    encoded.append(_BINARY_NULL)  # code -1 (NULL) picks the last entry
+    return [encoded[c] for c in codes]
+
+def _binary_int4_fields(col: pd.Series) -> List[bytes]:
+    """Length-prefixed int4 fields for an integer column (NA -> NULL)"""
+    missing = col.isna().to_numpy()
+    block = np.empty(len(col), dtype=[('l', '>i4'), ('v', '>i4')])
+    block['l'] = 4
+    block['v'] = col.to_numpy(dtype=np.float64, na_value=0).astype(np.int32) if missing.any() else col.to_numpy(dtype=np.int32)
+    raw = block.tobytes()
+    fields = [raw[j : j + 8] for j in range(0, len(raw), 8)]
+    for j in np.flatnonzero(missing):
+        fields[j] = _BINARY_NULL
+    return fields
+
+def _binary_timestamp_pair(dep: pd.Series, arr: pd.Series) -> List[bytes]:
+    """Length-prefixed departure+arrival fields as microseconds since 2000-01-01"""
+    block = np.empty(len(dep), dtype=[('dl', '>i4'), ('dv', '>i8'), ('al', '>i4'), ('av', '>i8')])
+    block['dl'] = 8
+    block['al'] = 8
+    block['dv'] = (dep.to_numpy(dtype='datetime64[us]') - _PG_EPOCH).astype(np.int64)
+    block['av'] = (arr.to_numpy(dtype='datetime64[us]') - _PG_EPOCH).astype(np.int64)
+    raw = block.tobytes()
+    fields = [raw[j : j + 24] for j in range(0, len(raw), 24)]
+    # NaT rows are rare; rebuild those with NULL fields
+    for j in np.flatnonzero((dep.isna() | arr.isna()).to_numpy()):
+        d = _BINARY_NULL if pd.isna(dep.iloc[j]) else raw[j * 24 : j * 24 + 12]
+        a = _BINARY_NULL if pd.isna(arr.iloc[j]) else raw[j * 24 + 12 : j * 24 + 24]
+        fields[j] = d + a
+    return fields
+
+def _copy_binary_chunks(df: pd.DataFrame, rows_per_chunk: int, source_file: Optional[str] = None):
+    """Yield (row_count, payload) chunks of COPY binary format data"""
+    source_field = _binary_text_fields(pd.Series([source_file], dtype=object))[0]
+    numbers = _binary_text_fields(df["vehicle_number"])
+    types = _binary_text_fields(df["vehicle_type"])
+    times = _binary_timestamp_pair(df["departure_time"], df["arrival_time"])
+    origins = _binary_text_fields(df["origin"])
+    destinations = _binary_text_fields(df["destination"])
+    stations = _binary_text_fields(df["station"])
+    seqs = _binary_int4_fields(df["seq"])
+    for i in range(0, len(df), rows_per_chunk):
+        j = min(i + rows_per_chunk, len(df))
+        parts = [_BINARY_HEADER]
+        for k in range(i, j):
+            parts.append(_BINARY_FIELD_COUNT)
+            parts.append(numbers[k])
+            parts.append(types[k])
+            parts.append(times[k])
+            parts.append(origins[k])
+            parts.append(destinations[k])
+            parts.append(stations[k])
+            parts.append(seqs[k])
+            parts.append(source_field)
+        parts.append(_BINARY_TRAILER)
+        yield j - i, b''.join(parts)
+
+def _id_copy_text(ids: np.ndarray) -> List[str]:
+    """Render a dimension id column as COPY text fields (null_id -> \\N)"""
+    uniques, inverse = np.unique(ids, return_inverse=True)
+    fields = ['\\N' if u == dimensions.null_id else str(u) for u in uniques.tolist()]
+    return [fields[i] for i in inverse]
+
+def _copy_compact_text_chunks(df: pd.DataFrame, ids: Dict[str, np.ndarray], rows_per_chunk: int, source_file_id: int):
+    """Yield (row_count, payload) chunks of COPY text format data for vehicle_facts"""
+    columns = [
+        _escape_copy_text(df["vehicle_number"]),
+        _id_copy_text(ids["vehicle_type_id"]),
+        _timestamp_copy_text(df["departure_time"]),
+        _timestamp_copy_text(df["arrival_time"]),
+        _id_copy_text(ids["origin_id"]),
+        _id_copy_text(ids["destination_id"]),
+        [str(source_file_id)] * len(df),
+    ]
+    for i in range(0, len(df), rows_per_chunk):
+        lines = ['\t'.join(fields) for fields in zip(*(c[i : i + rows_per_chunk] for c in columns))]
+        yield len(lines), ('\n'.join(lines) + '\n').encode('utf-8')
+
+def _binary_id_fields(ids: np.ndarray, width: int) -> List[bytes]:
+    """Length-prefixed int2 (width 2) or int4 (width 4) fields; repeated ids are encoded once"""
+    uniques, inverse = np.unique(ids, return_inverse=True)
+    code = '>h' if width == 2 else '>i'
+    encoded = [_BINARY_NULL if u == dimensions.null_id else struct.pack('>i', width) + struct.pack(code, u)
+               for u in uniques.tolist()]
+    return [encoded[i] for i in inverse]
+
+def _copy_compact_binary_chunks(df: pd.DataFrame, ids: Dict[str, np.ndarray], rows_per_chunk: int, source_file_id: int):
+    """Yield (row_count, payload) chunks of COPY binary format data for vehicle_facts"""
+    source_field = struct.pack('>ii', 4, source_file_id)
+    numbers = _binary_text_fields(df["vehicle_number"])
+    types = _binary_id_fields(ids["vehicle_type_id"], 2)
+    times = _binary_timestamp_pair(df["departure_time"], df["arrival_time"])
+    origins = _binary_id_fields(ids["origin_id"], 4)
+    destinations = _binary_id_fields(ids["destination_id"], 4)
+    for i in range(0, len(df), rows_per_chunk):
+        j = min(i + rows_per_chunk, len(df))
+        parts = [_BINARY_HEADER]
+        for k in range(i, j):
+            parts.append(_BINARY_COMPACT_FIELD_COUNT)
+            parts.append(numbers[k])
+            parts.append(types[k])
+            parts.append(times[k])
+            parts.append(origins[k])
+            parts.append(destinations[k])
+            parts.append(source_field)
+        parts.append(_BINARY_TRAILER)
+        yield j - i, b''.join(parts)
+
+def _copy_payloads(conn, sql: str, chunks, buffer: Optional[io.BytesIO], commit: bool) -> int:
+    """Send (row_count, payload) chunks with one COPY each through a reusable buffer"""
+    buf = buffer if buffer is not None else io.BytesIO()
+    cur = conn.cursor()
+    inserted = 0
+    try:
+        for n_rows, payload in chunks:
+            buf.seek(0)
+            buf.truncate()
+            buf.write(payload)
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+            inserted += n_rows
+        if commit:
+            conn.commit()
+        return inserted
+    except Exception:
+        db.rollback(conn)
+        raise
+    finally:
+        cur.close()
+
+def copy_insert(conn, df: pd.DataFrame, copy_format: str = "text", buffer: Optional[io.BytesIO] = None,
+                source_file: Optional[str] = None, commit: bool = True, table: str = "vehicles_batch") -> int:
+    """
+    Stream the normalized columns into vehicles_batch (or the given partition) with COPY ... FROM STDIN.
+    Chunks are written into one reusable buffer; all chunks share a single transaction.
+    """
+    if len(df) == 0:
+        return 0
     
-    df = normalize_dataframe(df, filepath)  # Pass filepath for transformation context
-    total_rows = len(df)
+    if copy_format == "binary":
+        chunks = _copy_binary_chunks(df, copy_chunk_size, source_file)
+    else:
+        chunks = _copy_text_chunks(df, copy_chunk_size, source_file)
+    return _copy_payloads(conn, copy_sql[copy_format].format(table=table), chunks, buffer, commit)
+
+def copy_compact_insert(conn, df: pd.DataFrame, ids: Dict[str, np.ndarray], source_file_id: int,
+                        copy_format: str = "text", buffer: Optional[io.BytesIO] = None, commit: bool = True) -> int:
+    """COPY a normalized frame into vehicle_facts; ids are its dimension id columns from dimensions.cache.encode"""
+    if len(df) == 0:
+        return 0
+    if copy_format == "binary":
+        chunks = _copy_compact_binary_chunks(df, ids, copy_chunk_size, source_file_id)
+    else:
+        chunks = _copy_compact_text_chunks(df, ids, copy_chunk_size, source_file_id)
+    return _copy_payloads(conn, copy_compact_sql[copy_format], chunks, buffer, commit)
+
+def manifest_key(filepath: str) -> str:
+    # project-relative path with forward slashes, so the manifest survives moving the checkout
+    return os.path.relpath(os.path.abspath(filepath), project_root).replace(os.sep, '/')
+
+def file_hash(filepath: str) -> str:
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def file_stat(filepath: str) -> Tuple[int, datetime]:
+    st = os.stat(filepath)
+    return st.st_size, datetime.fromtimestamp(st.st_mtime)
+
+class ManifestEntry(NamedTuple):
+    """A load_manifest row: the file as it was loaded, and the target and storage its rows were written for"""
+    size: int
+    mtime: datetime
+    content_hash: str
+    target: str
+    storage: str
+
+def fetch_manifest(conn) -> Dict[str, ManifestEntry]:
+    cur = conn.cursor()
+    try:
+        cur.execute(manifest_select_sql)
+        return {row[0]: ManifestEntry(*row[1:]) for row in cur.fetchall()}
+    finally:
+        cur.close()
+
+def loaded_as(entry: ManifestEntry, target: str, storage: str = "wide") -> bool:
+    """True when the manifest entry's rows are where a load with this target and storage would put them"""
+    # counts-only loads write no vehicle rows, so their storage does not matter
+    return entry.target == target and (target == "counts" or entry.storage == storage)
+
+def plan_files(conn, csv_files: List[str], target: str = "vehicles", storage: str = "wide") -> Tuple[List[str], List[str]]:
+    """
+    Split files into (to_load, unchanged) using the load manifest.
+    Files loaded for another target or storage are loaded again. Size + mtime matches skip
+    without reading the file; otherwise the content hash decides.
+    """
+    manifest = fetch_manifest(conn)
+    to_load = []
+    unchanged = []
+    cur = conn.cursor()
+    try:
+        for f in csv_files:
+            key = manifest_key(f)
+            entry = manifest.get(key)
+            if entry is None or not loaded_as(entry, target, storage):
+                to_load.append(f)
+                continue
+            size, mtime = file_stat(f)
+            if (size, mtime) == (entry.size, entry.mtime):
+                unchanged.append(f)
+            elif file_hash(f) == entry.content_hash:
+                # touched but identical; remember the new stat so the next run skips without hashing
+                cur.execute(manifest_touch_sql, (size, mtime, key))
+                unchanged.append(f)
+            else:
+                to_load.append(f)
+        conn.commit()
+    finally:
+        cur.close()
+    return to_load, unchanged
+
+def _write_vehicle_frame(conn, df: pd.DataFrame, loader: str, copy_format: str,
+                         buf: io.BytesIO, source_file: str,
+                         router: Optional[partitions.PartitionRouter] = None,
+                         compact_file_id: Optional[int] = None, staging: Optional[str] = None,
+                         prepared: bool = False) -> int:
+    if compact_file_id is not None:
+        with metrics.stage("encode_dimensions") as stage:
+            ids = dimensions.cache.encode(conn, df)
+            stage["rows"] = len(df)
+        with metrics.stage("copy_insert") as stage:
+            stage["rows"] = copy_compact_insert(conn, df, ids, compact_file_id, copy_format, buf, commit=False)
+        return stage["rows"]
+    if router is None:
+        parts = [("vehicles_batch", df)]
+    else:
+        with metrics.stage("route_partitions") as stage:
+            parts = router.split(df)
+            stage["rows"] = len(df)
+    inserted = 0
+    for table, part in parts:
+        # merges write every row to the staging table; the router still creates missing partitions
+        table = staging or table
+        if loader == "values":
+            with metrics.stage("df_to_tuples") as stage:
+                rows = df_to_tuples(part)
+                stage["rows"] = len(rows)
+            with metrics.stage("bulk_insert") as stage:
+                stage["rows"] = bulk_insert(conn, rows, source_file, commit=False, table=table, prepared=prepared)
+        else:
+            with metrics.stage("copy_insert") as stage:
+                stage["rows"] = copy_insert(conn, part, copy_format, buf, source_file, commit=False, table=table)
+        inserted += stage["rows"]
+    return inserted
+
+def merge_staged(conn, source_file: str) -> Tuple[int, int]:
+    """Apply the staged rows of one file to vehicles_batch; returns (written, deleted): new or changed rows, removed rows"""
+    cur = conn.cursor()
+    try:
+        # temp tables get no statistics from autovacuum; the anti-joins need the row count
+        cur.execute(f"ANALYZE {merge_staging_table}")
+        cur.execute(merge_delete_sql, (source_file,))
+        deleted = cur.rowcount
+        cur.execute(merge_upsert_sql, (source_file,))
+        return cur.rowcount, deleted
+    finally:
+        cur.close()
+
+def load_file(conn, filepath : str, loader: str = "copy", copy_format: str = "text",
+              chunk_rows: Optional[int] = None, target: str = "vehicles", use_cache: bool = False,
+              route_partitions: bool = False, storage: str = "wide", mode: str = "replace",
+              prepared: bool = False, before_commit: Optional[Callable] = None) -> Tuple[int, int]:
+    """
+    Load a single csv file. returns (inserted_counts, skipped_counts)
+    Rows from an earlier load of the same file are replaced and the manifest
+    entry is written in the same transaction, so a rerun never duplicates rows.
+    With chunk_rows set the file is streamed through the pipeline chunk by chunk.
+    target selects vehicles_batch rows, traffic_counts rows, or both.
+    use_cache reads/writes the normalized frames in the staging cache (vehicles target only).
+    route_partitions writes each frame straight into its vehicles_batch partition.
+    storage "compact" writes vehicle rows to vehicle_facts instead of vehicles_batch.
+    mode "merge" applies only the changed vehicle rows of the file (wide storage).
+    prepared runs the values loader's INSERT pages as a prepared statement.
+    before_commit(cursor) runs last in the load transaction; raising from it rolls the load back.
+    A file that cannot be read is skipped with a message, or raises when before_commit is given,
+    as the caller then expects the load to either run it or fail.
+    """
+    with metrics.stage("hash"):
+        size, mtime = file_stat(filepath)
+        content_hash = file_hash(filepath)
+    source_file = manifest_key(filepath)
+    use_cache = use_cache and target == "vehicles" and staging_cache.available()
+    cached = staging_cache.read(source_file, content_hash, chunk_rows) if use_cache else None
+    raw_frames = None
+    layout = None
+    if cached is None:
+        # traffic count files are read by their cached header layout: data rows and count columns only
+        with metrics.stage("detect_layout"):
+            layout = detect_layout(filepath)
+    if cached is not None:
+        print(f"Using staged columns for {os.path.basename(filepath)}")
+        cached = metrics.timed_iter("cache_read", cached)
+    elif chunk_rows:
+        if layout is not None:
+            raw_frames = metrics.timed_iter("read_csv", read_count_frames(filepath, layout, chunk_rows))
+        else:
+            raw_frames = metrics.timed_iter("read_csv", pd.read_csv(filepath, dtype=str, chunksize=stream_read_rows))
+    else:
+        try:
+            with metrics.stage("read_csv") as stage:
+                if layout is not None:
+                    raw_frames = read_count_frames(filepath, layout)
+                else:
+                    raw_frames = [pd.read_csv(filepath, dtype=str)] #read everything as str first
+                stage["rows"] = len(raw_frames[0])
+        except Exception as e:
+            if before_commit is not None:
+                raise
+            print(f"Failed to read csv '{filepath}': {e}")
+            return 0, 0
+    cache_writer = staging_cache.open_writer(source_file, content_hash) if use_cache and cached is None else None
+    return load_frames(conn, filepath, (size, mtime, content_hash), raw_frames, loader, copy_format,
+                       chunk_rows, target, cached, cache_writer, layout, route_partitions, storage, mode, prepared,
+                       before_commit)
+
+def load_frames(conn, filepath: str, manifest_entry: Tuple[int, datetime, str],
+                raw_frames: Optional[Iterable[pd.DataFrame]], loader: str = "copy", copy_format: str = "text",
+                chunk_rows: Optional[int] = None, target: str = "vehicles",
+                cached: Optional[Iterable[pd.DataFrame]] = None,
+                cache_writer: Optional[staging_cache.CacheWriter] = None,
+                layout: Optional[CountLayout] = None, route_partitions: bool = False,
+                storage: str = "wide", mode: str = "replace", prepared: bool = False,
+                before_commit: Optional[Callable] = None) -> Tuple[int, int]:
+    """
+    Transform raw frames of one file (or write its cached normalized frames) in a single transaction.
+    manifest_entry is the (size, mtime, content_hash) recorded for filepath on commit.
+    layout is set when raw_frames were read with read_count_frames.
+    When vehicles_batch is partitioned, missing partitions are created in the same transaction.
+    The file's contribution to the rollup tables is replaced in the same transaction as well.
+    In merge mode the vehicle rows go through a temp staging table and only the differences
+    against the file's earlier rows are written.
+    """
+    size, mtime, content_hash = manifest_entry
+    source_file = manifest_key(filepath)
+    write_vehicles = target in ("vehicles", "both")
+    write_counts = target in ("counts", "both")
+    merge = write_vehicles and mode == "merge"
+    if merge and storage != "wide":
+        raise ValueError("merge mode writes wide storage (vehicles_batch) only")
+    total_rows = 0
+    inserted = 0
+    count_rows = 0
+    count_vehicles = 0
+    replaced = 0
+    rollup_counts = []
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    cur = conn.cursor()
+    try:
+        with metrics.stage("delete_previous") as stage:
+            # the manifest records only this load's target and storage, so rows an earlier load wrote
+            # for another target or storage are removed as well. A merge diffs against the file's
+            # vehicles_batch rows instead of deleting them
+            deletes = [delete_compact_source_sql, delete_counts_source_sql]
+            if not merge:
+                deletes.append(delete_source_sql)
+            for sql in deletes:
+                cur.execute(sql, (source_file,))
+                replaced += cur.rowcount
+            stage["rows"] = replaced
+        router = None
+        compact_file_id = None
+        staging = None
+        if merge:
+            cur.execute(merge_staging_sql)
+            staging = merge_staging_table
+        if write_vehicles and storage == "compact":
+            compact_file_id = dimensions.source_file_id(conn, source_file)
+        elif write_vehicles and partitions.is_partitioned(conn):
+            router = partitions.PartitionRouter(conn, route_partitions)
+        if cached is not None:
+            for df in cached:
+                total_rows += len(df)
+                inserted += _write_vehicle_frame(conn, df, loader, copy_format, buf, source_file, router, compact_file_id, staging, prepared)
+            # staged frames hold expanded vehicles only; the rollups need the file's count cells
+            with metrics.stage("read_counts"):
+                counts = read_file_counts(filepath)
+            if counts is not None:
+                rollup_counts.append(counts)
+        else:
+            for cells, raw in iter_count_cells(raw_frames, filepath, layout):  # Pass filepath for transformation context
+                if cells is not None:
+                    counts = count_cells_to_frame(cells)
+                    rollup_counts.append(counts)
+                if write_counts and cells is not None:
+                    with metrics.stage("write_counts") as stage:
+                        stage["rows"] = insert_traffic_counts(conn, counts, source_file, commit=False)
+                    count_rows += stage["rows"]
+                    count_vehicles += int(counts["vehicle_count"].sum())
+                if not write_vehicles:
+                    continue
+                for df in iter_vehicle_frames(cells, raw, chunk_rows):
+                    if cache_writer is not None:
+                        with metrics.stage("cache_write") as stage:
+                            cache_writer.write(df)
+                            stage["rows"] = len(df)
+                    total_rows += len(df)
+                    inserted += _write_vehicle_frame(conn, df, loader, copy_format, buf, source_file, router, compact_file_id, staging, prepared)
+        if merge:
+            with metrics.stage("merge") as stage:
+                merged = merge_staged(conn, source_file)
+                stage["rows"] = sum(merged)
+        with metrics.stage("rollups") as stage:
+            stage["rows"] = rollups.replace_file(conn, source_file,
+                                                 pd.concat(rollup_counts, ignore_index=True) if rollup_counts else None)
+        # row_count is the number of vehicle records the file represents
+        with metrics.stage("commit"):
+            cur.execute(manifest_upsert_sql, (source_file, size, mtime, content_hash,
+                                              inserted if write_vehicles else count_vehicles, target, storage))
+            cur.execute(notify_load_sql, (load_channel, source_file))
+            if before_commit is not None:
+                before_commit(cur)
+            conn.commit()
+        dimensions.cache.commit()
+    except Exception:
+        # a lost connection took the transaction with it; the caches must be rolled back regardless
+        db.rollback(conn)
+        dimensions.cache.rollback()
+        if cache_writer is not None:
+            cache_writer.abort()
+        raise
+    finally:
+        cur.close()
+    if cache_writer is not None:
+        with metrics.stage("cache_write"):
+            cache_writer.commit()
+    elapsed = time.perf_counter() - start
+    if write_counts:
+        print(f"Wrote {count_rows} traffic_counts rows ({count_vehicles} vehicles) for {os.path.basename(filepath)}")
+        if not write_vehicles:
+            return count_rows, 0
     if total_rows == 0:
         print (f"No valid rows found in {os.path.basename(filepath)}")
         return 0, 0
     
-    rows = df_to_tuples(df)
-    inserted = bulk_insert(conn, rows)
+    rate = inserted / elapsed if elapsed > 0 else 0
+    if merge:
+        written, deleted = merged
+        print(f"Merged {inserted} rows in {elapsed:.2f}s ({rate:.0f} rows/sec): {written} new or changed, "
+              f"{deleted} deleted, {inserted - written} unchanged")
+    else:
+        print(f"Inserted {inserted} rows in {elapsed:.2f}s ({rate:.0f} rows/sec, {loader})")
+    if replaced:
+        print(f"Replaced {replaced} rows from an earlier load of {source_file}")
     skipped = total_rows - inserted
     return inserted, skipped
 
-def main():
-    csv_files = find_csv_files(batch_dir)
+def rows_to_frame(rows: List[List[str]]) -> pd.DataFrame:
+    """
+    The frame pd.read_csv(dtype=str) returns for table rows written as a headerless CSV:
+    the first row names the columns, short rows are padded and NA strings become NaN.
+    """
+    width = max((len(r) for r in rows), default=0)
+    header = list(rows[0]) + [""] * (width - len(rows[0])) if rows else []
+    names = []
+    seen: Dict[str, int] = {}
+    for i, name in enumerate(header):
+        name = name or f"Unnamed: {i}"
+        # duplicate names get .1, .2, ... like read_csv
+        while name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name] - 1}"
+        seen[name] = 1
+        names.append(name)
+    data = [[np.nan if v in _csv_na_values else v for v in r] + [np.nan] * (width - len(r)) for r in rows[1:]]
+    return pd.DataFrame(data, columns=names, dtype=object)
+
+def load_rows(conn, rows: List[List[str]], filepath: str, manifest_entry: Tuple[int, datetime, str],
+              use_cache: bool = False, **load_options) -> Tuple[int, int]:
+    """
+    Load table rows extracted in memory (e.g. from an SSRN HTML export) without a CSV round trip.
+    filepath is the batch CSV the rows stand for: it names the location and keys source_file
+    and the manifest, so a later load of the same CSV replaces these rows.
+    manifest_entry should describe that CSV's text, so a later load of the CSV finds it unchanged.
+    use_cache stages the normalized frames under that content hash (vehicles target only).
+    """
+    with metrics.stage("rows_to_frame") as stage:
+        raw = rows_to_frame(rows)
+        stage["rows"] = len(raw)
+    cache_writer = None
+    if use_cache and load_options.get("target", "vehicles") == "vehicles":
+        cache_writer = staging_cache.open_writer(manifest_key(filepath), manifest_entry[2])
+    return load_frames(conn, filepath, manifest_entry, [raw], cache_writer=cache_writer, **load_options)
+
+# a file is retried on a new connection after a transient database error (db.is_transient);
+# it loads in one transaction with its manifest entry, so each attempt starts from a clean slate
+file_retries = int(os.getenv("LOAD_FILE_RETRIES") or 3)
+
+def _load_retrying(pool: db.ConnectionPool, load: Callable, filepath: str) -> Tuple[int, int]:
+    def attempt():
+        conn = pool.getconn()
+        try:
+            return load(conn)
+        finally:
+            pool.putconn(conn)
+
+    return db.retrying(attempt, file_retries, f"Loading {os.path.basename(filepath)}")
+
+def load_file_retrying(pool: db.ConnectionPool, filepath: str, **load_options) -> Tuple[int, int]:
+    """load_file on a pooled connection; a dropped connection or deadlock retries the file instead of failing it"""
+    return _load_retrying(pool, lambda conn: load_file(conn, filepath, **load_options), filepath)
+
+def load_rows_retrying(pool: db.ConnectionPool, rows: List[List[str]], filepath: str,
+                       manifest_entry: Tuple[int, datetime, str], **load_options) -> Tuple[int, int]:
+    """load_rows on a pooled connection, retried like load_file_retrying"""
+    return _load_retrying(pool, lambda conn: load_rows(conn, rows, filepath, manifest_entry, **load_options), filepath)
+
+# per-process connection pool, created by _init_worker in each pool worker
+_worker_pool = None
+
+def _init_worker():
+    global _worker_pool
+    _worker_pool = create_pool(minconn=1, maxconn=1, profile="bulk_load")
+
+def _load_file_in_worker(filepath: str, load_options: dict, profile_dir: Optional[str]) -> Tuple[int, int, Optional[dict]]:
+    print(f"Processing: {os.path.basename(filepath)}")
+    profiler = cProfile.Profile() if profile_dir else None
+    metrics.begin_file(filepath)
+    try:
+        if profiler:
+            profiler.enable()
+        inserted, skipped = load_file_retrying(_worker_pool, filepath, **load_options)
+        metrics.end_file(inserted, skipped)
+        return inserted, skipped, metrics.take_file(filepath)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile_dir, f"{os.getpid()}-{os.path.basename(filepath)}.prof"))
+        metrics.take_file(filepath)
+
+def load_files_parallel(csv_files: List[str], workers: int, profile_dir: Optional[str] = None,
+                        **load_options) -> Tuple[int, int]:
+    """
+    Read, normalize, transform and load files in a process pool.
+    Each worker process owns a pooled bulk_load connection; a failing file does not affect the others.
+    Per-file metrics come back with each result and are merged into this process's metrics.
+    """
+    total_inserted = 0
+    total_skipped = 0
+    # biggest files first so the pool does not end on one long straggler
+    ordered = sorted(csv_files, key=os.path.getsize, reverse=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(_load_file_in_worker, f, load_options, profile_dir): f for f in ordered}
+        for future in as_completed(futures):
+            f = futures[future]
+            try:
+                inserted, skipped, file_metrics = future.result()
+                total_inserted += inserted
+                total_skipped += skipped
+                metrics.add_file(file_metrics)
+            except Exception as e:
+                print(f"Error loading '{os.path.basename(f)}': {e}")
+                traceback.print_exc()
+                metrics.fail_file(f, str(e))
+    return total_inserted, total_skipped
+
+def add_load_arguments(parser: argparse.ArgumentParser):
+    """Options of each file load; shared with the queue workers (src/load_queue.py)"""
+    parser.add_argument("--loader", choices=loader_modes, default="copy",
+                        help="copy: stream with COPY FROM STDIN (default); values: execute_values INSERT pages")
+    parser.add_argument("--copy-format", choices=copy_formats, default="text",
+                        help="COPY data format used by the copy loader (default: text)")
+    parser.add_argument("--prepared", action="store_true",
+                        help="run the values loader's INSERT pages as a server-side prepared statement")
+    parser.add_argument("--chunk-rows", type=int, default=None,
+                        help="stream each file through the pipeline in chunks of at most N records (bounded memory)")
+    parser.add_argument("--target", choices=load_targets, default="vehicles",
+                        help="vehicles: per-vehicle rows in vehicles_batch (default); counts: hourly counts in "
+                             "traffic_counts, expanded on demand by the traffic_count_vehicles view; both")
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse normalized columns from the Arrow staging cache (needs pyarrow); "
+                             "manage it with src/staging_cache.py")
+    parser.add_argument("--storage", choices=storage_modes, default="wide",
+                        help="wide: vehicle rows in vehicles_batch (default); compact: dimension ids in vehicle_facts, "
+                             "read through the vehicles_batch_view view (copy loader only)")
+    parser.add_argument("--mode", choices=load_modes, default="replace",
+                        help="replace: delete each file's earlier rows and insert its rows (default); merge: stage the "
+                             "rows and apply only new, changed and removed vehicles by natural key (wide storage)")
+    parser.add_argument("--route-partitions", action="store_true",
+                        help="COPY each file's rows straight into their departure_time partitions of vehicles_batch "
+                             "instead of routing every row through the parent table")
+
+def check_load_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.prepared and args.loader != "values":
+        parser.error("--prepared applies to --loader values")
+    if args.storage == "compact" and args.loader != "copy":
+        parser.error("--storage compact is written with the copy loader")
+    if args.mode == "merge" and args.storage != "wide":
+        parser.error("--mode merge works on --storage wide")
+
+def options_from_args(args: argparse.Namespace) -> dict:
+    """load_file keyword arguments for the add_load_arguments options"""
+    return dict(loader=args.loader, copy_format=args.copy_format, chunk_rows=args.chunk_rows,
+                target=args.target, use_cache=args.cache, route_partitions=args.route_partitions,
+                storage=args.storage, mode=args.mode, prepared=args.prepared)
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load batch CSV files into vehicles_batch")
+    add_load_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes loading files in parallel (default: 1, serial)")
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="drop the vehicles_batch query indexes before loading and rebuild them once at the end "
+                             "(for large bulk loads)")
+    parser.add_argument("--full", action="store_true",
+                        help="reload every file, ignoring the load manifest")
+    # file selection through the batch file catalog (src/catalog.py); whole files are loaded
+    catalog.add_filter_arguments(parser)
+    parser.add_argument("--report", default=None,
+                        help="path of the JSON run report (default: data/reports/load-<timestamp>.json)")
+    parser.add_argument("--profile", action="store_true",
+                        help="capture cProfile data for the run; hot functions go into the report, stats next to it as .prof")
+    args = parser.parse_args(argv)
+    check_load_arguments(parser, args)
+    if args.mode == "merge" and args.defer_indexes:
+        parser.error("--mode merge upserts on the natural key index, which --defer-indexes drops")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    filters = dict(stations=args.station, years=args.year, start=args.start, end=args.end)
+    csv_files = find_csv_files(batch_dir, **filters)
     if not csv_files:
-        print (f"No csv files in the {batch_dir}. put your batch files there and re-run.")
+        if any(v is not None for v in filters.values()):
+            print("No catalogued batch files match the filters; list them with: python src/catalog.py list")
+        else:
+            print (f"No csv files in the {batch_dir}. put your batch files there and re-run.")
         return
     
-    # open single connection for all files
+    # bulk_load sessions for all files; getting the first one checks the DB is reachable before starting workers
     try:
-        conn = get_connection()
+        pool = create_pool(minconn=1, maxconn=1, profile="bulk_load")
+        conn = pool.getconn()
     except Exception as e:
         print("ERROR! Could not get DB connection. check src/db.py and .env.")
         traceback.print_exc()
@@ -252,21 +1374,95 @@ def main():
     total_skipped = 0
 
     print(f"Found {len(csv_files)} file(s). Starting load...")
+    if args.cache and not staging_cache.available():
+        print("pyarrow is not installed; --cache is ignored.")
+    start = time.perf_counter()
 
-    for f in csv_files:
-        print(f"Processing: {os.path.basename(f)}")
-        try:
-            inserted, skipped = load_file(conn, f)
-            total_inserted += inserted
-            total_skipped += skipped
-        except Exception as e:
-            print(f"Error loading '{os.path.basename(f)}': {e}")
-            traceback.print_exc()
+    if not args.full:
+        csv_files, unchanged = plan_files(conn, csv_files, args.target, args.storage)
+        print(f"Skipping {len(unchanged)} unchanged file(s) listed in load_manifest; {len(csv_files)} to load")
+
+    load_options = options_from_args(args)
+    deferred_indexes = []
+    if args.route_partitions and not partitions.is_partitioned(conn):
+        print("vehicles_batch is not partitioned (run src/partitions.py migrate); --route-partitions has no effect.")
+    if args.defer_indexes and csv_files:
+        # an interrupted run leaves them dropped; rebuild with: python src/partitions.py reindex
+        deferred_indexes = partitions.drop_secondary_indexes(conn)
+        print(f"Dropped {len(deferred_indexes)} vehicles_batch index(es); they are rebuilt after the load")
+    report_path = args.report or os.path.join(reports_dir, f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+    profile_path = os.path.splitext(report_path)[0] + ".prof"
+    profile_dir = None
+    profiler = None
+
+    pool.putconn(conn)
+    if args.workers > 1:
+        pool.closeall()
+        print(f"Loading with {args.workers} worker processes")
+        if args.profile:
+            profile_dir = tempfile.mkdtemp(prefix="load-profile-")
+        total_inserted, total_skipped = load_files_parallel(csv_files, args.workers, profile_dir, **load_options)
+    else:
+        if args.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        for f in csv_files:
+            print(f"Processing: {os.path.basename(f)}")
+            metrics.begin_file(f)
+            try:
+                inserted, skipped = load_file_retrying(pool, f, **load_options)
+                total_inserted += inserted
+                total_skipped += skipped
+                metrics.end_file(inserted, skipped)
+            except Exception as e:
+                print(f"Error loading '{os.path.basename(f)}': {e}")
+                traceback.print_exc()
+                metrics.end_file(status="error", error=str(e))
+
+                continue
+        if profiler:
+            profiler.disable()
 
-            continue
+        pool.closeall()
 
-    conn.close()
+    index_seconds = None
+    if deferred_indexes:
+        # the bulk_load profile's maintenance_work_mem sizes the index sorts
+        conn = get_connection("bulk_load")
+        try:
+            index_seconds = partitions.create_secondary_indexes(conn)
+            print(f"Rebuilt vehicles_batch indexes in {index_seconds:.1f}s")
+        finally:
+            conn.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total_inserted / elapsed if elapsed > 0 else 0
     print(f"Done. Total inserted: {total_inserted}. Total skipped: {total_skipped}.")
+    print(f"Elapsed: {elapsed:.1f}s ({rate:.0f} records/sec end to end, loader={args.loader})")
+
+    report = metrics.report(
+        options={k: v for k, v in vars(args).items() if k != "report"},
+        elapsed_seconds=round(elapsed, 3),
+        total_inserted=total_inserted,
+        total_skipped=total_skipped,
+        records_per_sec=round(rate),
+        index_rebuild_seconds=round(index_seconds, 3) if index_seconds is not None else None,
+    )
+    if args.profile:
+        if profiler:
+            stats = pstats.Stats(profiler)
+        else:
+            dumps = glob.glob(os.path.join(profile_dir, "*.prof"))
+            stats = pstats.Stats(*dumps) if dumps else None
+            shutil.rmtree(profile_dir, ignore_errors=True)
+        if stats:
+            os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+            stats.dump_stats(profile_path)
+            report["profile"] = {"stats_file": profile_path, "hot_functions": hot_functions(stats)}
+    write_report(report_path, report)
+    for f in report["slowest_files"][:5]:
+        print(f"  slow: {os.path.basename(f['file'])} {f['seconds']:.2f}s ({f['inserted']} rows)")
+    print(f"Run report written to {report_path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,364 @@
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+import traceback
+import multiprocessing
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+import db
+import catalog
+import load_batch
+
+# a running job whose heartbeat is older than job_timeout seconds belongs to a dead worker
+# and goes back to the queue; workers refresh it every heartbeat_interval seconds
+heartbeat_interval = float(os.getenv("LOAD_JOB_HEARTBEAT") or 10)
+job_timeout = float(os.getenv("LOAD_JOB_TIMEOUT") or 60)
+# attempts before a job is marked failed; claims by workers that died count as attempts too
+max_attempts = int(os.getenv("LOAD_JOB_ATTEMPTS") or 3)
+# idle workers look for new jobs this often
+poll_interval = 2.0
+
+# a job that is already being loaded keeps its worker; everything else is queued again from scratch
+enqueue_sql = """
+INSERT INTO load_jobs (file_path, file_size) VALUES %s
+ON CONFLICT (file_path) DO UPDATE SET file_size = EXCLUDED.file_size, status = 'queued', attempts = 0,
+    error = NULL, available_at = now(), enqueued_at = now()
+WHERE load_jobs.status <> 'running'"""
+# biggest files first so the run does not end on one long straggler
+claim_sql = """
+UPDATE load_jobs SET status = 'running', worker = %s, attempts = attempts + 1,
+    claimed_at = now(), heartbeat_at = now(), finished_at = NULL, error = NULL
+WHERE file_path = (
+    SELECT file_path FROM load_jobs WHERE status = 'queued' AND available_at <= now()
+    ORDER BY file_size DESC, file_path LIMIT 1 FOR UPDATE SKIP LOCKED)
+RETURNING file_path, attempts"""
+# every update of a claimed job names the claim (worker and attempt), so a worker that lost
+# its job to the reaper can no longer touch it
+_claim_match = "file_path = %(file_path)s AND worker = %(worker)s AND attempts = %(attempts)s AND status = 'running'"
+# a job that was just marked done by its load still belongs to the worker
+heartbeat_sql = """
+UPDATE load_jobs SET heartbeat_at = now()
+WHERE file_path = %(file_path)s AND worker = %(worker)s AND attempts = %(attempts)s AND status IN ('running', 'done')"""
+done_sql = f"UPDATE load_jobs SET status = 'done', finished_at = now(), heartbeat_at = now() WHERE {_claim_match}"
+result_sql = """
+UPDATE load_jobs SET inserted = %(inserted)s, skipped = %(skipped)s
+WHERE file_path = %(file_path)s AND worker = %(worker)s AND attempts = %(attempts)s"""
+fail_sql = f"""
+UPDATE load_jobs SET status = CASE WHEN attempts >= %(max_attempts)s THEN 'failed' ELSE 'queued' END,
+    error = %(error)s, finished_at = now(), available_at = now() + make_interval(secs => %(delay)s)
+WHERE {_claim_match}"""
+# a stopping worker hands its job back without spending an attempt
+release_sql = f"UPDATE load_jobs SET status = 'queued', attempts = attempts - 1, available_at = now() WHERE {_claim_match}"
+reap_sql = """
+UPDATE load_jobs SET status = CASE WHEN attempts >= %(max_attempts)s THEN 'failed' ELSE 'queued' END,
+    error = 'worker ' || worker || ' stopped sending heartbeats', available_at = now()
+WHERE status = 'running' AND heartbeat_at < now() - make_interval(secs => %(timeout)s)
+RETURNING file_path, worker, status"""
+pending_sql = "SELECT count(*) FROM load_jobs WHERE status IN ('queued', 'running')"
+retry_failed_sql = "UPDATE load_jobs SET status = 'queued', attempts = 0, error = NULL, available_at = now() WHERE status = 'failed'"
+status_sql = "SELECT status, count(*), coalesce(sum(inserted), 0) FROM load_jobs GROUP BY status ORDER BY status"
+running_sql = """
+SELECT file_path, worker, attempts, round(extract(epoch FROM now() - heartbeat_at)::numeric, 1)
+FROM load_jobs WHERE status = 'running' ORDER BY claimed_at"""
+failed_sql = "SELECT file_path, attempts, error FROM load_jobs WHERE status = 'failed' ORDER BY file_path"
+
+class Job(NamedTuple):
+    """One claim of a file: the attempt number tells a reclaimed job from the worker's earlier claim"""
+    file_path: str
+    worker: str
+    attempts: int
+
+    def params(self, **extra) -> dict:
+        return dict(file_path=self.file_path, worker=self.worker, attempts=self.attempts, **extra)
+
+class JobLost(Exception):
+    """The job was given to another worker while this one was loading it"""
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class LoadQueue:
+    """
+    The load_jobs table seen from one worker or coordinator. Every call is its own short
+    transaction on a private connection, reconnecting after transient errors.
+    """
+
+    def __init__(self):
+        self.conn = None
+
+    def _run(self, fn: Callable):
+        def attempt():
+            if self.conn is None or self.conn.closed:
+                self.conn = db.get_connection()
+                self.conn.autocommit = True
+            with self.conn.cursor() as cur:
+                return fn(cur)
+
+        return db.retrying(attempt, what="Load queue update")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def enqueue(self, files: List[str]) -> int:
+        """Queue the files (paths on this host); returns jobs queued, which excludes files being loaded right now"""
+        rows = [(load_batch.manifest_key(f), os.path.getsize(f)) for f in files]
+        if not rows:
+            return 0
+
+        def insert(cur):
+            execute_values(cur, enqueue_sql, rows, page_size=1000)
+            return cur.rowcount
+
+        return self._run(insert)
+
+    def claim(self, worker: str) -> Optional[Job]:
+        def claim(cur):
+            cur.execute(claim_sql, (worker,))
+            row = cur.fetchone()
+            return Job(row[0], worker, row[1]) if row else None
+
+        return self._run(claim)
+
+    def heartbeat(self, job: Job) -> bool:
+        """False when the job is no longer this worker's"""
+        def beat(cur):
+            cur.execute(heartbeat_sql, job.params())
+            return cur.rowcount == 1
+
+        return self._run(beat)
+
+    def finish(self, job: Job, inserted: int, skipped: int):
+        self._run(lambda cur: cur.execute(result_sql, job.params(inserted=inserted, skipped=skipped)))
+
+    def fail(self, job: Job, error: str) -> str:
+        """Queue the job again after a backoff, or mark it failed after max_attempts; returns the new status"""
+        def fail(cur):
+            cur.execute(fail_sql, job.params(max_attempts=max_attempts, error=error, delay=db.backoff(job.attempts)))
+            return "failed" if job.attempts >= max_attempts else "queued"
+
+        return self._run(fail)
+
+    def release(self, job: Job):
+        self._run(lambda cur: cur.execute(release_sql, job.params()))
+
+    def reap(self) -> List[Tuple[str, str, str]]:
+        """Queue again (or fail) the jobs of workers that stopped sending heartbeats"""
+        def reap(cur):
+            cur.execute(reap_sql, dict(max_attempts=max_attempts, timeout=job_timeout))
+            return cur.fetchall()
+
+        return self._run(reap)
+
+    def pending(self) -> int:
+        def count(cur):
+            cur.execute(pending_sql)
+            return cur.fetchone()[0]
+
+        return self._run(count)
+
+    def retry_failed(self) -> int:
+        def retry(cur):
+            cur.execute(retry_failed_sql)
+            return cur.rowcount
+
+        return self._run(retry)
+
+    def status(self) -> Tuple[Dict[str, Tuple[int, int]], List[tuple], List[tuple]]:
+        """({status: (jobs, rows inserted)}, running jobs, failed jobs)"""
+        def status(cur):
+            cur.execute(status_sql)
+            counts = {s: (n, inserted) for s, n, inserted in cur.fetchall()}
+            cur.execute(running_sql)
+            running = cur.fetchall()
+            cur.execute(failed_sql)
+            return counts, running, cur.fetchall()
+
+        return self._run(status)
+
+class ClaimCheck:
+    """
+    load_file before_commit hook: marks the job done in the load's own transaction, so rows and
+    job state commit together. Raises JobLost (rolling the load back) when the job was reclaimed.
+    marked tells whether a load got as far as marking the job.
+    """
+
+    def __init__(self, job: Job):
+        self.job = job
+        self.marked = False
+
+    def __call__(self, cur):
+        cur.execute(done_sql, self.job.params())
+        if cur.rowcount != 1:
+            raise JobLost(f"{self.job.file_path} was reassigned after {self.job.worker} missed its heartbeats")
+        self.marked = True
+
+class Heartbeat(threading.Thread):
+    """Refreshes the current job's heartbeat from its own connection while the main thread loads"""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.job: Optional[Job] = None
+        self.queue = LoadQueue()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(heartbeat_interval):
+            job = self.job
+            if job is None:
+                continue
+            try:
+                if not self.queue.heartbeat(job):
+                    print(f"Lost {job.file_path}: another worker took it over")
+            except Exception as e:
+                print(f"Heartbeat for {job.file_path} failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.queue.close()
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def run_worker(load_options: dict, drain: bool = False, worker: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Claim and load queued files until stopped, or with drain until nothing is queued or running.
+    Returns (files loaded, failed attempts). SIGTERM and Ctrl-C hand the current file back to the queue.
+    """
+    worker = worker or worker_name()
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    queue = LoadQueue()
+    pool = db.create_pool(minconn=1, maxconn=1, profile="bulk_load")
+    heartbeat = Heartbeat()
+    heartbeat.start()
+    loaded = failed = 0
+    job = None
+    print(f"Worker {worker} started")
+    try:
+        while True:
+            for file_path, dead_worker, status in queue.reap():
+                print(f"{file_path}: worker {dead_worker} stopped sending heartbeats; job {status}")
+            job = queue.claim(worker)
+            if job is None:
+                if drain and queue.pending() == 0:
+                    break
+                time.sleep(poll_interval)
+                continue
+            heartbeat.job = job
+            filepath = os.path.join(load_batch.project_root, job.file_path)
+            print(f"[{worker}] Processing: {job.file_path} (attempt {job.attempts})")
+            try:
+                if not os.path.exists(filepath):
+                    raise FileNotFoundError(f"{filepath} not found on {socket.gethostname()}")
+                check = ClaimCheck(job)
+                inserted, skipped = load_batch.load_file_retrying(pool, filepath, before_commit=check,
+                                                                  **load_options)
+                # a load that returned without committing would leave the job running until it is reaped
+                if not check.marked:
+                    raise RuntimeError(f"the load of {job.file_path} ended without marking its job done")
+                queue.finish(job, inserted, skipped)
+                loaded += 1
+            except JobLost as e:
+                print(f"[{worker}] {e}; its load was rolled back")
+            except Exception as e:
+                traceback.print_exc()
+                status = queue.fail(job, str(e).strip())
+                print(f"[{worker}] Error loading {job.file_path}: {e}; job {status}")
+                failed += 1
+            finally:
+                heartbeat.job = None
+            job = None
+    except KeyboardInterrupt:
+        if job is not None:
+            queue.release(job)
+            print(f"[{worker}] Stopped; {job.file_path} is queued again")
+    finally:
+        heartbeat.stop()
+        pool.closeall()
+        queue.close()
+    print(f"Worker {worker} done: {loaded} file(s) loaded, {failed} failed attempt(s)")
+    return loaded, failed
+
+def _worker_process(load_options: dict, drain: bool):
+    try:
+        run_worker(load_options, drain)
+    except KeyboardInterrupt:
+        pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Share batch loads between loader workers through the load_jobs queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    enqueue_parser = sub.add_parser("enqueue", help="queue the batch files (coordinator)")
+    catalog.add_filter_arguments(enqueue_parser)
+    enqueue_parser.add_argument("--full", action="store_true",
+                                help="queue every file, including files unchanged since their last load")
+    enqueue_parser.add_argument("--target", choices=load_batch.load_targets, default="vehicles",
+                                help="the --target the workers load with; files loaded for another target are queued")
+    enqueue_parser.add_argument("--storage", choices=load_batch.storage_modes, default="wide",
+                                help="the --storage the workers load with; files loaded with another storage are queued")
+    work_parser = sub.add_parser("work", help="claim and load queued files")
+    load_batch.add_load_arguments(work_parser)
+    work_parser.add_argument("--processes", type=int, default=1, help="worker processes on this host (default: 1)")
+    work_parser.add_argument("--drain", action="store_true",
+                             help="exit once no job is queued or running instead of waiting for more")
+    sub.add_parser("status", help="job counts, running and failed jobs")
+    sub.add_parser("retry-failed", help="queue the failed jobs again")
+    args = parser.parse_args(argv)
+
+    queue = LoadQueue()
+    try:
+        if args.command == "enqueue":
+            files = load_batch.find_csv_files(load_batch.batch_dir, args.station, args.year, args.start, args.end)
+            unchanged = []
+            if files and not args.full:
+                conn = db.get_connection()
+                try:
+                    files, unchanged = load_batch.plan_files(conn, files, args.target, args.storage)
+                finally:
+                    conn.close()
+            queued = queue.enqueue(files)
+            print(f"Queued {queued} file(s); {len(files) - queued} already running, {len(unchanged)} unchanged skipped")
+        elif args.command == "work":
+            load_batch.check_load_arguments(work_parser, args)
+            load_options = load_batch.options_from_args(args)
+            if args.processes <= 1:
+                queue.close()
+                _, failed = run_worker(load_options, args.drain)
+                sys.exit(1 if failed else 0)
+            processes = [multiprocessing.Process(target=_worker_process, args=(load_options, args.drain))
+                         for _ in range(args.processes)]
+            for p in processes:
+                p.start()
+            try:
+                for p in processes:
+                    p.join()
+            except KeyboardInterrupt:
+                # the children got the same Ctrl-C and release their jobs
+                for p in processes:
+                    p.join()
+        elif args.command == "retry-failed":
+            print(f"Queued {queue.retry_failed()} failed job(s) again")
+        else:
+            for file_path, worker, status in queue.reap():
+                print(f"{file_path}: worker {worker} stopped sending heartbeats; job {status}")
+            counts, running, failed = queue.status()
+            for status in ["queued", "running", "done", "failed"]:
+                jobs, inserted = counts.get(status, (0, 0))
+                print(f"{status:<8} {jobs:>6} job(s)" + (f", {inserted} rows inserted" if status == "done" else ""))
+            for file_path, worker, attempts, age in running:
+                print(f"  running {file_path} on {worker} (attempt {attempts}, heartbeat {age}s ago)")
+            for file_path, attempts, error in failed:
+                print(f"  failed  {file_path} after {attempts} attempt(s): {error}")
+    finally:
+        queue.close()
+
+if __name__ == "__main__":
+    main()
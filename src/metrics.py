@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import pstats
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# resource is unix-only; peak memory is reported as null elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb() -> Optional[float]:
+    """Process high-water mark of resident memory in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+class RunMetrics:
+    """
+    Wall time, row counts and peak memory per stage and per file for one load run.
+    Stages called outside begin_file/end_file (e.g. from the benchmark) are not recorded.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, dict] = {}
+        self.current: Optional[dict] = None
+        self._file_start = 0.0
+
+    def begin_file(self, filepath: str):
+        self.current = {"file": filepath, "status": "ok", "stages": {}}
+        self.files[filepath] = self.current
+        self._file_start = time.perf_counter()
+
+    def end_file(self, inserted: int = 0, skipped: int = 0, status: str = "ok", error: Optional[str] = None):
+        if self.current is None:
+            return
+        seconds = time.perf_counter() - self._file_start
+        self.current.update({
+            "status": status,
+            "seconds": round(seconds, 4),
+            "inserted": inserted,
+            "skipped": skipped,
+            "rows_per_sec": round(inserted / seconds) if seconds > 0 else None,
+            "peak_rss_mb": peak_rss_mb(),
+        })
+        if error:
+            self.current["error"] = error
+        self.current = None
+
+    def fail_file(self, filepath: str, error: str):
+        # files that failed in another process only have their error recorded
+        entry = self.files.setdefault(filepath, {"file": filepath, "stages": {}})
+        entry.update({"status": "error", "error": error})
+        entry.setdefault("seconds", None)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time one stage call; set record["rows"] inside the block to count rows"""
+        record = {}
+        if self.current is None:
+            yield record
+            return
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            totals = self.current["stages"].setdefault(name, {"seconds": 0.0, "rows": 0, "calls": 0})
+            totals["seconds"] += elapsed
+            totals["rows"] += record.get("rows", 0)
+            totals["calls"] += 1
+            totals["peak_rss_mb"] = peak_rss_mb()
+
+    def timed_iter(self, name: str, iterable: Iterable) -> Iterator:
+        """Charge the time spent producing each item of a lazy iterable (e.g. a chunked reader) to a stage"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as record:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                record["rows"] = len(item) if hasattr(item, "__len__") else 0
+            yield item
+
+    def take_file(self, filepath: str) -> Optional[dict]:
+        """Remove and return one file's metrics (worker processes send them back to main)"""
+        return self.files.pop(filepath, None)
+
+    def add_file(self, entry: Optional[dict]):
+        if entry:
+            self.files[entry["file"]] = entry
+
+    def report(self, slowest: int = 10, **run_info) -> dict:
+        stage_totals: Dict[str, dict] = {}
+        for entry in self.files.values():
+            for name, s in entry["stages"].items():
+                total = stage_totals.setdefault(name, {"seconds": 0.0, "rows": 0, "calls": 0, "peak_rss_mb": None})
+                total["seconds"] += s["seconds"]
+                total["rows"] += s["rows"]
+                total["calls"] += s["calls"]
+                if s.get("peak_rss_mb") is not None:
+                    total["peak_rss_mb"] = max(total["peak_rss_mb"] or 0, s["peak_rss_mb"])
+            for s in entry["stages"].values():
+                s["seconds"] = round(s["seconds"], 4)
+                s["rows_per_sec"] = round(s["rows"] / s["seconds"]) if s["seconds"] > 0 and s["rows"] else None
+        for total in stage_totals.values():
+            total["seconds"] = round(total["seconds"], 4)
+            total["rows_per_sec"] = round(total["rows"] / total["seconds"]) if total["seconds"] > 0 and total["rows"] else None
+
+        files = list(self.files.values())
+        timed = [f for f in files if f.get("seconds") is not None]
+        return {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            **run_info,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": stage_totals,
+            "slowest_files": [
+                {"file": f["file"], "seconds": f["seconds"], "inserted": f.get("inserted", 0)}
+                for f in sorted(timed, key=lambda f: f["seconds"], reverse=True)[:slowest]
+            ],
+            "failed_files": [{"file": f["file"], "error": f.get("error")} for f in files if f.get("status") == "error"],
+            "files": files,
+        }
+
+def hot_functions(stats: pstats.Stats, limit: int = 25) -> List[dict]:
+    """Top functions by own time from merged cProfile stats"""
+    rows = []
+    for (filename, lineno, func), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{lineno}({func})",
+            "calls": nc,
+            "tottime": round(tt, 4),
+            "cumtime": round(ct, 4),
+        })
+    rows.sort(key=lambda r: r["tottime"], reverse=True)
+    return rows[:limit]
+
+def write_report(path: str, report: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as fh:
+        json.dump(report, fh, indent=2, default=str)
@@ -0,0 +1,286 @@
+import os
+import re
+import sys
+import time
+import argparse
+from datetime import datetime
+from typing import Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from db import get_connection
+from create_tables import VEHICLES_BATCH_QUERIES, VEHICLES_BATCH_INDEXES, is_partitioned_sql
+
+parent_table = "vehicles_batch"
+partition_intervals = ["year", "month"]
+# interval used for the first partitions; once partitions exist their names decide
+default_interval = os.getenv("PARTITION_INTERVAL") or "year"
+
+# vehicles_batch_y2019 (year) or vehicles_batch_y2019m03 (month)
+_partition_name = re.compile(r"^vehicles_batch_y(\d{4})(?:m(\d{2}))?$")
+
+# serializes partition creation between concurrent loads; held until the loading transaction ends
+partition_lock_key = 0x76625f70  # "vb_p"
+
+partitions_sql = f"""
+SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint, pg_total_relation_size(c.oid), i.inhdetachpending
+FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = '{parent_table}'::regclass
+ORDER BY c.relname"""
+# CREATE TABLE ... PARTITION OF locks the parent ACCESS EXCLUSIVE; ATTACH only needs SHARE UPDATE
+# EXCLUSIVE, so partitions can be added while other loads and queries run
+create_partition_sql = f"CREATE TABLE {{name}} (LIKE {parent_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+attach_partition_sql = f"ALTER TABLE {parent_table} ATTACH PARTITION {{name}} FOR VALUES FROM (%s) TO (%s)"
+# CONCURRENTLY waits for running queries instead of blocking new ones; it cannot run in a transaction
+detach_partition_sql = f"ALTER TABLE {parent_table} DETACH PARTITION {{name}} CONCURRENTLY"
+finalize_detach_sql = f"ALTER TABLE {parent_table} DETACH PARTITION {{name}} FINALIZE"
+
+def is_partitioned(conn) -> bool:
+    cur = conn.cursor()
+    try:
+        cur.execute(is_partitioned_sql)
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+
+def partition_name(start: datetime, interval: str) -> str:
+    if interval == "month":
+        return f"{parent_table}_y{start.year}m{start.month:02d}"
+    return f"{parent_table}_y{start.year}"
+
+def partition_bounds(start: datetime, interval: str) -> Tuple[datetime, datetime]:
+    if interval == "month":
+        start = datetime(start.year, start.month, 1)
+        end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    else:
+        start = datetime(start.year, 1, 1)
+        end = datetime(start.year + 1, 1, 1)
+    return start, end
+
+def list_partitions(conn) -> List[dict]:
+    cur = conn.cursor()
+    try:
+        cur.execute(partitions_sql)
+        return [{"name": name, "bounds": bounds, "rows": max(rows, 0), "bytes": size, "detach_pending": pending}
+                for name, bounds, rows, size, pending in cur.fetchall()]
+    finally:
+        cur.close()
+
+def partition_interval(names: Iterable[str]) -> str:
+    """Interval of existing partitions, from their names"""
+    for name in names:
+        m = _partition_name.match(name)
+        if m:
+            return "month" if m.group(2) else "year"
+    return default_interval
+
+def create_partition(cur, start: datetime, interval: str) -> str:
+    start, end = partition_bounds(start, interval)
+    name = partition_name(start, interval)
+    cur.execute(create_partition_sql.format(name=name))
+    cur.execute(attach_partition_sql.format(name=name), (start, end))
+    return name
+
+class PartitionRouter:
+    """
+    Splits vehicle frames by departure_time partition for one loading transaction,
+    creating missing partitions in that transaction.
+    With route=True each part is written straight into its partition table instead of the parent.
+    """
+
+    def __init__(self, conn, route: bool = False):
+        self.conn = conn
+        self.route = route
+        self.known = {p["name"] for p in list_partitions(conn)}
+        self.interval = partition_interval(self.known)
+        self._unit = "datetime64[M]" if self.interval == "month" else "datetime64[Y]"
+
+    def ensure(self, starts: Iterable[datetime]):
+        missing = [s for s in starts if partition_name(s, self.interval) not in self.known]
+        if not missing:
+            return
+        cur = self.conn.cursor()
+        try:
+            # another load may have added the same partition while we waited for the lock
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (partition_lock_key,))
+            self.known = {p["name"] for p in list_partitions(self.conn)}
+            for start in missing:
+                if partition_name(start, self.interval) not in self.known:
+                    name = create_partition(cur, start, self.interval)
+                    self.known.add(name)
+                    print(f"Created partition {name}")
+        finally:
+            cur.close()
+
+    def split(self, df: pd.DataFrame) -> List[Tuple[str, pd.DataFrame]]:
+        """(table, rows) pairs covering every row with a departure_time; rows without one cannot be stored"""
+        keys = df["departure_time"].to_numpy(dtype="datetime64[ns]").astype(self._unit)
+        valid = ~np.isnat(keys)
+        if not valid.all():
+            df = df[valid].reset_index(drop=True)
+            keys = keys[valid]
+        if len(keys) == 0:
+            return []
+        first = keys[0]
+        if (keys == first).all():
+            groups = [(first, df)]
+        else:
+            groups = [(k, df[keys == k].reset_index(drop=True)) for k in np.unique(keys)]
+        starts = {k: pd.Timestamp(k).to_pydatetime() for k, _ in groups}
+        self.ensure(starts.values())
+        if not self.route:
+            return [(parent_table, df)]
+        return [(partition_name(starts[k], self.interval), part) for k, part in groups]
+
+def drop_secondary_indexes(conn) -> List[str]:
+    """Drop the query indexes before a large load; returns the names that existed"""
+    cur = conn.cursor()
+    dropped = []
+    try:
+        for name in VEHICLES_BATCH_INDEXES:
+            cur.execute("SELECT to_regclass(%s)", (name,))
+            if cur.fetchone()[0] is not None:
+                cur.execute(f"DROP INDEX {name}")
+                dropped.append(name)
+        conn.commit()
+        return dropped
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+def create_secondary_indexes(conn) -> float:
+    """(Re)build the query indexes, one partition at a time, and refresh planner statistics"""
+    start = time.perf_counter()
+    cur = conn.cursor()
+    try:
+        for ddl in VEHICLES_BATCH_INDEXES.values():
+            cur.execute(ddl)
+        cur.execute(f"ANALYZE {parent_table}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return time.perf_counter() - start
+
+def migrate(conn, interval: str = default_interval) -> int:
+    """
+    Convert a heap vehicles_batch into the partitioned table in one transaction, keeping vehicle_id values.
+    Returns the number of rows moved.
+    """
+    if is_partitioned(conn):
+        return 0
+    cur = conn.cursor()
+    try:
+        cur.execute(f"LOCK TABLE {parent_table} IN ACCESS EXCLUSIVE MODE")
+        # move the old table and everything named after it out of the way
+        cur.execute(f"ALTER TABLE {parent_table} RENAME TO {parent_table}_heap")
+        cur.execute(f"ALTER SEQUENCE IF EXISTS {parent_table}_vehicle_id_seq RENAME TO {parent_table}_heap_vehicle_id_seq")
+        cur.execute(f"ALTER TABLE {parent_table}_heap DROP CONSTRAINT IF EXISTS {parent_table}_pkey")
+        # a heap from before the natural key has no station and seq yet
+        cur.execute(f"ALTER TABLE {parent_table}_heap ADD COLUMN IF NOT EXISTS station VARCHAR(50), "
+                    "ADD COLUMN IF NOT EXISTS seq INTEGER")
+        cur.execute(f"DROP INDEX IF EXISTS idx_vehicles_batch_source_file, {', '.join(VEHICLES_BATCH_INDEXES)}")
+        for query in VEHICLES_BATCH_QUERIES:
+            cur.execute(query)
+        cur.execute(f"SELECT DISTINCT date_trunc(%s, departure_time) FROM {parent_table}_heap WHERE departure_time IS NOT NULL",
+                    (interval,))
+        for (start,) in sorted(cur.fetchall()):
+            print(f"Created partition {create_partition(cur, start, interval)}")
+        columns = "vehicle_id, vehicle_number, vehicle_type, departure_time, arrival_time, origin, destination, recorded_at, source_file, station, seq"
+        cur.execute(f"INSERT INTO {parent_table} ({columns}) SELECT {columns} FROM {parent_table}_heap "
+                    "WHERE departure_time IS NOT NULL ORDER BY departure_time")
+        moved = cur.rowcount
+        cur.execute(f"SELECT setval('{parent_table}_vehicle_id_seq', GREATEST(COALESCE(MAX(vehicle_id), 0), 1)) FROM {parent_table}_heap")
+        cur.execute(f"SELECT count(*) FROM {parent_table}_heap WHERE departure_time IS NULL")
+        dropped = cur.fetchone()[0]
+        if dropped:
+            print(f"Dropped {dropped} row(s) without departure_time (they have no partition)")
+        cur.execute(f"DROP TABLE {parent_table}_heap")
+        for ddl in VEHICLES_BATCH_INDEXES.values():
+            cur.execute(ddl)
+        conn.commit()
+        return moved
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+def detach_year(conn, year: int, drop: bool = False) -> List[str]:
+    """
+    Detach every partition of one year (CONCURRENTLY, so readers and loads of other years keep running).
+    The detached tables are kept as plain tables unless drop is set.
+    """
+    names = [p["name"] for p in list_partitions(conn)
+             if (_partition_name.match(p["name"]) or [None, None])[1] == str(year)]
+    conn.rollback()
+    old_autocommit = conn.autocommit
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        for name in names:
+            cur.execute(detach_partition_sql.format(name=name))
+            print(f"Detached {name}")
+            if drop:
+                cur.execute(f"DROP TABLE {name}")
+                print(f"Dropped {name}")
+    finally:
+        cur.close()
+        conn.autocommit = old_autocommit
+    return names
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the departure_time partitions of vehicles_batch")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show partitions with estimated rows and size")
+    migrate_parser = sub.add_parser("migrate", help="convert an unpartitioned vehicles_batch (rows are kept)")
+    migrate_parser.add_argument("--interval", choices=partition_intervals, default=default_interval)
+    create_parser = sub.add_parser("create", help="pre-create partitions for a range of years")
+    create_parser.add_argument("first_year", type=int)
+    create_parser.add_argument("last_year", type=int)
+    detach_parser = sub.add_parser("detach", help="detach (and optionally drop) all partitions of a year")
+    detach_parser.add_argument("year", type=int)
+    detach_parser.add_argument("--drop", action="store_true", help="drop the detached tables")
+    finalize_parser = sub.add_parser("finalize", help="complete a detach that was interrupted")
+    finalize_parser.add_argument("name")
+    sub.add_parser("reindex", help="(re)build the vehicles_batch query indexes")
+    args = parser.parse_args(argv)
+
+    conn = get_connection()
+    try:
+        if args.command not in ("migrate", "reindex") and not is_partitioned(conn):
+            print("vehicles_batch is not partitioned; run: python src/partitions.py migrate")
+            sys.exit(1)
+        if args.command == "list":
+            for p in list_partitions(conn):
+                pending = " (detach pending)" if p["detach_pending"] else ""
+                print(f"{p['name']}: {p['bounds']}, ~{p['rows']} rows, {p['bytes'] / (1024 * 1024):.1f} MB{pending}")
+        elif args.command == "migrate":
+            start = time.perf_counter()
+            moved = migrate(conn, args.interval)
+            print(f"Moved {moved} rows into partitioned vehicles_batch in {time.perf_counter() - start:.1f}s")
+        elif args.command == "create":
+            router = PartitionRouter(conn)
+            router.ensure(datetime(y, m, 1) for y in range(args.first_year, args.last_year + 1)
+                          for m in (range(1, 13) if router.interval == "month" else [1]))
+            conn.commit()
+        elif args.command == "detach":
+            if not detach_year(conn, args.year, args.drop):
+                print(f"No partitions for {args.year}")
+        elif args.command == "finalize":
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(finalize_detach_sql.format(name=args.name))
+            print(f"Detached {args.name}")
+        else:
+            print(f"Indexes built in {create_secondary_indexes(conn):.1f}s")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
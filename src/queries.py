@@ -0,0 +1,366 @@
+import os
+import sys
+import time
+import uuid
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+
+from db import create_pool, get_connection, load_channel, rollback
+
+# pyarrow is optional: without it only the numpy and pandas formats are available
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+load_dotenv()
+
+formats = ["pandas", "numpy", "arrow"]
+default_batch_rows = 50000
+cache_ttl = float(os.getenv("QUERY_CACHE_TTL") or 300)
+cache_entries = int(os.getenv("QUERY_CACHE_ENTRIES") or 128)
+# results larger than this are returned but not cached
+cache_max_rows = int(os.getenv("QUERY_CACHE_MAX_ROWS") or 1000000)
+# read-only connections for queries without an explicit conn, one per open stream
+pool_connections = int(os.getenv("QUERY_POOL_CONNECTIONS") or 8)
+
+# column kinds of a result: (name, kind)
+Columns = Sequence[Tuple[str, str]]
+_numpy_dtypes = {"str": object, "int": np.int64, "float": np.float64,
+                 "datetime": "datetime64[us]", "date": "datetime64[D]"}
+# timestamps and dates are fetched as text: numpy and Arrow parse ISO strings many times
+# faster than they convert the datetime objects psycopg2 would build for every value
+_text_types = psycopg2.extensions.new_type((1114, 1082), "QUERY_TEXT_TIME", lambda value, cur: value)
+
+station_hourly_sql = """
+SELECT hour_start, vehicle_type, sum(vehicle_count) AS vehicle_count
+FROM rollup_station_hour
+WHERE station = %(station)s AND hour_start >= %(start)s AND hour_start < %(end)s
+  AND (%(vehicle_type)s IS NULL OR vehicle_type = %(vehicle_type)s)
+GROUP BY 1, 2 ORDER BY 1, 2"""
+station_hourly_columns = [("hour_start", "datetime"), ("vehicle_type", "str"), ("vehicle_count", "int")]
+
+station_daily_sql = """
+SELECT station, day, vehicle_type, vehicle_count
+FROM rollup_station_day
+WHERE (%(station)s IS NULL OR station = %(station)s) AND day >= %(start)s AND day < %(end)s
+  AND (%(vehicle_type)s IS NULL OR vehicle_type = %(vehicle_type)s)
+ORDER BY 1, 2, 3"""
+station_daily_columns = [("station", "str"), ("day", "date"), ("vehicle_type", "str"), ("vehicle_count", "int")]
+
+network_daily_sql = """
+SELECT day, sum(vehicle_count) AS vehicle_count
+FROM rollup_network_day
+WHERE day >= %(start)s AND day < %(end)s AND (%(vehicle_type)s IS NULL OR vehicle_type = %(vehicle_type)s)
+GROUP BY 1 ORDER BY 1"""
+network_daily_columns = [("day", "date"), ("vehicle_count", "int")]
+
+# vehicles_batch_view reads the compact vehicle_facts storage with the same columns
+vehicle_tables = {"wide": "vehicles_batch", "compact": "vehicles_batch_view"}
+vehicles_sql = """
+SELECT vehicle_number, vehicle_type, departure_time, arrival_time, origin, destination
+FROM {table}
+WHERE departure_time >= %(start)s AND departure_time < %(end)s
+  AND (%(vehicle_type)s IS NULL OR vehicle_type = %(vehicle_type)s)
+  AND (%(origin)s IS NULL OR origin LIKE %(origin)s)"""
+vehicles_columns = [("vehicle_number", "str"), ("vehicle_type", "str"), ("departure_time", "datetime"),
+                    ("arrival_time", "datetime"), ("origin", "str"), ("destination", "str")]
+
+class ResultCache:
+    """
+    LRU of materialized query results, each kept for at most ttl seconds.
+    Every lookup first checks for load notifications, so nothing loaded after a result was cached is missed.
+    """
+
+    def __init__(self, max_entries: int = cache_entries, ttl: float = cache_ttl, max_rows: int = cache_max_rows):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener = LoadListener()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if self._listener.changed():
+            self.clear()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any, rows: int):
+        if rows > self.max_rows or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class LoadListener:
+    """
+    LISTENs on load_channel, which load_batch notifies inside each load transaction,
+    so a notification arrives exactly when a load commits. changed() never blocks.
+    Safe to share between threads: the connection is used under a lock.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = get_connection()
+        conn.autocommit = True
+        conn.cursor().execute(f"LISTEN {load_channel}")
+        self._conn = conn
+
+    def changed(self) -> bool:
+        """True if a load committed since the last call (or if that cannot be known)"""
+        with self._lock:
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._connect()
+                    # loads while we were not listening are unknown
+                    return True
+                self._conn.poll()
+            except psycopg2.Error:
+                self._close()
+                return True
+            if self._conn.notifies:
+                self._conn.notifies.clear()
+                return True
+            return False
+
+    def _close(self):
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        self._conn = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+# per-process cache used by fetch()
+cache = ResultCache()
+_pool = None
+_pool_lock = threading.Lock()
+
+def _checkout():
+    """
+    A read-only connection of the module pool for one stream. Every stream gets its own, so
+    ending one stream's transaction never invalidates the cursor of another that is still open.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool(minconn=1, maxconn=pool_connections)
+    conn = _pool.getconn()
+    if not conn.readonly:
+        conn.set_session(readonly=True)
+    return conn
+
+def _checkin(conn):
+    try:
+        rollback(conn)
+    finally:
+        _pool.putconn(conn)
+
+def _convert(rows: List[tuple], columns: Columns, fmt: str):
+    """One batch of rows in the requested format"""
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    if fmt == "arrow":
+        if pa is None:
+            raise RuntimeError("the arrow format needs pyarrow")
+        arrow_types = {"str": pa.string(), "int": pa.int64(), "float": pa.float64(),
+                       "datetime": pa.timestamp("us"), "date": pa.date32()}
+        arrays = [pa.array(v, type=pa.string()).cast(arrow_types[kind]) if kind in ("datetime", "date")
+                  else pa.array(v, type=arrow_types[kind]) for (_, kind), v in zip(columns, values)]
+        return pa.RecordBatch.from_arrays(arrays, names=[name for name, _ in columns])
+    arrays = {name: np.array(v, dtype=_numpy_dtypes[kind]) for (name, kind), v in zip(columns, values)}
+    if fmt == "numpy":
+        return arrays
+    return pd.DataFrame(arrays)
+
+def _combine(batches: list, columns: Columns, fmt: str):
+    if not batches:
+        return _convert([], columns, fmt)
+    if fmt == "arrow":
+        return pa.Table.from_batches(batches)
+    if fmt == "numpy":
+        return {name: np.concatenate([b[name] for b in batches]) for name, _ in columns}
+    return pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+
+def _copy(result, fmt: str):
+    # cached pandas/numpy results are mutable; callers get their own copy (Arrow tables are immutable)
+    if fmt == "pandas":
+        return result.copy()
+    if fmt == "numpy":
+        return {name: a.copy() for name, a in result.items()}
+    return result
+
+def stream(sql: str, params: Dict[str, Any], columns: Columns, fmt: str = "pandas",
+           batch_rows: int = default_batch_rows, conn=None) -> Iterator[Any]:
+    """
+    Run sql through a named (server-side) cursor and yield batches of at most batch_rows rows,
+    so only one batch is held in memory. Without conn the stream runs on a read-only connection of
+    its own from the module pool, whose transaction ends when the stream does. A conn passed in is
+    left in its transaction.
+    """
+    if fmt not in formats:
+        raise ValueError(f"unknown format {fmt!r}, expected one of {formats}")
+    own = conn is None
+    conn = _checkout() if own else conn
+    try:
+        cur = conn.cursor(name=f"query_{uuid.uuid4().hex[:12]}")
+        psycopg2.extensions.register_type(_text_types, cur)
+        try:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_rows)
+                if not rows:
+                    break
+                yield _convert(rows, columns, fmt)
+        finally:
+            if not conn.closed:
+                cur.close()
+    finally:
+        if own:
+            _checkin(conn)
+
+def fetch(sql: str, params: Dict[str, Any], columns: Columns, fmt: str = "pandas",
+          batch_rows: int = default_batch_rows, conn=None, use_cache: bool = True):
+    """The whole result of sql in one object, served from the result cache when possible"""
+    key = (sql, tuple(sorted(params.items())), fmt)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return _copy(cached, fmt)
+    result = _combine(list(stream(sql, params, columns, fmt, batch_rows, conn)), columns, fmt)
+    if use_cache:
+        cache.put(key, result, result.num_rows if fmt == "arrow" else len(result[columns[0][0]]))
+        return _copy(result, fmt)
+    return result
+
+def station_hourly(station: str, start: datetime, end: datetime, vehicle_type: Optional[str] = None,
+                   fmt: str = "pandas", **options):
+    """Vehicles counted per hour and type at one station (e.g. F00101) in [start, end)"""
+    params = {"station": station, "start": start, "end": end, "vehicle_type": vehicle_type}
+    return fetch(station_hourly_sql, params, station_hourly_columns, fmt, **options)
+
+def station_daily(start: date, end: date, station: Optional[str] = None, vehicle_type: Optional[str] = None,
+                  fmt: str = "pandas", **options):
+    """Vehicles counted per station, day and type in [start, end); every station when station is None"""
+    params = {"station": station, "start": start, "end": end, "vehicle_type": vehicle_type}
+    return fetch(station_daily_sql, params, station_daily_columns, fmt, **options)
+
+def network_daily(start: date, end: date, vehicle_type: Optional[str] = None, fmt: str = "pandas", **options):
+    """Vehicles counted per day over all stations in [start, end)"""
+    params = {"start": start, "end": end, "vehicle_type": vehicle_type}
+    return fetch(network_daily_sql, params, network_daily_columns, fmt, **options)
+
+def _vehicles_query(start: datetime, end: datetime, vehicle_type: Optional[str], station: Optional[str],
+                    storage: str) -> Tuple[str, Dict[str, Any]]:
+    # origins of count file vehicles start with their location, <station>_traffic_count_<year>
+    origin = station.replace("_", r"\_") + r"\_traffic\_count\_%" if station else None
+    params = {"start": start, "end": end, "vehicle_type": vehicle_type, "origin": origin}
+    return vehicles_sql.format(table=vehicle_tables[storage]), params
+
+def vehicles(start: datetime, end: datetime, vehicle_type: Optional[str] = None, station: Optional[str] = None,
+             storage: str = "wide", fmt: str = "pandas", **options):
+    """Vehicle rows departing in [start, end), optionally of one type and from one station"""
+    sql, params = _vehicles_query(start, end, vehicle_type, station, storage)
+    return fetch(sql, params, vehicles_columns, fmt, **options)
+
+def iter_vehicles(start: datetime, end: datetime, vehicle_type: Optional[str] = None, station: Optional[str] = None,
+                  storage: str = "wide", fmt: str = "pandas", batch_rows: int = default_batch_rows,
+                  conn=None) -> Iterator[Any]:
+    """vehicles() in batches of at most batch_rows rows, for ranges too large to hold in memory (not cached)"""
+    sql, params = _vehicles_query(start, end, vehicle_type, station, storage)
+    return stream(sql, params, vehicles_columns, fmt, batch_rows, conn)
+
+def _write(batches: Iterator[Any], out: Optional[str]) -> int:
+    """Write pandas batches to a csv/parquet file (or print the first ones); returns rows written"""
+    rows = 0
+    writer = None
+    try:
+        for i, df in enumerate(batches):
+            if out is None:
+                if i == 0:
+                    print(df.head(50).to_string(index=False))
+            elif out.endswith(".parquet"):
+                if pa is None:
+                    raise RuntimeError("parquet output needs pyarrow")
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                writer = writer or pq.ParquetWriter(out, table.schema)
+                writer.write_table(table)
+            else:
+                df.to_csv(out, mode="w" if i == 0 else "a", header=(i == 0), index=False)
+            rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the loaded traffic data")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in [("station-hourly", "hourly counts of one station"),
+                            ("station-daily", "daily counts per station"),
+                            ("network-daily", "daily counts over all stations"),
+                            ("vehicles", "vehicle rows by departure time (streamed)")]:
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--from", dest="start", required=True, type=datetime.fromisoformat, help="start (inclusive)")
+        p.add_argument("--to", dest="end", required=True, type=datetime.fromisoformat, help="end (exclusive)")
+        p.add_argument("--type", dest="vehicle_type", help="only this vehicle type")
+        if name != "network-daily":
+            p.add_argument("--station", required=(name == "station-hourly"), help="station code, e.g. F00101")
+        if name == "vehicles":
+            p.add_argument("--storage", choices=list(vehicle_tables), default="wide")
+        p.add_argument("--out", help="write a .csv or .parquet file instead of printing")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        if args.command == "vehicles":
+            batches = iter_vehicles(args.start, args.end, args.vehicle_type, args.station, args.storage)
+        elif args.command == "station-hourly":
+            batches = [station_hourly(args.station, args.start, args.end, args.vehicle_type)]
+        elif args.command == "station-daily":
+            batches = [station_daily(args.start.date(), args.end.date(), args.station, args.vehicle_type)]
+        else:
+            batches = [network_daily(args.start.date(), args.end.date(), args.vehicle_type)]
+        rows = _write(batches, args.out)
+    except Exception as e:
+        print(f"Query failed: {e}")
+        sys.exit(1)
+    print(f"{rows} rows in {time.perf_counter() - start:.2f}s" + (f", written to {args.out}" if args.out else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+import os
+import io
+import json
+import time
+import signal
+import asyncio
+import argparse
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import psycopg2
+
+from db import get_connection
+
+# one event per line (JSON object); recorded_at is optional and defaults to the receive time
+event_fields = ["vehicle_number", "vehicle_type", "latitude", "longitude", "speed", "status", "recorded_at"]
+copy_realtime_sql = f"COPY vehicles_realtime ({', '.join(event_fields)}) FROM STDIN"
+max_text_lengths = {"vehicle_number": 20, "vehicle_type": 20, "status": 20}
+
+# flush a micro-batch at batch_size events or flush_interval seconds after its first event
+batch_size = 5000
+flush_interval = 0.5
+# events waiting for the writer; sources stop reading (TCP, file) or drop (UDP) beyond this
+max_pending = 50000
+# writer retry backoff while the database is unavailable
+retry_initial = 0.5
+retry_max = 30.0
+
+class InvalidEvent(ValueError):
+    pass
+
+def is_data_error(exc: BaseException) -> bool:
+    """
+    True when the rows themselves were refused (SQLSTATE classes 22 data exception and 23 integrity
+    constraint violation), so other rows can still be written. Anything else - a lost connection,
+    a full disk, a read-only standby, a missing table or privilege - refuses every row alike.
+    """
+    if isinstance(exc, (psycopg2.DataError, psycopg2.IntegrityError)):
+        return True
+    code = getattr(exc, "pgcode", None) or ""
+    return code.startswith("22") or code.startswith("23")
+
+def _text(event: dict, name: str, required: bool = False) -> Optional[str]:
+    value = event.get(name)
+    if value is None or value == "":
+        if required:
+            raise InvalidEvent(f"missing {name}")
+        return None
+    if not isinstance(value, str):
+        raise InvalidEvent(f"{name} must be a string")
+    value = value.strip()
+    if not value:
+        if required:
+            raise InvalidEvent(f"missing {name}")
+        return None
+    # COPY cannot store NUL, and no field has a use for control characters
+    if any(c < " " or c == "\x7f" for c in value):
+        raise InvalidEvent(f"{name} contains control characters")
+    if len(value) > max_text_lengths[name]:
+        raise InvalidEvent(f"{name} longer than {max_text_lengths[name]} characters")
+    return value
+
+def _number(event: dict, name: str, low: float, high: float, required: bool = True) -> Optional[float]:
+    value = event.get(name)
+    if value is None:
+        if required:
+            raise InvalidEvent(f"missing {name}")
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        raise InvalidEvent(f"{name} must be a number")
+    if not low <= value <= high:
+        raise InvalidEvent(f"{name} out of range [{low}, {high}]")
+    return float(value)
+
+def parse_event(line: bytes, received_at: float) -> Tuple:
+    """Validate one JSON line and return the vehicles_realtime row (event_fields order)"""
+    try:
+        event = json.loads(line)
+    except ValueError:
+        raise InvalidEvent("not valid JSON")
+    if not isinstance(event, dict):
+        raise InvalidEvent("not a JSON object")
+    recorded_at = event.get("recorded_at")
+    if recorded_at is None:
+        recorded_at = datetime.fromtimestamp(received_at)
+    else:
+        try:
+            recorded_at = datetime.fromisoformat(recorded_at)
+        except (TypeError, ValueError):
+            raise InvalidEvent("recorded_at must be an ISO timestamp")
+        if recorded_at.tzinfo is not None:
+            # the column is a local TIMESTAMP
+            recorded_at = recorded_at.astimezone().replace(tzinfo=None)
+    return (
+        _text(event, "vehicle_number", required=True),
+        _text(event, "vehicle_type"),
+        _number(event, "latitude", -90.0, 90.0),
+        _number(event, "longitude", -180.0, 180.0),
+        _number(event, "speed", 0.0, 1000.0, required=False),
+        _text(event, "status"),
+        recorded_at,
+    )
+
+def _copy_field(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, str):
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return repr(value)
+
+def copy_rows(conn, rows: List[Tuple]) -> int:
+    payload = "".join("\t".join(_copy_field(v) for v in row) + "\n" for row in rows)
+    cur = conn.cursor()
+    try:
+        cur.copy_expert(copy_realtime_sql, io.StringIO(payload))
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+class IngestStats:
+    """Counters of one service run; rates and lag cover the last `window` seconds of a snapshot"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.received = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.flush_errors = 0
+        self.failed = 0
+        self.pending = 0
+        # (commit time, rows, summed lag, max lag) of recent flushes
+        self._flushes = deque()
+        # (time, received) at each snapshot, for the receive rate
+        self._samples = deque([(self.started, 0)])
+
+    def record_flush(self, rows: int, lags: List[float]):
+        self.written += rows
+        self.batches += 1
+        self._flushes.append((time.time(), rows, sum(lags), max(lags, default=0.0)))
+
+    def snapshot(self, window: float = 10.0) -> dict:
+        now = time.time()
+        while self._flushes and self._flushes[0][0] < now - window:
+            self._flushes.popleft()
+        while len(self._samples) > 1 and self._samples[1][0] < now - window:
+            self._samples.popleft()
+        rows = sum(f[1] for f in self._flushes)
+        since, received_then = self._samples[0]
+        elapsed = now - since
+        self._samples.append((now, self.received))
+        return {
+            "uptime_seconds": round(now - self.started, 1),
+            "received": self.received,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "written": self.written,
+            "batches": self.batches,
+            "flush_errors": self.flush_errors,
+            "failed": self.failed,
+            "pending": self.pending,
+            "received_per_sec": round((self.received - received_then) / elapsed) if elapsed > 0 else None,
+            "written_per_sec": round(rows / min(window, now - self.started)) if now > self.started else None,
+            # lag = commit time - event recorded_at, over rows committed in the window
+            "lag_mean_seconds": round(sum(f[2] for f in self._flushes) / rows, 3) if rows else None,
+            "lag_max_seconds": round(max(f[3] for f in self._flushes), 3) if rows else None,
+        }
+
+class IngestService:
+    """
+    Reads position events from any number of sources into one bounded queue and writes
+    them to vehicles_realtime in micro-batches from a single writer connection.
+    The writer runs COPY in a worker thread while the next batch is collected.
+    """
+
+    def __init__(self, batch_size: int = batch_size, flush_interval: float = flush_interval,
+                 max_pending: int = max_pending, connect=get_connection):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.stats = IngestStats()
+        self.connect = connect
+        self.conn = None
+        self.stopping = asyncio.Event()
+        self._invalid_logged = 0
+        self._failed_logged = 0
+
+    def _accept(self, line: bytes) -> Optional[Tuple]:
+        line = line.strip()
+        if not line:
+            return None
+        self.stats.received += 1
+        try:
+            return parse_event(line, time.time())
+        except InvalidEvent as e:
+            self.stats.rejected += 1
+            if self._invalid_logged < 10:
+                self._invalid_logged += 1
+                print(f"Rejected event ({e}): {line[:120]!r}")
+            return None
+
+    async def submit(self, line: bytes):
+        """Queue one event line, waiting while the writer is behind"""
+        row = self._accept(line)
+        if row is not None:
+            await self.queue.put(row)
+
+    def submit_nowait(self, line: bytes):
+        """Queue one event line, dropping it when the queue is full (for sources that cannot wait)"""
+        row = self._accept(line)
+        if row is None:
+            return
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+
+    def _write(self, rows: List[Tuple]) -> int:
+        if self.conn is None or self.conn.closed:
+            self.conn = self.connect()
+        try:
+            return copy_rows(self.conn, rows)
+        except Exception as e:
+            # drop the connection unless the rows were at fault; the next attempt reconnects.
+            # copy_rows rolled back, so after a data error it stays usable for the rest of the batch
+            if self.conn.closed or not is_data_error(e):
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+                self.conn = None
+            raise
+
+    async def _flush(self, rows: List[Tuple]):
+        loop = asyncio.get_running_loop()
+        delay = retry_initial
+        while True:
+            try:
+                await loop.run_in_executor(None, self._write, rows)
+                break
+            except Exception as e:
+                self.stats.flush_errors += 1
+                if is_data_error(e):
+                    await self._split(rows, e)
+                    return
+                # the database is down or refuses every write: keep the batch, so the bounded
+                # queue holds back the sources until it accepts rows again
+                print(f"Flush of {len(rows)} event(s) failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, retry_max)
+        now = datetime.now()
+        self.stats.record_flush(len(rows), [(now - row[6]).total_seconds() for row in rows])
+
+    async def _split(self, rows: List[Tuple], error: Exception):
+        # a retry cannot get past an error in the data: write each half on its own until the
+        # rows that fail are isolated, then drop those and count them. A half that fails for
+        # any other reason is retried by _flush
+        if len(rows) > 1:
+            half = len(rows) // 2
+            await self._flush(rows[:half])
+            await self._flush(rows[half:])
+            return
+        self.stats.failed += 1
+        if self._failed_logged < 10:
+            self._failed_logged += 1
+            print(f"Dropped event that cannot be written ({str(error).strip()}): {rows[0]!r}")
+
+    async def writer(self):
+        """Collect micro-batches and flush them; at most one flush runs while the next batch fills"""
+        loop = asyncio.get_running_loop()
+        in_flight: Optional[asyncio.Task] = None
+        while not (self.stopping.is_set() and self.queue.empty()):
+            try:
+                first = await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                continue
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                # take what is already queued without yielding, then wait out the deadline
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                remaining = deadline - loop.time()
+                if len(batch) >= self.batch_size or remaining <= 0 or self.stopping.is_set():
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            if in_flight is not None:
+                await in_flight
+            self.stats.pending = self.queue.qsize()
+            in_flight = asyncio.create_task(self._flush(batch))
+        if in_flight is not None:
+            await in_flight
+
+    async def report(self, interval: float):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self.stats.pending = self.queue.qsize()
+            s = self.stats.snapshot()
+            lag = f"{s['lag_mean_seconds']:.3f}s mean / {s['lag_max_seconds']:.3f}s max" if s["lag_mean_seconds"] is not None else "-"
+            print(f"received {s['received']} ({s['received_per_sec']}/s), written {s['written']} ({s['written_per_sec']}/s), "
+                  f"pending {s['pending']}, rejected {s['rejected']}, dropped {s['dropped']}, failed {s['failed']}, lag {lag}")
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+
+async def serve_tcp(service: IngestService, host: str, port: int):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # awaiting submit stops reading the socket, so TCP flow control slows the sender
+            while not service.stopping.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                await service.submit(line)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            print(f"TCP client error: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Listening for events on tcp://{host}:{port}")
+    async with server:
+        await service.stopping.wait()
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, service: IngestService):
+        self.service = service
+
+    def datagram_received(self, data: bytes, addr):
+        for line in data.splitlines():
+            self.service.submit_nowait(line)
+
+async def serve_udp(service: IngestService, host: str, port: int):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: _UdpProtocol(service), local_addr=(host, port))
+    print(f"Listening for events on udp://{host}:{port} (events are dropped while the queue is full)")
+    try:
+        await service.stopping.wait()
+    finally:
+        transport.close()
+
+async def tail_file(service: IngestService, path: str, from_start: bool = False, poll: float = 0.2):
+    """Follow a JSONL file like tail -F: new lines are ingested, truncation and replacement reopen it"""
+    fh = None
+    inode = None
+    partial = b""
+    print(f"Tailing events from {path}")
+    while not service.stopping.is_set():
+        if fh is None:
+            try:
+                fh = open(path, "rb")
+            except FileNotFoundError:
+                await asyncio.sleep(poll)
+                continue
+            inode = os.fstat(fh.fileno()).st_ino
+            if not from_start:
+                fh.seek(0, os.SEEK_END)
+            from_start = True  # files that appear later are read from their beginning
+        chunk = fh.read(1 << 20)
+        if chunk:
+            lines = (partial + chunk).split(b"\n")
+            partial = lines.pop()
+            for line in lines:
+                await service.submit(line)
+            continue
+        try:
+            st = os.stat(path)
+            rotated = st.st_ino != inode or st.st_size < fh.tell()
+        except FileNotFoundError:
+            rotated = False
+        if rotated:
+            fh.close()
+            fh = None
+            partial = b""
+            continue
+        await asyncio.sleep(poll)
+    if fh is not None:
+        fh.close()
+
+async def serve_stats(service: IngestService, host: str, port: int):
+    """Counters as JSON over HTTP (any path), e.g. curl http://127.0.0.1:8766/"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readline()
+            service.stats.pending = service.queue.qsize()
+            body = json.dumps(service.stats.snapshot()).encode()
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n"
+                         + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Stats on http://{host}:{port}/")
+    async with server:
+        await service.stopping.wait()
+
+async def run(args: argparse.Namespace) -> dict:
+    service = IngestService(args.batch_size, args.flush_interval, args.max_pending)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, service.stopping.set)
+        except NotImplementedError:  # Windows
+            pass
+    if args.duration:
+        loop.call_later(args.duration, service.stopping.set)
+
+    sources = []
+    if args.tcp:
+        sources.append(serve_tcp(service, args.host, args.tcp))
+    if args.udp:
+        sources.append(serve_udp(service, args.host, args.udp))
+    if args.file:
+        sources.append(tail_file(service, args.file, args.from_start))
+    if args.stats_port:
+        sources.append(serve_stats(service, args.host, args.stats_port))
+    tasks = [asyncio.create_task(s) for s in sources]
+    tasks.append(asyncio.create_task(service.report(args.report_interval)))
+    try:
+        # the writer drains the queue after stop, so events already accepted are committed
+        await service.writer()
+    finally:
+        service.stopping.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception):
+                traceback.print_exception(type(r), r, r.__traceback__)
+        service.close()
+    return service.stats.snapshot()
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Ingest realtime vehicle positions into vehicles_realtime")
+    parser.add_argument("--tcp", type=int, metavar="PORT", help="accept JSON lines over TCP on this port")
+    parser.add_argument("--udp", type=int, metavar="PORT", help="accept JSON lines in UDP datagrams on this port")
+    parser.add_argument("--file", help="tail this JSONL file")
+    parser.add_argument("--from-start", action="store_true", help="read the tailed file from its beginning")
+    parser.add_argument("--host", default="127.0.0.1", help="address the TCP/UDP/stats listeners bind to")
+    parser.add_argument("--batch-size", type=int, default=batch_size, help=f"events per flush (default {batch_size})")
+    parser.add_argument("--flush-interval", type=float, default=flush_interval,
+                        help=f"seconds before a partial batch is flushed (default {flush_interval})")
+    parser.add_argument("--max-pending", type=int, default=max_pending,
+                        help=f"queued events before sources are paused (default {max_pending})")
+    parser.add_argument("--stats-port", type=int, help="serve the counters as JSON over HTTP on this port")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="seconds between progress lines")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    args = parser.parse_args(argv)
+    if not (args.tcp or args.udp or args.file):
+        parser.error("give at least one source: --tcp, --udp or --file")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    stats = asyncio.run(run(args))
+    print(f"Stopped. {json.dumps(stats)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import argparse
+from typing import List, Optional, Tuple
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from db import get_connection, load_channel
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+rollup_sources = ["files", "counts"]
+
+# serializes rollup updates between concurrent loads: the daily tables are shared by all files,
+# and updates happen right before each load commits, so the lock is held only briefly
+rollup_lock_key = 0x76625f72  # "vb_r"
+
+# a file's earlier contribution comes back out of the daily tables through its hourly rows
+remove_file_sql = """
+WITH old AS (
+    DELETE FROM rollup_station_hour WHERE source_file = %s
+    RETURNING station, hour_start::date AS day, vehicle_type, vehicle_count
+), per_day AS (
+    SELECT station, day, vehicle_type, sum(vehicle_count) AS vehicle_count FROM old GROUP BY 1, 2, 3
+), station_day AS (
+    UPDATE rollup_station_day r SET vehicle_count = r.vehicle_count - d.vehicle_count
+    FROM per_day d WHERE r.station = d.station AND r.day = d.day AND r.vehicle_type = d.vehicle_type
+), network_day AS (
+    UPDATE rollup_network_day r SET vehicle_count = r.vehicle_count - d.vehicle_count
+    FROM (SELECT day, vehicle_type, sum(vehicle_count) AS vehicle_count FROM per_day GROUP BY 1, 2) d
+    WHERE r.day = d.day AND r.vehicle_type = d.vehicle_type
+)
+SELECT count(*) FROM old"""
+delete_empty_sql = [
+    "DELETE FROM rollup_station_day WHERE station = %(station)s AND vehicle_count <= 0",
+    "DELETE FROM rollup_network_day WHERE vehicle_count <= 0",
+]
+insert_hour_sql = """
+INSERT INTO rollup_station_hour (station, hour_start, vehicle_type, vehicle_count, source_file) VALUES %s"""
+# the new hourly rows are added to the daily tables in the same statement; rows are upserted in
+# key order so two loads touching the same days lock them in the same order
+add_file_sql = """
+WITH new AS (
+    INSERT INTO rollup_station_hour (station, hour_start, vehicle_type, vehicle_count, source_file) VALUES %s
+    RETURNING station, hour_start::date AS day, vehicle_type, vehicle_count
+), station_day AS (
+    INSERT INTO rollup_station_day (station, day, vehicle_type, vehicle_count)
+    SELECT station, day, vehicle_type, sum(vehicle_count) FROM new GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+    ON CONFLICT (station, day, vehicle_type)
+    DO UPDATE SET vehicle_count = rollup_station_day.vehicle_count + EXCLUDED.vehicle_count
+)
+INSERT INTO rollup_network_day (day, vehicle_type, vehicle_count)
+SELECT day, vehicle_type, sum(vehicle_count) FROM new GROUP BY 1, 2 ORDER BY 1, 2
+ON CONFLICT (day, vehicle_type)
+DO UPDATE SET vehicle_count = rollup_network_day.vehicle_count + EXCLUDED.vehicle_count"""
+
+rebuild_days_sql = [
+    """
+    INSERT INTO rollup_station_day (station, day, vehicle_type, vehicle_count)
+    SELECT station, hour_start::date, vehicle_type, sum(vehicle_count) FROM rollup_station_hour GROUP BY 1, 2, 3
+    """,
+    """
+    INSERT INTO rollup_network_day (day, vehicle_type, vehicle_count)
+    SELECT day, vehicle_type, sum(vehicle_count) FROM rollup_station_day GROUP BY 1, 2
+    """,
+]
+hours_from_counts_sql = """
+INSERT INTO rollup_station_hour (station, hour_start, vehicle_type, vehicle_count, source_file)
+SELECT split_part(location, '_traffic_count_', 1), hour_start, vehicle_type, sum(vehicle_count), source_file
+FROM traffic_counts GROUP BY 1, 2, 3, 5"""
+
+def station_of(location: str) -> str:
+    """Station code of a count file's location, e.g. F00101 for F00101_traffic_count_2011"""
+    return location.split("_traffic_count_")[0]
+
+def _hour_rows(counts: pd.DataFrame) -> pd.DataFrame:
+    """(station, hour_start, vehicle_type, vehicle_count) from traffic_counts-shaped cells"""
+    hours = counts.groupby([counts["location"].map(station_of).rename("station"), "hour_start", "vehicle_type"],
+                           sort=True)["vehicle_count"].sum()
+    return hours.reset_index()
+
+def _hour_values(hours: pd.DataFrame, source_file: str) -> List[Tuple]:
+    return [(s, h.to_pydatetime(), t, int(n), source_file) for s, h, t, n in hours.itertuples(index=False)]
+
+def replace_file(conn, source_file: str, counts: Optional[pd.DataFrame]) -> int:
+    """
+    Swap one file's contribution to the rollup tables inside the caller's transaction.
+    counts are the file's non-zero cells (count_cells_to_frame); None just removes the old contribution.
+    Returns the number of hourly rows written.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (rollup_lock_key,))
+        cur.execute(remove_file_sql, (source_file,))
+        if cur.fetchone()[0]:
+            station = station_of(os.path.splitext(os.path.basename(source_file))[0])
+            for sql in delete_empty_sql:
+                cur.execute(sql, {"station": station})
+        if counts is None or len(counts) == 0:
+            return 0
+        hours = _hour_rows(counts)
+        # one statement, so the daily deltas are aggregated from every hourly row of the file
+        execute_values(cur, add_file_sql, _hour_values(hours, source_file), page_size=len(hours))
+        return len(hours)
+    finally:
+        cur.close()
+
+def rebuild(conn, source: str = "files") -> int:
+    """
+    Recompute all rollup tables in one transaction, from the batch files listed in load_manifest
+    (source "files") or from the traffic_counts table (source "counts"). Returns hourly rows written.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (rollup_lock_key,))
+        cur.execute("TRUNCATE rollup_station_hour, rollup_station_day, rollup_network_day")
+        if source == "counts":
+            cur.execute(hours_from_counts_sql)
+            written = cur.rowcount
+        else:
+            # imported here: load_batch imports this module
+            import load_batch
+            cur.execute("SELECT file_path FROM load_manifest ORDER BY file_path")
+            written = 0
+            for (file_path,) in cur.fetchall():
+                path = os.path.join(project_root, file_path)
+                if not os.path.exists(path):
+                    print(f"Skipping {file_path}: file not found")
+                    continue
+                counts = load_batch.read_file_counts(path)
+                if counts is None or len(counts) == 0:
+                    continue
+                hours = _hour_rows(counts)
+                execute_values(cur, insert_hour_sql, _hour_values(hours, file_path), page_size=2000)
+                written += len(hours)
+        for sql in rebuild_days_sql:
+            cur.execute(sql)
+        cur.execute("ANALYZE rollup_station_hour")
+        cur.execute("SELECT pg_notify(%s, %s)", (load_channel, "rollups"))
+        conn.commit()
+        return written
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the station/day rollup tables (e.g. after a backfill)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = sub.add_parser("rebuild", help="recompute all rollups")
+    rebuild_parser.add_argument("--from", dest="source", choices=rollup_sources, default="files",
+                                help="files: re-read the batch files in load_manifest (default); "
+                                     "counts: aggregate the traffic_counts table")
+    args = parser.parse_args(argv)
+
+    conn = get_connection()
+    try:
+        start = time.perf_counter()
+        written = rebuild(conn, args.source)
+        print(f"Rebuilt rollups from {args.source}: {written} station-hour rows in {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        print(f"Rebuild failed: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+import os
+import json
+import math
+import time
+import heapq
+import signal
+import asyncio
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from db import get_connection
+
+# distances are local (equirectangular) around the query point: well under 0.1% off within tens of km
+earth_radius_m = 6371008.8
+meters_per_degree = math.pi * earth_radius_m / 180
+
+# grid cells are cell_meters of latitude on each side (narrower in meters east-west, by cos(latitude));
+# about the radius of a typical query, so one lands in a 3x3 block of cells
+cell_meters = float(os.getenv("SPATIAL_CELL_METERS") or 250)
+# nearest() without max_meters only looks this far: a query far from every vehicle (or a glitch
+# position far from the rest) would otherwise search ring after ring of empty cells
+nearest_max_meters = float(os.getenv("SPATIAL_NEAREST_MAX_METERS") or 25000)
+# vehicles without a position newer than this many seconds are evicted
+max_age_seconds = float(os.getenv("SPATIAL_MAX_AGE") or 300)
+# new vehicles_realtime rows are read this often
+poll_interval = 1.0
+# a vehicle_id skipped by a poll may belong to a transaction that has not committed yet;
+# it is looked for again until this many seconds have passed
+gap_timeout = 30.0
+
+# the latest row of every vehicle seen in the last max_age seconds
+latest_positions_sql = """
+SELECT DISTINCT ON (vehicle_number) vehicle_id, vehicle_number, vehicle_type, latitude, longitude, speed, status, recorded_at
+FROM vehicles_realtime WHERE recorded_at >= %s
+ORDER BY vehicle_number, recorded_at DESC, vehicle_id DESC"""
+new_rows_sql = """
+SELECT vehicle_id, vehicle_number, vehicle_type, latitude, longitude, speed, status, recorded_at
+FROM vehicles_realtime WHERE vehicle_id > %s OR vehicle_id = ANY(%s) ORDER BY vehicle_id"""
+max_id_sql = "SELECT coalesce(max(vehicle_id), 0) FROM vehicles_realtime"
+
+class Position(NamedTuple):
+    vehicle_number: str
+    vehicle_type: Optional[str]
+    latitude: float
+    longitude: float
+    speed: Optional[float]
+    status: Optional[str]
+    recorded_at: float      # epoch seconds
+
+    def to_dict(self) -> dict:
+        d = self._asdict()
+        d["recorded_at"] = datetime.fromtimestamp(self.recorded_at).isoformat(timespec="milliseconds")
+        return d
+
+def position_from_row(row: Tuple) -> Position:
+    """Position of a (vehicle_id, vehicle_number, vehicle_type, latitude, longitude, speed, status, recorded_at) row"""
+    _, number, vehicle_type, lat, lon, speed, status, recorded_at = row
+    return Position(number, vehicle_type, lat, lon, speed, status, recorded_at.timestamp())
+
+class SpatialIndex:
+    """
+    Latest position of each vehicle in a uniform latitude/longitude grid of dicts.
+    Updates move a vehicle between two cells; radius, bounding box and nearest-k queries
+    only look at the cells that can hold a match. Not thread-safe: use it from one thread.
+    """
+
+    def __init__(self, cell_meters: float = cell_meters, max_age: float = max_age_seconds):
+        self.cell_degrees = cell_meters / meters_per_degree
+        self.max_age = max_age
+        self.positions: Dict[str, Position] = {}
+        self._cells: Dict[Tuple[int, int], Dict[str, Position]] = {}
+        self._cell_of: Dict[str, Tuple[int, int]] = {}
+        # (recorded_at, vehicle_number) of every update; entries replaced by a newer update are skipped on eviction
+        self._ages: List[Tuple[float, str]] = []
+        # [min i, max i, min j, max j] of the occupied cells; bounds the rings searched by nearest().
+        # Emptying a cell on an edge only marks it stale, it is recomputed by the next nearest()
+        self._bounds: Optional[List[int]] = None
+        self._bounds_stale = False
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def update(self, position: Position) -> bool:
+        """Store a position unless the vehicle already has a newer one; True when stored"""
+        number = position.vehicle_number
+        current = self.positions.get(number)
+        if current is not None and current.recorded_at > position.recorded_at:
+            return False
+        cell = self._cell(position.latitude, position.longitude)
+        old_cell = self._cell_of.get(number)
+        if old_cell != cell:
+            if old_cell is not None:
+                self._leave(old_cell, number)
+            self._cell_of[number] = cell
+            if self._bounds is None:
+                self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+            else:
+                b = self._bounds
+                b[0], b[1], b[2], b[3] = min(b[0], cell[0]), max(b[1], cell[0]), min(b[2], cell[1]), max(b[3], cell[1])
+        self._cells.setdefault(cell, {})[number] = position
+        self.positions[number] = position
+        if current is None or current.recorded_at != position.recorded_at:
+            heapq.heappush(self._ages, (position.recorded_at, number))
+        return True
+
+    def update_many(self, positions: Iterable[Position]) -> int:
+        return sum(self.update(p) for p in positions)
+
+    def remove(self, vehicle_number: str) -> bool:
+        if self.positions.pop(vehicle_number, None) is None:
+            return False
+        self._leave(self._cell_of.pop(vehicle_number), vehicle_number)
+        return True
+
+    def _leave(self, cell: Tuple[int, int], vehicle_number: str):
+        bucket = self._cells[cell]
+        del bucket[vehicle_number]
+        if not bucket:
+            del self._cells[cell]
+            b = self._bounds
+            if cell[0] in (b[0], b[1]) or cell[1] in (b[2], b[3]):
+                self._bounds_stale = True
+
+    def _refresh_bounds(self):
+        cells = self._cells
+        if not cells:
+            self._bounds = None
+        else:
+            rows = [i for i, _ in cells]
+            cols = [j for _, j in cells]
+            self._bounds = [min(rows), max(rows), min(cols), max(cols)]
+        self._bounds_stale = False
+
+    def evict(self, now: Optional[float] = None) -> int:
+        """Remove vehicles whose latest position is older than max_age; returns vehicles removed"""
+        cutoff = (time.time() if now is None else now) - self.max_age
+        ages = self._ages
+        removed = 0
+        while ages and ages[0][0] < cutoff:
+            recorded_at, number = heapq.heappop(ages)
+            current = self.positions.get(number)
+            if current is not None and current.recorded_at == recorded_at:
+                self.remove(number)
+                removed += 1
+        # drop the superseded entries once they outnumber the live ones
+        if len(ages) > 2 * len(self.positions) + 1024:
+            self._ages = [(p.recorded_at, n) for n, p in self.positions.items()]
+            heapq.heapify(self._ages)
+        return removed
+
+    def _scale(self, lat: float) -> Tuple[float, float]:
+        # meters per degree of latitude and of longitude around lat
+        return meters_per_degree, meters_per_degree * max(math.cos(math.radians(lat)), 1e-6)
+
+    def radius(self, lat: float, lon: float, meters: float, limit: Optional[int] = None) -> List[Tuple[float, Position]]:
+        """(distance in meters, position) of the vehicles within meters of (lat, lon), nearest first"""
+        my, mx = self._scale(lat)
+        dlat, dlon = meters / my, meters / mx
+        i0, j0 = self._cell(lat - dlat, lon - dlon)
+        i1, j1 = self._cell(lat + dlat, lon + dlon)
+        limit_sq = meters * meters
+        found = []
+        cells = self._cells
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                bucket = cells.get((i, j))
+                if bucket is None:
+                    continue
+                for p in bucket.values():
+                    dy = (p.latitude - lat) * my
+                    dx = (p.longitude - lon) * mx
+                    d = dx * dx + dy * dy
+                    if d <= limit_sq:
+                        found.append((d, p))
+        found.sort(key=lambda item: item[0])
+        if limit is not None:
+            found = found[:limit]
+        return [(math.sqrt(d), p) for d, p in found]
+
+    def bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[Position]:
+        """Positions inside the box (edges included)"""
+        i0, j0 = self._cell(min_lat, min_lon)
+        i1, j1 = self._cell(max_lat, max_lon)
+        found = []
+        cells = self._cells
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                bucket = cells.get((i, j))
+                if bucket is None:
+                    continue
+                if i0 < i < i1 and j0 < j < j1:
+                    found.extend(bucket.values())  # cells inside the box need no test
+                    continue
+                for p in bucket.values():
+                    if min_lat <= p.latitude <= max_lat and min_lon <= p.longitude <= max_lon:
+                        found.append(p)
+        return found
+
+    def nearest(self, lat: float, lon: float, k: int, max_meters: Optional[float] = None) -> List[Tuple[float, Position]]:
+        """
+        (distance in meters, position) of the k vehicles nearest to (lat, lon), nearest first.
+        Only vehicles within max_meters (default nearest_max_meters) are considered.
+        """
+        if self._bounds_stale:
+            self._refresh_bounds()
+        if k <= 0 or self._bounds is None:
+            return []
+        if max_meters is None:
+            max_meters = nearest_max_meters
+        my, mx = self._scale(lat)
+        # every cell outside ring r is at least r cell widths away (east-west is the narrower side)
+        ring_meters = self.cell_degrees * min(my, mx)
+        ci, cj = self._cell(lat, lon)
+        b = self._bounds
+        # rings before first_ring miss every occupied cell; rings after last_ring are beyond the
+        # occupied cells or beyond max_meters
+        first_ring = max(b[0] - ci, ci - b[1], b[2] - cj, cj - b[3], 0)
+        last_ring = min(max(ci - b[0], b[1] - ci, cj - b[2], b[3] - cj, 0), int(max_meters / ring_meters) + 1)
+        limit_sq = max_meters * max_meters
+        seen = 0
+        best: List[Tuple[float, str, Position]] = []   # max-heap of the k nearest by negated distance
+        cells = self._cells
+        for r in range(first_ring, last_ring + 1):
+            if r == 0:
+                ring = [(ci, cj)]
+            else:
+                ring = [(ci + di, cj + dj) for di in (-r, r) for dj in range(-r, r + 1)]
+                ring += [(ci + di, cj + dj) for dj in (-r, r) for di in range(-r + 1, r)]
+            for cell in ring:
+                bucket = cells.get(cell)
+                if bucket is None:
+                    continue
+                seen += len(bucket)
+                for p in bucket.values():
+                    dy = (p.latitude - lat) * my
+                    dx = (p.longitude - lon) * mx
+                    d = dx * dx + dy * dy
+                    if d > limit_sq:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, p.vehicle_number, p))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, p.vehicle_number, p))
+            # stop once no further cell can be closer, or every vehicle has been looked at
+            if len(best) == k and -best[0][0] <= (r * ring_meters) ** 2 or seen == len(self.positions):
+                break
+        return [(math.sqrt(-d), p) for d, _, p in sorted(best, reverse=True)]
+
+    def stats(self) -> dict:
+        return {"vehicles": len(self.positions), "cells": len(self._cells),
+                "cell_meters": round(self.cell_degrees * meters_per_degree, 1), "max_age_seconds": self.max_age}
+
+class RealtimeFeed:
+    """
+    Keeps a SpatialIndex current from vehicles_realtime: one bulk load of each vehicle's latest row,
+    then polls for rows with a higher vehicle_id. Ids a poll skipped are retried for gap_timeout seconds,
+    because a concurrent writer may commit its lower ids after a higher batch became visible.
+    """
+
+    def __init__(self, index: SpatialIndex, connect=get_connection):
+        self.index = index
+        self.connect = connect
+        self.conn = None
+        self.last_id = 0
+        self._gaps: Dict[int, float] = {}
+
+    def _cursor(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = self.connect()
+            self.conn.autocommit = True
+        return self.conn.cursor()
+
+    def load(self) -> int:
+        """Bulk load the latest position of every vehicle seen within max_age; returns vehicles loaded"""
+        with self._cursor() as cur:
+            # ids up to last_id are covered by the bulk read; later rows come from poll()
+            cur.execute(max_id_sql)
+            self.last_id = cur.fetchone()[0]
+            cur.execute(latest_positions_sql, (datetime.fromtimestamp(time.time() - self.index.max_age),))
+            rows = cur.fetchall()
+        return self.index.update_many(position_from_row(r) for r in rows)
+
+    def fetch(self) -> List[Tuple]:
+        """New rows since the last fetch; safe to run in a worker thread while the index is queried"""
+        now = time.time()
+        self._gaps = {i: seen for i, seen in self._gaps.items() if now - seen < gap_timeout}
+        try:
+            with self._cursor() as cur:
+                cur.execute(new_rows_sql, (self.last_id, list(self._gaps)))
+                rows = cur.fetchall()
+        except Exception:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+            raise
+        expected = self.last_id + 1
+        for row in rows:
+            vehicle_id = row[0]
+            if vehicle_id in self._gaps:
+                del self._gaps[vehicle_id]
+            elif vehicle_id > self.last_id:
+                for missing in range(expected, vehicle_id):
+                    self._gaps[missing] = now
+                expected = vehicle_id + 1
+                self.last_id = vehicle_id
+        return rows
+
+    def apply(self, rows: List[Tuple]) -> int:
+        return self.index.update_many(position_from_row(r) for r in rows)
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+
+def answer(index: SpatialIndex, request: dict) -> dict:
+    """Run one query request: {"op": "radius"|"bbox"|"nearest"|"stats", ...}"""
+    op = request.get("op")
+    start = time.perf_counter()
+    if op == "radius":
+        found = index.radius(float(request["lat"]), float(request["lon"]), float(request["meters"]), request.get("limit"))
+    elif op == "bbox":
+        found = index.bbox(float(request["min_lat"]), float(request["min_lon"]),
+                           float(request["max_lat"]), float(request["max_lon"]))
+    elif op == "nearest":
+        found = index.nearest(float(request["lat"]), float(request["lon"]), int(request.get("k", 10)),
+                              request.get("max_meters"))
+    elif op == "stats":
+        return index.stats()
+    else:
+        raise ValueError(f"unknown op {op!r}; use radius, bbox, nearest or stats")
+    elapsed = time.perf_counter() - start
+    if found and isinstance(found[0], tuple):
+        vehicles = [dict(p.to_dict(), distance_m=round(d, 1)) for d, p in found]
+    else:
+        vehicles = [p.to_dict() for p in found]
+    return {"count": len(vehicles), "query_ms": round(elapsed * 1000, 3), "vehicles": vehicles}
+
+async def serve(index: SpatialIndex, feed: RealtimeFeed, host: str, port: int, stopping: asyncio.Event):
+    """JSON-lines queries over TCP; the feed is polled in a worker thread and applied between requests"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    response = answer(index, json.loads(line))
+                except KeyError as e:
+                    response = {"error": f"missing field {e.args[0]}"}
+                except (ValueError, TypeError) as e:
+                    response = {"error": str(e)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Serving {len(index)} vehicle(s) on {host}:{port}")
+    async with server:
+        while not stopping.is_set():
+            try:
+                rows = await loop.run_in_executor(None, feed.fetch)
+                # applied on the event loop thread, so queries never see a half-applied update
+                feed.apply(rows)
+                index.evict()
+            except Exception as e:
+                print(f"Polling vehicles_realtime failed: {e}")
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+async def run_server(args: argparse.Namespace):
+    index = SpatialIndex(args.cell_meters, args.max_age)
+    feed = RealtimeFeed(index)
+    start = time.perf_counter()
+    loaded = feed.load()
+    print(f"Loaded {loaded} vehicle(s) from vehicles_realtime in {time.perf_counter() - start:.2f}s")
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await serve(index, feed, args.host, args.port, stopping)
+    finally:
+        feed.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the latest vehicle positions from vehicles_realtime")
+    parser.add_argument("--cell-meters", type=float, default=cell_meters, help=f"grid cell size (default {cell_meters:g})")
+    parser.add_argument("--max-age", type=float, default=max_age_seconds,
+                        help=f"seconds before a vehicle without new positions is dropped (default {max_age_seconds:g})")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="keep the index current and answer JSON-line queries over TCP")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=9903)
+    radius_parser = sub.add_parser("radius", help="vehicles within a distance of a point")
+    nearest_parser = sub.add_parser("nearest", help="the k vehicles nearest to a point")
+    for p in (radius_parser, nearest_parser):
+        p.add_argument("--lat", type=float, required=True)
+        p.add_argument("--lon", type=float, required=True)
+    radius_parser.add_argument("--meters", type=float, default=500)
+    nearest_parser.add_argument("-k", type=int, default=10)
+    nearest_parser.add_argument("--max-meters", type=float,
+                                help=f"only vehicles within this distance (default {nearest_max_meters:g})")
+    bbox_parser = sub.add_parser("bbox", help="vehicles inside a bounding box")
+    bbox_parser.add_argument("min_lat", type=float)
+    bbox_parser.add_argument("min_lon", type=float)
+    bbox_parser.add_argument("max_lat", type=float)
+    bbox_parser.add_argument("max_lon", type=float)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        asyncio.run(run_server(args))
+        return
+    # one-off query: load the index, answer, exit
+    index = SpatialIndex(args.cell_meters, args.max_age)
+    feed = RealtimeFeed(index)
+    try:
+        feed.load()
+    finally:
+        feed.close()
+    request = {k: v for k, v in vars(args).items() if k not in ("cell_meters", "max_age", "command")}
+    response = answer(index, dict(request, op=args.command))
+    for v in response["vehicles"]:
+        distance = f"{v['distance_m']:>8.1f} m  " if "distance_m" in v else ""
+        print(f"{distance}{v['vehicle_number']:<12} {v['vehicle_type'] or '-':<16} {v['latitude']:.6f} {v['longitude']:.6f} "
+              f"{v['speed'] if v['speed'] is not None else '-'} {v['status'] or '-'} {v['recorded_at']}")
+    print(f"{response['count']} vehicle(s) of {len(index)}; query {response['query_ms']} ms")
+
+if __name__ == "__main__":
+    main()
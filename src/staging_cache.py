@@ -0,0 +1,173 @@
+import os
+import sys
+import glob
+import hashlib
+import argparse
+from typing import Iterator, List, Optional
+
+import pandas as pd
+from dotenv import load_dotenv
+
+# pyarrow is optional: without it the cache is simply disabled
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+
+load_dotenv()
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+cache_dir = os.path.join(project_root, "data", "cache", "staging")
+max_cache_bytes = int(os.getenv("STAGING_CACHE_MAX_MB") or 2048) * 1024 * 1024
+
+# bump when the normalized output changes so stale entries are never served
+cache_version = 2
+
+columns = ["vehicle_number", "vehicle_type", "departure_time", "arrival_time", "origin", "destination", "station", "seq"]
+
+def available() -> bool:
+    return pa is not None
+
+def _schema():
+    return pa.schema([
+        ("vehicle_number", pa.string()),
+        ("vehicle_type", pa.string()),
+        ("departure_time", pa.timestamp("ns")),
+        ("arrival_time", pa.timestamp("ns")),
+        ("origin", pa.string()),
+        ("destination", pa.string()),
+        ("station", pa.string()),
+        ("seq", pa.int32()),
+    ])
+
+def _source_prefix(source_file: str) -> str:
+    # readable file stem plus a short digest of the full path, shared by every version of the file
+    stem = os.path.splitext(os.path.basename(source_file))[0]
+    digest = hashlib.sha1(source_file.encode("utf-8")).hexdigest()[:8]
+    return f"{stem}-{digest}"
+
+def cache_path(source_file: str, content_hash: str) -> str:
+    return os.path.join(cache_dir, f"{_source_prefix(source_file)}-{content_hash[:16]}-v{cache_version}.arrow")
+
+def read(source_file: str, content_hash: str, chunk_rows: Optional[int] = None) -> Optional[Iterator[pd.DataFrame]]:
+    """
+    Return normalized frames for a cached file, or None on a miss.
+    The Arrow file is memory-mapped; chunk_rows slices it so only one chunk is converted at a time.
+    """
+    if not available():
+        return None
+    path = cache_path(source_file, content_hash)
+    if not os.path.exists(path):
+        return None
+    os.utime(path)  # eviction is least-recently-used by mtime
+    return _iter_cached(path, chunk_rows)
+
+def _iter_cached(path: str, chunk_rows: Optional[int]) -> Iterator[pd.DataFrame]:
+    with pa.memory_map(path, "r") as source:
+        table = ipc.open_file(source).read_all()
+        step = chunk_rows or max(table.num_rows, 1)
+        for start in range(0, table.num_rows, step):
+            yield table.slice(start, step).to_pandas()
+
+class CacheWriter:
+    """Write a file's normalized frames to a temporary Arrow file; commit() publishes it"""
+
+    def __init__(self, source_file: str, content_hash: str):
+        self.source_file = source_file
+        self.path = cache_path(source_file, content_hash)
+        self.tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        os.makedirs(cache_dir, exist_ok=True)
+        self.schema = _schema()
+        self.sink = pa.OSFile(self.tmp_path, "wb")
+        self.writer = ipc.new_file(self.sink, self.schema)
+
+    def write(self, df: pd.DataFrame):
+        self.writer.write_table(pa.Table.from_pandas(df[columns], schema=self.schema, preserve_index=False))
+
+    def commit(self):
+        self.writer.close()
+        self.sink.close()
+        # drop entries for older contents of the same file before publishing the new one
+        for old in glob.glob(os.path.join(cache_dir, _source_prefix(self.source_file) + "-*.arrow")):
+            _remove(old)
+        os.replace(self.tmp_path, self.path)
+        evict()
+
+    def abort(self):
+        try:
+            self.writer.close()
+            self.sink.close()
+        finally:
+            _remove(self.tmp_path)
+
+def open_writer(source_file: str, content_hash: str) -> Optional[CacheWriter]:
+    return CacheWriter(source_file, content_hash) if available() else None
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass  # another worker got there first
+
+def _entries() -> List[str]:
+    return glob.glob(os.path.join(cache_dir, "*.arrow"))
+
+def evict(max_bytes: int = max_cache_bytes) -> int:
+    """Remove least-recently-used entries until the cache fits in max_bytes. Returns entries removed"""
+    entries = []
+    for path in _entries():
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+def clear(source_files: Optional[List[str]] = None) -> int:
+    """Invalidate every entry, or only the entries for the given source files. Returns entries removed"""
+    if source_files:
+        paths = []
+        for source_file in source_files:
+            paths += glob.glob(os.path.join(cache_dir, _source_prefix(source_file) + "-*.arrow"))
+    else:
+        paths = _entries()
+    for path in paths:
+        _remove(path)
+    return len(paths)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the staging cache of normalized batch files")
+    sub = parser.add_subparsers(dest="command", required=True)
+    clear_parser = sub.add_parser("clear", help="invalidate cached files (all, or the given source files)")
+    clear_parser.add_argument("files", nargs="*", help="source CSV paths relative to the project root, e.g. data/batch/ssrn/H0101_traffic_count_2011.csv")
+    evict_parser = sub.add_parser("evict", help="shrink the cache to a size limit")
+    evict_parser.add_argument("--max-mb", type=int, default=max_cache_bytes // (1024 * 1024))
+    sub.add_parser("info", help="show cache location and size")
+    args = parser.parse_args(argv)
+
+    if args.command == "clear":
+        files = [f.replace(os.sep, "/") for f in args.files]
+        print(f"Removed {clear(files)} cached file(s) from {cache_dir}")
+    elif args.command == "evict":
+        print(f"Evicted {evict(args.max_mb * 1024 * 1024)} cached file(s)")
+    else:
+        entries = _entries()
+        size = sum(os.path.getsize(p) for p in entries)
+        print(f"Cache directory: {cache_dir}")
+        print(f"Entries: {len(entries)}, size: {size / (1024 * 1024):.1f} MB, limit: {max_cache_bytes // (1024 * 1024)} MB")
+        if not available():
+            print("pyarrow is not installed; the cache is disabled.")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import shutil
+from datetime import datetime
+
+import pytest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+import catalog
+
+ssrn_dir = os.path.join(project_root, "data", "batch", "ssrn")
+sample_names = ["F00101_traffic_count_2011.csv", "F00101_traffic_count_2012.csv"]
+
+pytestmark = pytest.mark.skipif(not all(os.path.exists(os.path.join(ssrn_dir, n)) for n in sample_names),
+                                reason="sample SSRN files missing from data/batch/ssrn")
+
+@pytest.fixture
+def batch(tmp_path):
+    # a batch directory with two count files and one plain vehicle CSV one level down
+    root = tmp_path / "batch"
+    (root / "ssrn").mkdir(parents=True)
+    for name in sample_names:
+        shutil.copy(os.path.join(ssrn_dir, name), root / "ssrn" / name)
+    (root / "vehicles.csv").write_text(
+        "vehicle_number,vehicle_type,departure_time,arrival_time,origin,destination\n"
+        "BA1PA1234,Car,2020-03-01 08:00:00,2020-03-01 09:00:00,A,B\n"
+        "BA1PA1235,Bus,2020-03-04 10:00:00,2020-03-04 11:30:00,A,B\n")
+    return str(root), str(tmp_path / "catalog.json")
+
+def test_parse_name():
+    assert catalog.parse_name("data/batch/ssrn/NH02-006_traffic_count_2024.csv") == ("NH02-006", 2024)
+    assert catalog.parse_name("vehicles.csv") == (None, None)
+
+def test_refresh_indexes_files(batch):
+    root, path = batch
+    c = catalog.Catalog(path)
+    assert c.refresh(root) == (2, 3, 0)
+    entries = {os.path.basename(k): e for k, e in c.files.items()}
+    count = entries["F00101_traffic_count_2011.csv"]
+    assert (count.station, count.year) == ("F00101", 2011)
+    assert count.layout is not None and count.rows > 0
+    assert count.min_date <= count.max_date
+    vehicles = entries["vehicles.csv"]
+    assert (vehicles.station, vehicles.layout, vehicles.rows) == (None, None, 2)
+    assert (vehicles.min_date, vehicles.max_date) == ("2020-03-01", "2020-03-04")
+
+def test_refresh_is_incremental(batch):
+    root, path = batch
+    c = catalog.Catalog(path)
+    c.refresh(root)
+    c.save()
+    c = catalog.Catalog.load(path)
+    assert len(c.files) == 3
+    assert c.refresh(root) == (0, 0, 0)
+
+    # rewritten in place: the file is re-read, its directory is not listed
+    vehicles = os.path.join(root, "vehicles.csv")
+    with open(vehicles, "a") as fh:
+        fh.write("BA1PA1236,Car,2020-03-09 07:00:00,2020-03-09 08:00:00,A,B\n")
+    assert c.refresh(root) == (0, 1, 0)
+    assert c.files[catalog._key(vehicles)].max_date == "2020-03-09"
+
+    os.remove(os.path.join(root, "ssrn", sample_names[1]))
+    assert c.refresh(root) == (1, 0, 1)
+    assert len(c.files) == 2
+
+def test_select_filters(batch):
+    root, path = batch
+    c = catalog.Catalog(path)
+    c.refresh(root)
+    names = lambda selected: [os.path.basename(p) for p, _ in selected]
+    assert len(c.select(root)) == 3
+    assert names(c.select(root, stations=["f001*"])) == sample_names
+    assert names(c.select(root, stations=["F00101"], years=[2012])) == sample_names[1:]
+    assert names(c.select(root, stations=["NH*"])) == []
+    assert names(c.select(root, start=datetime(2020, 3, 4), end=datetime(2020, 3, 5))) == ["vehicles.csv"]
+    # the end is exclusive and the start day counts whole
+    assert names(c.select(root, start=datetime(2020, 3, 4, 23), end=datetime(2020, 3, 5))) == ["vehicles.csv"]
+    assert names(c.select(root, start=datetime(2020, 2, 1), end=datetime(2020, 3, 1))) == []
@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import asyncio
+from datetime import datetime
+
+import psycopg2
+import psycopg2.errors
+import pytest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+import realtime_ingest as ri
+
+received_at = datetime(2026, 10, 17, 8, 0).timestamp()
+
+def event(**fields) -> bytes:
+    base = {"vehicle_number": "RT000042", "latitude": 27.7172, "longitude": 85.324}
+    return json.dumps({**base, **fields}).encode()
+
+def test_parse_event_row():
+    row = ri.parse_event(event(vehicle_type="Car", speed=31.5, status=" moving ",
+                               recorded_at="2026-10-17T08:15:02.120"), received_at)
+    assert row == ("RT000042", "Car", 27.7172, 85.324, 31.5, "moving", datetime(2026, 10, 17, 8, 15, 2, 120000))
+
+def test_parse_event_defaults():
+    row = ri.parse_event(event(vehicle_type="", status=None), received_at)
+    assert row[1] is None and row[4] is None and row[5] is None
+    assert row[6] == datetime.fromtimestamp(received_at)
+
+@pytest.mark.parametrize("line, error", [
+    (b"not json", "not valid JSON"),
+    (b"[1, 2]", "not a JSON object"),
+    (event(vehicle_number=None), "missing vehicle_number"),
+    (event(vehicle_number="   "), "missing vehicle_number"),
+    (event(vehicle_number=42), "vehicle_number must be a string"),
+    (event(vehicle_number="RT\u000042"), "vehicle_number contains control characters"),
+    (event(status="moving\nstopped"), "status contains control characters"),
+    (event(vehicle_type="Car\x7f"), "vehicle_type contains control characters"),
+    (event(vehicle_number="R" * 21), "vehicle_number longer than 20 characters"),
+    (event(latitude=90.5), "latitude out of range"),
+    (event(longitude=-181), "longitude out of range"),
+    (event(latitude="27.7"), "latitude must be a number"),
+    (event(latitude=True), "latitude must be a number"),
+    (event(speed=-1), "speed out of range"),
+    (event(recorded_at="yesterday"), "recorded_at must be an ISO timestamp"),
+])
+def test_parse_event_rejects(line, error):
+    with pytest.raises(ri.InvalidEvent, match=error):
+        ri.parse_event(line, received_at)
+
+class StubCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def copy_expert(self, sql, payload):
+        self.conn.attempts += 1
+        lines = payload.getvalue().splitlines()
+        if self.conn.refuse:
+            self.conn.refuse -= 1
+            raise psycopg2.errors.DiskFull("could not extend file: No space left on device")
+        if any(line.startswith("BAD") for line in lines):
+            raise psycopg2.errors.StringDataRightTruncation("value too long for type character varying(20)")
+        self.conn.pending = [line.split("\t")[0] for line in lines]
+
+    def close(self):
+        pass
+
+class StubConnection:
+    """Accepts COPY payloads, refusing a row whose vehicle_number starts with BAD and the first `refuse` COPYs"""
+
+    def __init__(self, refuse: int = 0):
+        self.refuse = refuse
+        self.attempts = 0
+        self.written = []
+        self.pending = []
+        self.closed = 0
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def commit(self):
+        self.written += self.pending
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        # stays open: the service reconnects to this same stub, so the counters span reconnects
+        pass
+
+def flush(conn: StubConnection, numbers):
+    service = ri.IngestService(connect=lambda: conn)
+    # BAD rows pass validation; they stand for rows only the database refuses
+    rows = [ri.parse_event(event(vehicle_number=n), received_at) for n in numbers]
+    asyncio.run(service._flush(rows))
+    return service.stats
+
+def test_flush_isolates_bad_rows():
+    conn = StubConnection()
+    numbers = [f"RT{i:04d}" for i in range(1000)]
+    numbers[417] = "BAD0417"
+    stats = flush(conn, numbers)
+    assert stats.failed == 1
+    assert stats.written == 999
+    assert sorted(conn.written) == sorted(n for n in numbers if n != "BAD0417")
+    # bisecting isolates one row in about 2 * log2(1000) COPYs, not one per row
+    assert conn.attempts <= 25
+
+def test_flush_keeps_batch_while_database_refuses_writes(monkeypatch):
+    monkeypatch.setattr(ri, "retry_initial", 0.001)
+    monkeypatch.setattr(ri, "retry_max", 0.001)
+    conn = StubConnection(refuse=5)
+    numbers = [f"RT{i:04d}" for i in range(1000)]
+    stats = flush(conn, numbers)
+    assert stats.failed == 0
+    assert stats.flush_errors == 5
+    assert stats.written == 1000
+    # the whole batch is retried as one COPY, never bisected
+    assert conn.attempts == 6
+    assert sorted(conn.written) == numbers
+
+def test_is_data_error():
+    assert ri.is_data_error(psycopg2.errors.StringDataRightTruncation())
+    assert ri.is_data_error(psycopg2.errors.UniqueViolation())
+    assert not ri.is_data_error(psycopg2.errors.DiskFull())
+    assert not ri.is_data_error(psycopg2.errors.ReadOnlySqlTransaction())
+    assert not ri.is_data_error(psycopg2.errors.UndefinedTable())
+    assert not ri.is_data_error(psycopg2.errors.InsufficientPrivilege())
+    assert not ri.is_data_error(psycopg2.OperationalError("server closed the connection unexpectedly"))
@@ -0,0 +1,127 @@
+import os
+import sys
+import glob
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+import load_batch as lb
+
+ssrn_files = sorted(glob.glob(os.path.join(project_root, "data", "batch", "ssrn", "*.csv")))
+
+vehicle_columns = ["vehicle_number", "vehicle_type", "departure_time", "arrival_time", "origin", "destination"]
+time_columns = ["departure_time", "arrival_time"]
+
+# Reference: transform_traffic_count_to_vehicles and normalize_dataframe as they were before the
+# numpy expansion, one dict per vehicle. Kept verbatim so the vectorized code has a fixed oracle.
+def reference_transform(df: pd.DataFrame, filepath: str) -> pd.DataFrame:
+    data_start_idx = 0
+    for i, row in df.iterrows():
+        first_col = str(df.iloc[i, 0]) if not pd.isna(df.iloc[i, 0]) else ""
+        if first_col.startswith('2011') or first_col.startswith('2012') or first_col.startswith('2013') or first_col.startswith('2014') or first_col.startswith('2015') or first_col.startswith('2016') or first_col.startswith('2018') or first_col.startswith('2020') or first_col.startswith('2021') or first_col.startswith('2022') or first_col.startswith('2024'):
+            data_start_idx = i
+            break
+
+    data_df = df.iloc[data_start_idx:].copy()
+    data_df = data_df.reset_index(drop=True)
+    data_df = data_df[~data_df.iloc[:, 0].astype(str).str.contains(
+        'Sub-total|Total|Average|Composition|Grand Total', case=False, na=False)]
+
+    vehicles = []
+    location = os.path.basename(filepath).replace('.csv', '')
+
+    for _, row in data_df.iterrows():
+        try:
+            date_str = str(row.iloc[0])
+            time_str = str(row.iloc[1]) if len(row) > 1 else "00:00:00"
+            if not date_str.startswith('20'):
+                continue
+            try:
+                base_datetime = pd.to_datetime(f"{date_str} {time_str}")
+            except:
+                continue
+            counts_data = row.iloc[2:].tolist()
+            for vehicle_type, col_idx in lb.VEHICLE_TYPES:
+                if col_idx < len(counts_data):
+                    try:
+                        count = int(float(counts_data[col_idx])) if pd.notna(counts_data[col_idx]) and str(counts_data[col_idx]).strip() != '' else 0
+                    except (ValueError, TypeError):
+                        count = 0
+                    for i in range(count):
+                        date_short = date_str.replace('-', '')[-6:]
+                        time_short = time_str.replace(':', '')[:4]
+                        vehicle_number = f"{vehicle_type[:3].upper()}{date_short}{time_short}{i%1000:03d}"
+                        departure_time = base_datetime + timedelta(minutes=i * 2 + (i % 5) * 10)
+                        arrival_time = departure_time + timedelta(hours=1, minutes=30 + (i % 4) * 15)
+                        if 'Bus' in vehicle_type:
+                            origin = f"{location}_Bus_Station"
+                            destination = "City_Center"
+                        elif 'Truck' in vehicle_type:
+                            origin = f"{location}_Industrial_Area"
+                            destination = "Commercial_District"
+                        else:
+                            origin = f"{location}_Entry_Point"
+                            destination = "Various_Destinations"
+                        vehicles.append({
+                            'vehicle_number': vehicle_number,
+                            'vehicle_type': vehicle_type.replace('_', ' '),
+                            'departure_time': departure_time.strftime('%Y-%m-%d %H:%M:%S'),
+                            'arrival_time': arrival_time.strftime('%Y-%m-%d %H:%M:%S'),
+                            'origin': origin,
+                            'destination': destination
+                        })
+        except Exception as e:
+            print(f"Error processing row in traffic count transformation: {e}")
+            continue
+
+    return pd.DataFrame(vehicles, columns=vehicle_columns)
+
+def reference_normalize(df: pd.DataFrame) -> pd.DataFrame:
+    for c in ["vehicle_number", "vehicle_type", "origin", "destination"]:
+        df[c] = df[c].astype("string").str.strip()
+    df["departure_time"] = pd.to_datetime(df["departure_time"], errors="coerce", utc=False)
+    df["arrival_time"] = pd.to_datetime(df["arrival_time"], errors="coerce", utc=False)
+    df = df[df["vehicle_number"].notna() & (df["vehicle_number"].str.len() > 0)]
+    return df.reset_index(drop=True)
+
+def as_text(df: pd.DataFrame) -> pd.DataFrame:
+    # departure/arrival in the reference's '%Y-%m-%d %H:%M:%S' text
+    df = df[vehicle_columns].copy()
+    for c in time_columns:
+        df[c] = df[c].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return df.astype(object)
+
+@pytest.fixture(scope="module", params=ssrn_files, ids=os.path.basename)
+def ssrn_file(request):
+    filepath = request.param
+    raw = pd.read_csv(filepath, dtype=str)
+    return filepath, raw, reference_transform(raw.copy(), filepath)
+
+pytestmark = pytest.mark.skipif(not ssrn_files, reason="no SSRN files in data/batch/ssrn")
+
+def test_transform_matches_reference(ssrn_file):
+    filepath, raw, expected = ssrn_file
+    vehicles = lb.transform_traffic_count_to_vehicles(raw.copy(), filepath)
+    # the one intended difference: departure/arrival are datetime64, not '%Y-%m-%d %H:%M:%S' text
+    for c in time_columns:
+        assert pd.api.types.is_datetime64_dtype(vehicles[c])
+    pd.testing.assert_frame_equal(as_text(vehicles), expected.astype(object))
+
+def test_normalize_matches_reference(ssrn_file):
+    filepath, raw, expected = ssrn_file
+    df = lb.normalize_dataframe(raw.copy(), filepath)
+    pd.testing.assert_frame_equal(df[vehicle_columns], reference_normalize(expected.copy()), check_dtype=False)
+
+def test_layout_reader_matches_reference(ssrn_file):
+    # the loader's path: cached header layout, column-pruned read, int32 counts
+    filepath, _, expected = ssrn_file
+    layout = lb.detect_layout(filepath)
+    assert layout is not None
+    frames = [lb.expand_count_cells(lb.parse_layout_cells(frame, layout, filepath))
+              for frame in lb.read_count_frames(filepath, layout)]
+    vehicles = pd.concat(frames, ignore_index=True)
+    pd.testing.assert_frame_equal(as_text(vehicles), expected.astype(object))